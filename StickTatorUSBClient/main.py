@@ -1,10 +1,20 @@
 import asyncio
+import codecs
+import collections
+import hashlib
 import json
 import logging
 import os
 import platform
+import random
+import resource
+import shutil
 import signal
 import ssl
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
 from pathlib import Path
 
 import websockets
@@ -13,6 +23,157 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+class OutputBatcher:
+    """Coalesces output into chunks flushed by size or after a short delay"""
+
+    def __init__(self, send, max_bytes: int, flush_interval: float):
+        self._send = send
+        self._max_bytes = max_bytes
+        self._flush_interval = flush_interval
+        self._parts = []
+        self._size = 0
+        self._seq = 0
+        self._timer = None
+        self._lock = asyncio.Lock()
+
+    async def add(self, text: str):
+        self._parts.append(text)
+        self._size += len(text.encode())
+
+        if self._size >= self._max_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self._flush_interval)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+            self._timer = None
+
+        # The lock keeps chunks going out in sequence order
+        async with self._lock:
+            if not self._parts:
+                return
+            output = "\n".join(self._parts)
+            self._parts = []
+            self._size = 0
+            seq = self._seq
+            self._seq += 1
+            await self._send(output, seq)
+
+
+class OutputStore:
+    """Keeps the tail of a command's output in memory and spills the full
+    output to disk, up to a size cap"""
+
+    def __init__(self, directory: Path, tail_bytes: int, max_bytes: int):
+        self.output_id = uuid.uuid4().hex
+        self.path = directory / f"{self.output_id}.log"
+        self._file = open(self.path, "wb")
+        self._tail = collections.deque()
+        self._tail_size = 0
+        self._tail_bytes = tail_bytes
+        self._max_bytes = max_bytes
+        self._digest = hashlib.sha256()
+        self.bytes = 0
+        self.lines = 0
+        self.truncated = False
+
+    def add(self, line: str):
+        data = (line + "\n").encode()
+        self.bytes += len(data)
+        self.lines += 1
+        self._digest.update(data)
+
+        room = self._max_bytes - self._file.tell()
+        if len(data) > room:
+            self.truncated = True
+        if room > 0:
+            self._file.write(data[:room])
+
+        self._tail.append(line)
+        self._tail_size += len(data)
+        while self._tail_size > self._tail_bytes and len(self._tail) > 1:
+            self._tail_size -= len(self._tail.popleft().encode()) + 1
+
+    def tail(self) -> str:
+        return "\n".join(self._tail)[-self._tail_bytes :]
+
+    def close(self):
+        self._file.close()
+
+    def summary(self) -> dict:
+        return {
+            "output_id": self.output_id,
+            "bytes": self.bytes,
+            "lines": self.lines,
+            "sha256": self._digest.hexdigest(),
+            "truncated": self.truncated,
+        }
+
+
+class PlanRun:
+    """Deadline, resource limits and cancellation state of one execute request"""
+
+    def __init__(
+        self,
+        plan_id: str,
+        completed_commands=(),
+        timeout: float = None,
+        command_timeout: float = None,
+        limits: dict = None,
+        request_id: str = None,
+    ):
+        self.plan_id = plan_id
+        self.request_id = request_id
+        self.completed_commands = frozenset(completed_commands)
+        self.timeout = timeout
+        self.deadline = None
+        self.command_timeout = command_timeout
+        self.limits = limits or {}
+        self.cancelled = asyncio.Event()
+
+    def start(self):
+        # The plan timeout counts from when a worker picks the plan up, not
+        # from when it was queued
+        if self.timeout:
+            self.deadline = time.monotonic() + self.timeout
+
+    @property
+    def stop_reason(self):
+        if self.cancelled.is_set():
+            return "cancelled"
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return "timeout"
+        return None
+
+    def timeout_for(self, cmd):
+        timeout = cmd.get("timeout") or self.command_timeout
+        if self.deadline is not None:
+            remaining = max(self.deadline - time.monotonic(), 0)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return timeout
+
+
+class CurrentConnection:
+    """Sends through whichever socket the client has open at send time, so a
+    job that outlives a reconnect reports over the new connection"""
+
+    def __init__(self, client):
+        self._client = client
+
+    async def send(self, message: str):
+        websocket = self._client._current_websocket
+        if websocket is None or not self._client._connection_active:
+            raise ConnectionError("Not connected to the server")
+        await websocket.send(message)
+
+
 class WSClient:
     def __init__(self):
         print("Initializing WSClient...")
@@ -26,8 +187,68 @@ class WSClient:
         print(f"Client ID: {self.client_id}")
         self.computer_name = platform.node()
         print(f"Computer name: {self.computer_name}")
-        self.max_retries = 5
-        self.retry_delay = 5
+        self.heartbeat_interval = float(os.getenv("HEARTBEAT_INTERVAL", 15))
+        # Reconnects back off exponentially up to the cap and never give up
+        self.retry_delay = float(os.getenv("RECONNECT_BASE_DELAY", 5))
+        self.max_retry_delay = float(os.getenv("RECONNECT_MAX_DELAY", 300))
+        self._connections = 0
+        # Outgoing messages are numbered and kept until the server confirms
+        # them, so whatever it missed while the connection was down is
+        # replayed once it reports the last number it saw for this token
+        self.resume_token = uuid.uuid4().hex
+        self._out_seq = 0
+        self._replay_buffer = collections.deque()
+        self._replay_bytes = 0
+        self.replay_buffer_bytes = int(
+            os.getenv("REPLAY_BUFFER_BYTES", 4 * 1024 * 1024)
+        )
+        self._resumed = asyncio.Event()
+        # Without a resume from the server (an older backend, or one that
+        # dropped it) output goes out anyway once this runs out
+        self.resume_timeout = float(os.getenv("RESUME_TIMEOUT", 10))
+        self.output_flush_bytes = int(os.getenv("OUTPUT_FLUSH_BYTES", 64 * 1024))
+        self.output_flush_interval = float(os.getenv("OUTPUT_FLUSH_INTERVAL", 0.05))
+        self.read_chunk_size = 64 * 1024
+        self.max_parallel_categories = int(os.getenv("MAX_PARALLEL_CATEGORIES", 4))
+        # Tags let the server target groups of machines in fleet runs
+        self.tags = [
+            tag.strip()
+            for tag in os.getenv("MACHINE_TAGS", "").split(",")
+            if tag.strip()
+        ]
+        # Full command output is kept on disk and fetched by the server on
+        # demand; only a short tail travels with the completion messages
+        self.output_dir = Path(
+            os.getenv("OUTPUT_DIR", Path(tempfile.gettempdir()) / "sticktator-output")
+        )
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.output_tail_bytes = int(os.getenv("OUTPUT_TAIL_BYTES", 16 * 1024))
+        self.output_max_bytes = int(os.getenv("OUTPUT_MAX_BYTES", 10 * 1024 * 1024))
+        self.output_retain_count = int(os.getenv("OUTPUT_RETAIN_COUNT", 50))
+        self.output_fetch_max_bytes = 1024 * 1024
+        # Defaults for execute requests that don't set their own; 0 means none
+        self.command_timeout = float(os.getenv("COMMAND_TIMEOUT_SECONDS", 0)) or None
+        self.command_limits = {
+            "cpu_seconds": int(os.getenv("COMMAND_CPU_LIMIT_SECONDS", 0)) or None,
+            "memory_mb": int(os.getenv("COMMAND_MEMORY_LIMIT_MB", 0)) or None,
+        }
+        self._plan_runs = {}
+        # Executions run on a fixed pool of workers fed by a bounded queue, so
+        # the receive loop never waits for a plan to finish. One worker keeps
+        # plans in arrival order and out of each other's way (e.g. two apt runs
+        # fighting over the dpkg lock); raise it to run plans side by side
+        self.max_concurrent_plans = int(os.getenv("MAX_CONCURRENT_PLANS", 1))
+        self._jobs = asyncio.Queue(maxsize=int(os.getenv("JOB_QUEUE_SIZE", 100)))
+        self._connection = CurrentConnection(self)
+        # Server messages are numbered per connection; duplicates are acked
+        # but not acted on
+        self._stream_id = None
+        self._last_msg_id = 0
+        # Results of recently finished plans, so a plan delivered again after
+        # a reconnect is answered instead of re-run
+        self.plan_dedup_size = int(os.getenv("PLAN_DEDUP_SIZE", 1000))
+        self._executed_plans_file = self.output_dir / "executed_plans.json"
+        self._executed_plans = self._load_executed_plans()
         self.shutdown_event = asyncio.Event()
         self._current_websocket = None
         self._connection_active = False
@@ -54,6 +275,8 @@ class WSClient:
         status: int = None,
         success: bool = None,
         error: str = None,
+        seq: int = None,
+        **fields,
     ):
         """Helper function to send formatted output messages"""
         message = {
@@ -71,10 +294,25 @@ class WSClient:
             message["success"] = success
         if error is not None:
             message["error"] = error
+        if seq is not None:
+            message["seq"] = seq
+        message.update(
+            {key: value for key, value in fields.items() if value is not None}
+        )
+        self._out_seq += 1
+        message["out_seq"] = self._out_seq
+        self._buffer_for_replay(message)
+
+        if not self._resumed.is_set():
+            print(f"Buffered {output_type} message until the server resumes")
+            return
 
         try:
             await websocket.send(json.dumps(message))
-            print(f"Sent {output_type} message: {message}")
+            print(
+                f"Sent {output_type} message for '{command}'"
+                f" ({len(output or '')} bytes of output)"
+            )
         except Exception as e:
             self.logger.error(f"Error sending {output_type} message: {e}")
 
@@ -98,6 +336,9 @@ class WSClient:
             )
             self._current_websocket = websocket
             self._connection_active = True
+            self._connections += 1
+            # Hold new output back until buffered output has been replayed
+            self._resumed.clear()
             print(f"Connected as {self.client_id} from {self.computer_name}")
 
             await websocket.send(
@@ -106,27 +347,37 @@ class WSClient:
                         "type": "device_connected",
                         "email": self.owner_email,
                         "machine_name": self.computer_name,
+                        "tags": self.tags,
+                        "resume_token": self.resume_token,
                     }
                 )
             )
 
-            while not self.shutdown_event.is_set():
-                try:
-                    message = await asyncio.wait_for(websocket.recv(), timeout=1.0)
-                    print(f"Received message: {message}")
-                    await self.handle_message(websocket, message)
-                except asyncio.TimeoutError:
-                    continue
-                except websockets.exceptions.ConnectionClosed:
-                    print("Connection closed")
-                    self._connection_active = False
-                    return False
-                except Exception as e:
-                    print(f"Error in message loop: {e}")
-                    self._connection_active = False
-                    return False
+            # Application-level heartbeats let the server spot a dead machine
+            # even when the socket itself has not noticed yet
+            heartbeat = asyncio.create_task(self._send_heartbeats(websocket))
+            resume_timeout = asyncio.create_task(self._resume_after_timeout(websocket))
+            try:
+                while not self.shutdown_event.is_set():
+                    try:
+                        message = await asyncio.wait_for(websocket.recv(), timeout=1.0)
+                        print(f"Received message ({len(message)} bytes)")
+                        await self.handle_message(websocket, message)
+                    except asyncio.TimeoutError:
+                        continue
+                    except websockets.exceptions.ConnectionClosed:
+                        print("Connection closed")
+                        self._connection_active = False
+                        return False
+                    except Exception as e:
+                        print(f"Error in message loop: {e}")
+                        self._connection_active = False
+                        return False
 
-            return True
+                return True
+            finally:
+                heartbeat.cancel()
+                resume_timeout.cancel()
 
         except (websockets.exceptions.WebSocketException, ssl.SSLError) as e:
             print(f"Connection error: {e}")
@@ -137,6 +388,26 @@ class WSClient:
             self._connection_active = False
             return False
 
+    async def _send_heartbeats(self, websocket):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await websocket.send(json.dumps({"type": "heartbeat"}))
+            except Exception as e:
+                self.logger.error(f"Error sending heartbeat: {e}")
+                return
+
+    async def _resume_after_timeout(self, websocket):
+        try:
+            await asyncio.wait_for(self._resumed.wait(), self.resume_timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning("No resume from the server, sending buffered output")
+            try:
+                # The server drops anything it already has by out_seq
+                await self._replay(websocket, 0)
+            except Exception as e:
+                self.logger.error(f"Error replaying buffered output: {e}")
+
     async def shutdown(self):
         print("Initiating shutdown...")
         self.shutdown_event.set()
@@ -173,121 +444,504 @@ class WSClient:
             except Exception as e:
                 print(f"Error sending disconnect message: {e}")
 
+    async def _pump_stream(self, stream, name: str, queue: asyncio.Queue):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            chunk = await stream.read(self.read_chunk_size)
+            if not chunk:
+                break
+            text = decoder.decode(chunk)
+            if text:
+                await queue.put((name, text))
+
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            await queue.put((name, tail))
+        await queue.put((name, None))
+
+    async def _read_process_output(self, process, on_line):
+        """Reads stdout and stderr concurrently so neither pipe can fill up and
+        stall the process, and reports complete lines in arrival order"""
+        queue = asyncio.Queue(maxsize=64)
+        pumps = [
+            asyncio.create_task(self._pump_stream(process.stdout, "stdout", queue)),
+            asyncio.create_task(self._pump_stream(process.stderr, "stderr", queue)),
+        ]
+        partial = {"stdout": "", "stderr": ""}
+        open_streams = len(pumps)
+
+        async def emit(name, line):
+            line = line.strip()
+            if line:
+                await on_line(f"ERROR: {line}" if name == "stderr" else line)
+
+        try:
+            while open_streams:
+                if self.shutdown_event.is_set():
+                    process.terminate()
+                    break
+
+                try:
+                    name, text = await asyncio.wait_for(queue.get(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    continue
+
+                if text is None:
+                    open_streams -= 1
+                    await emit(name, partial[name])
+                    partial[name] = ""
+                    continue
+
+                *lines, partial[name] = (partial[name] + text).split("\n")
+                for line in lines:
+                    await emit(name, line)
+                # Don't let output without newlines grow the buffer without bound
+                if len(partial[name]) >= self.read_chunk_size:
+                    await emit(name, partial[name])
+                    partial[name] = ""
+        finally:
+            for pump in pumps:
+                pump.cancel()
+
+    def _schedule_categories(self, categories):
+        """Maps each category index to the indexes it must wait for. Categories
+        wait for every category with a lower order unless they declare their
+        own depends_on list of category ids"""
+        index_by_id = {
+            category.get("id"): i
+            for i, category in enumerate(categories)
+            if category.get("id")
+        }
+        dependencies = {}
+        for i, category in enumerate(categories):
+            if "depends_on" in category:
+                dependencies[i] = [
+                    index_by_id[category_id]
+                    for category_id in category.get("depends_on") or []
+                    if category_id in index_by_id and index_by_id[category_id] != i
+                ]
+            else:
+                order = category.get("order", i + 1)
+                dependencies[i] = [
+                    j
+                    for j, other in enumerate(categories)
+                    if other.get("order", j + 1) < order
+                ]
+
+        # Reject cycles, which would otherwise wait forever
+        remaining = {i: set(deps) for i, deps in dependencies.items()}
+        while remaining:
+            ready = [i for i, deps in remaining.items() if not deps]
+            if not ready:
+                self.logger.warning(
+                    "Cyclic category dependencies, running categories in sequence"
+                )
+                return {i: list(range(i)) for i in range(len(categories))}
+            for i in ready:
+                del remaining[i]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+        return dependencies
+
+    async def _run_plan(self, websocket, execution_plan, plan_run: PlanRun):
+        categories = execution_plan.get("categories", [])
+        dependencies = self._schedule_categories(categories)
+        semaphore = asyncio.Semaphore(self.max_parallel_categories)
+        tasks = {}
+
+        async def run(i):
+            needed = await asyncio.gather(
+                *(tasks[j] for j in dependencies[i]), return_exceptions=True
+            )
+            if self.shutdown_event.is_set() or plan_run.stop_reason:
+                return False
+            # A category only runs once everything it depends on succeeded
+            if not all(result is True for result in needed):
+                await self._skip_category(websocket, categories[i], plan_run)
+                return False
+            async with semaphore:
+                return await self._run_category(websocket, categories[i], plan_run)
+
+        # Every task is registered before any of them starts running
+        for i in range(len(categories)):
+            tasks[i] = asyncio.create_task(run(i))
+
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        return all(result is True for result in results)
+
+    async def _skip_category(self, websocket, category, plan_run: PlanRun):
+        print(f"Skipping category {category.get('id')}: a dependency failed")
+        await self.send_output(
+            websocket,
+            "command_complete",
+            " && ".join(
+                cmd["command"]
+                for cmd in category.get("commands", [])
+                if cmd.get("command")
+            ),
+            output="",
+            bytes_out=0,
+            outputs=[],
+            status=-1,
+            success=False,
+            category_id=category.get("id"),
+            plan_id=plan_run.plan_id,
+            stop_reason="dependency_failed",
+        )
+
+    async def _run_category(self, websocket, category, plan_run: PlanRun) -> bool:
+        commands = sorted(
+            (cmd for cmd in category.get("commands", []) if cmd.get("command")),
+            key=lambda cmd: cmd.get("order", 0),
+        )
+        if not commands:
+            return True
+
+        combined_cmd = " && ".join(cmd["command"] for cmd in commands)
+        print(f"Executing category {category.get('id')}: {combined_cmd}")
+
+        # Each command runs in its own process so it gets its own exit code and
+        # timings. The shell state a command leaves behind (working directory,
+        # exported environment, set options and umask) is carried over to the
+        # next one, so `cd`, `export`, `source venv/bin/activate` and `set -e`
+        # still apply to the commands after them, as they did when the
+        # commands were joined with &&
+        state_dir = tempfile.mkdtemp(prefix="sticktator-shell-")
+        shell = {"cwd": None, "env": None, "flags": "", "umask": None}
+        records = []
+
+        try:
+            for cmd in commands:
+                if self.shutdown_event.is_set() or plan_run.stop_reason:
+                    break
+                if cmd.get("id") and cmd["id"] in plan_run.completed_commands:
+                    print(f"Skipping already completed command {cmd['id']}")
+                    continue
+
+                record = await self._run_command(
+                    websocket, category, cmd, shell, state_dir, plan_run
+                )
+                records.append(record)
+                shell = self._read_shell_state(state_dir, shell)
+
+                if record["exit_code"] != 0:
+                    break
+        except Exception as e:
+            self.logger.error(f"Error executing command: {e}")
+            await self.send_output(
+                websocket,
+                "command_error",
+                combined_cmd,
+                error=str(e),
+                category_id=category.get("id"),
+                plan_id=plan_run.plan_id,
+            )
+            return False
+        finally:
+            shutil.rmtree(state_dir, ignore_errors=True)
+
+        returncode = records[-1]["exit_code"] if records else 0
+        stop_reason = plan_run.stop_reason or (
+            records[-1]["stop_reason"] if records else None
+        )
+        if stop_reason and returncode == 0:
+            returncode = -1
+        tail = "\n".join(record["output"] for record in records if record["output"])
+        await self.send_output(
+            websocket,
+            "command_complete",
+            combined_cmd,
+            output=tail[-self.output_tail_bytes :],
+            bytes_out=sum(record["bytes_out"] for record in records),
+            outputs=[
+                {"command_id": record["command_id"], **record["output_summary"]}
+                for record in records
+            ],
+            status=returncode,
+            success=returncode == 0,
+            category_id=category.get("id"),
+            plan_id=plan_run.plan_id,
+            stop_reason=stop_reason,
+        )
+        return returncode == 0
+
+    @staticmethod
+    def _shell_script(command, shell, state_dir):
+        restore = ""
+        if shell["umask"]:
+            restore += f"umask {shell['umask']}\n"
+        if shell["flags"]:
+            restore += f"set -{shell['flags']}\n"
+        # The state is saved with stderr silenced so `set -x` doesn't trace it
+        return (
+            f"{restore}{command}\n"
+            "{ __status=$?; __flags=$-; set +x; } 2>/dev/null\n"
+            f'pwd > "{state_dir}/cwd"\n'
+            f'env -0 > "{state_dir}/env"\n'
+            f'echo "$__flags" > "{state_dir}/flags"\n'
+            f'umask > "{state_dir}/umask"\n'
+            "exit $__status"
+        )
+
+    @staticmethod
+    def _read_shell_state(state_dir, shell):
+        """Reads what the last command saved; a command that ended the shell
+        early (e.g. with `exit`) leaves the previous state in place"""
+        state_dir = Path(state_dir)
+        try:
+            env = (state_dir / "env").read_bytes()
+            saved = {
+                "cwd": (state_dir / "cwd").read_text().strip() or shell["cwd"],
+                "env": dict(
+                    os.fsdecode(entry).partition("=")[::2]
+                    for entry in env.split(b"\0")
+                    if b"=" in entry
+                ),
+                # Only options that are safe to set again in a fresh shell
+                "flags": "".join(
+                    flag
+                    for flag in (state_dir / "flags").read_text().strip()
+                    if flag in "aefuvxC"
+                ),
+                "umask": (state_dir / "umask").read_text().strip() or None,
+            }
+        except FileNotFoundError:
+            return shell
+        finally:
+            for name in ("cwd", "env", "flags", "umask"):
+                (state_dir / name).unlink(missing_ok=True)
+        return saved
+
+    async def _run_command(self, websocket, category, cmd, shell, state_dir, plan_run):
+        command = cmd["command"]
+        started_at = datetime.now(timezone.utc)
+        started = time.perf_counter()
+
+        process = await asyncio.create_subprocess_shell(
+            self._shell_script(command, shell, state_dir),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=shell["cwd"],
+            env=shell["env"],
+            # Own process group, so a timeout or cancel also stops its children
+            start_new_session=True,
+            preexec_fn=self._resource_limiter(plan_run.limits),
+        )
+
+        store = self._create_output_store()
+
+        async def send_chunk(output, seq):
+            await self.send_output(
+                websocket,
+                "command_output",
+                command,
+                output=output,
+                seq=seq,
+                category_id=category.get("id"),
+                command_id=cmd.get("id"),
+            )
+
+        batcher = OutputBatcher(
+            send_chunk, self.output_flush_bytes, self.output_flush_interval
+        )
+
+        async def on_line(line):
+            store.add(line)
+            await batcher.add(line)
+
+        stop_reason = None
+        reader = asyncio.create_task(self._read_process_output(process, on_line))
+        cancelled = asyncio.create_task(plan_run.cancelled.wait())
+        try:
+            done, _ = await asyncio.wait(
+                {reader, cancelled},
+                timeout=plan_run.timeout_for(cmd),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        except asyncio.CancelledError:
+            # The worker is being torn down; don't leave the command running
+            reader.cancel()
+            await self._stop_process(process)
+            raise
+        finally:
+            cancelled.cancel()
+
+        if reader not in done:
+            stop_reason = "cancelled" if plan_run.cancelled.is_set() else "timeout"
+            self.logger.warning(f"Stopping '{command}': {stop_reason}")
+            await self._stop_process(process)
+
+        try:
+            # Pipes close once the process group is gone
+            await asyncio.wait_for(reader, timeout=5.0)
+        except Exception as e:
+            self.logger.error(f"Error reading process output: {e!r}")
+
+        try:
+            returncode = await asyncio.wait_for(process.wait(), timeout=5.0)
+        except asyncio.TimeoutError:
+            self.logger.warning("Process took too long to complete, terminating...")
+            await self._stop_process(process)
+            returncode = -1
+
+        await batcher.flush()
+        store.close()
+        summary = store.summary()
+
+        record = {
+            "category_id": category.get("id"),
+            "command_id": cmd.get("id"),
+            "started_at": started_at.isoformat(),
+            "ended_at": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round((time.perf_counter() - started) * 1000),
+            "exit_code": returncode,
+            "bytes_out": summary["bytes"],
+            "output": store.tail(),
+            "output_summary": summary,
+            "stop_reason": stop_reason,
+        }
+        await self.send_output(
+            websocket,
+            "command_result",
+            command,
+            output=record["output"],
+            status=returncode,
+            success=returncode == 0,
+            category_id=record["category_id"],
+            command_id=record["command_id"],
+            started_at=record["started_at"],
+            ended_at=record["ended_at"],
+            duration_ms=record["duration_ms"],
+            bytes_out=record["bytes_out"],
+            output_id=summary["output_id"],
+            output_sha256=summary["sha256"],
+            output_truncated=summary["truncated"],
+            plan_id=plan_run.plan_id,
+            stop_reason=stop_reason,
+        )
+        return record
+
+    @staticmethod
+    def _resource_limiter(limits):
+        cpu_seconds = limits.get("cpu_seconds")
+        memory_mb = limits.get("memory_mb")
+        if not cpu_seconds and not memory_mb:
+            return None
+
+        def apply():
+            if cpu_seconds:
+                resource.setrlimit(
+                    resource.RLIMIT_CPU, (int(cpu_seconds), int(cpu_seconds))
+                )
+            if memory_mb:
+                memory = int(memory_mb) * 1024 * 1024
+                resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+        return apply
+
+    async def _stop_process(self, process, grace: float = 2.0):
+        """Sends SIGTERM to the command's process group, then SIGKILL to
+        whatever is still running after the grace period"""
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(process.wait(), timeout=grace)
+            except asyncio.TimeoutError:
+                pass
+            # Also catches children the shell left behind in the group
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await process.wait()
+
+    def _create_output_store(self) -> OutputStore:
+        # Drop the oldest spilled outputs so the directory stays bounded
+        files = sorted(self.output_dir.glob("*.log"), key=lambda f: f.stat().st_mtime)
+        for stale in files[: max(len(files) - self.output_retain_count + 1, 0)]:
+            stale.unlink(missing_ok=True)
+        return OutputStore(
+            self.output_dir, self.output_tail_bytes, self.output_max_bytes
+        )
+
+    def _cancel_plans(self, plan_id=None):
+        """Cancels the given plan, or every running plan when no id is given"""
+        if plan_id:
+            runs = [self._plan_runs[plan_id]] if plan_id in self._plan_runs else []
+        else:
+            runs = list(self._plan_runs.values())
+        for run in runs:
+            print(f"Cancelling plan {run.plan_id}")
+            run.cancelled.set()
+        if not runs:
+            print(f"No running plan to cancel: {plan_id}")
+
+    @staticmethod
+    def _is_output_id(output_id: str) -> bool:
+        try:
+            return uuid.UUID(output_id).hex == output_id
+        except ValueError:
+            return False
+
+    async def _send_output_data(self, websocket, data):
+        message = {
+            "type": "output_data",
+            "request_id": data.get("request_id"),
+            "output_id": data.get("output_id"),
+        }
+        output_id = str(data.get("output_id", ""))
+        path = self.output_dir / f"{output_id}.log"
+
+        # Output ids are uuid hex strings, which also keeps the path inside
+        # the output directory
+        if not self._is_output_id(output_id):
+            message["error"] = "Invalid output id"
+        elif not path.exists():
+            message["error"] = "Output not found"
+        else:
+            offset = max(int(data.get("offset") or 0), 0)
+            limit = min(
+                int(data.get("limit") or self.output_fetch_max_bytes),
+                self.output_fetch_max_bytes,
+            )
+            with open(path, "rb") as f:
+                f.seek(offset)
+                chunk = f.read(limit)
+            total_bytes = path.stat().st_size
+            message.update(
+                {
+                    "offset": offset,
+                    "data": chunk.decode(errors="replace"),
+                    "next_offset": offset + len(chunk),
+                    "total_bytes": total_bytes,
+                    "eof": offset + len(chunk) >= total_bytes,
+                }
+            )
+
+        await websocket.send(json.dumps(message))
+
     async def handle_message(self, websocket, message: str):
-        print(f"Handling message: {message}")
         try:
             data = json.loads(message)
-            if data.get("type") == "execute":
+            msg_id = data.get("msg_id")
+            if msg_id is not None and self._is_duplicate(data):
+                print(f"Ignoring duplicate message {msg_id}")
+            elif data.get("type") == "execute":
                 print("Received execute command...")
                 execution_plan = data.get("execution_plan")
                 if execution_plan:
-                    for category in execution_plan.get("categories", []):
-                        if self.shutdown_event.is_set():
-                            break
-
-                        commands = [
-                            cmd.get("command")
-                            for cmd in category.get("commands", [])
-                            if cmd.get("command")
-                        ]
-
-                        if commands:
-                            combined_cmd = " && ".join(commands)
-                            print(f"Executing combined commands: {combined_cmd}")
-
-                            try:
-                                process = await asyncio.create_subprocess_shell(
-                                    combined_cmd,
-                                    stdout=asyncio.subprocess.PIPE,
-                                    stderr=asyncio.subprocess.PIPE,
-                                    shell=True,
-                                )
-
-                                # Buffer for accumulating output
-                                output_buffer = []
-
-                                while True:
-                                    if self.shutdown_event.is_set():
-                                        process.terminate()
-                                        break
-
-                                    try:
-                                        stdout_data = await process.stdout.readline()
-                                        stderr_data = await process.stderr.readline()
-
-                                        if (
-                                            not stdout_data
-                                            and not stderr_data
-                                            and process.returncode is not None
-                                        ):
-                                            break
-
-                                        if stdout_data:
-                                            output_line = stdout_data.decode().strip()
-                                            if output_line:
-                                                output_buffer.append(output_line)
-                                                await self.send_output(
-                                                    websocket,
-                                                    "command_output",
-                                                    combined_cmd,
-                                                    output=output_line,
-                                                )
-
-                                        if stderr_data:
-                                            error_line = stderr_data.decode().strip()
-                                            if error_line:
-                                                output_buffer.append(
-                                                    f"ERROR: {error_line}"
-                                                )
-                                                await self.send_output(
-                                                    websocket,
-                                                    "command_output",
-                                                    combined_cmd,
-                                                    output=f"ERROR: {error_line}",
-                                                )
-
-                                    except asyncio.TimeoutError:
-                                        continue
-                                    except Exception as e:
-                                        self.logger.error(
-                                            f"Error reading process output: {e}"
-                                        )
-                                        break
-
-                                try:
-                                    returncode = await asyncio.wait_for(
-                                        process.wait(), timeout=5.0
-                                    )
-                                except asyncio.TimeoutError:
-                                    self.logger.warning(
-                                        "Process took too long to complete, terminating..."
-                                    )
-                                    process.terminate()
-                                    try:
-                                        await asyncio.wait_for(
-                                            process.wait(), timeout=2.0
-                                        )
-                                    except asyncio.TimeoutError:
-                                        process.kill()
-                                    returncode = -1
-
-                                await self.send_output(
-                                    websocket,
-                                    "command_complete",
-                                    combined_cmd,
-                                    output="\n".join(output_buffer),
-                                    status=returncode,
-                                    success=returncode == 0,
-                                )
-
-                            except Exception as e:
-                                self.logger.error(f"Error executing command: {e}")
-                                await self.send_output(
-                                    websocket,
-                                    "command_error",
-                                    combined_cmd,
-                                    error=str(e),
-                                )
+                    await self._enqueue_plan(websocket, data)
+            elif data.get("type") == "cancel":
+                self._cancel_plans(data.get("plan_id"))
+            elif data.get("type") == "fetch_output":
+                await self._send_output_data(websocket, data)
+            elif data.get("type") == "resume":
+                await self._replay(websocket, data.get("last_seq") or 0)
+            elif data.get("type") == "seq_ack":
+                self._release_replayed(data.get("out_seq") or 0)
+
+            if msg_id is not None:
+                await websocket.send(json.dumps({"type": "ack", "msg_id": msg_id}))
 
         except json.JSONDecodeError:
             self.logger.error(f"Error: Invalid JSON received: {message}")
@@ -295,31 +949,195 @@ class WSClient:
             self.logger.error(f"Error handling message: {e}")
             await self.send_output(websocket, "error", "", error=str(e))
 
+    def _buffer_for_replay(self, message):
+        size = len(message.get("output") or "") + 256
+        self._replay_buffer.append((message, size))
+        self._replay_bytes += size
+        while (
+            self._replay_bytes > self.replay_buffer_bytes
+            and len(self._replay_buffer) > 1
+        ):
+            _, dropped = self._replay_buffer.popleft()
+            self._replay_bytes -= dropped
+
+    def _release_replayed(self, out_seq):
+        # The server has these even if it restarts and forgets where we were
+        while self._replay_buffer and self._replay_buffer[0][0]["out_seq"] <= out_seq:
+            _, size = self._replay_buffer.popleft()
+            self._replay_bytes -= size
+
+    async def _replay(self, websocket, last_seq):
+        replayed = 0
+        # Messages buffered while replaying are picked up by the next pass
+        while True:
+            pending = [m for m, _ in self._replay_buffer if m["out_seq"] > last_seq]
+            if not pending:
+                break
+            for message in pending:
+                await websocket.send(json.dumps(message))
+                last_seq = message["out_seq"]
+                replayed += 1
+        self._resumed.set()
+        if replayed:
+            print(f"Replayed {replayed} buffered message(s)")
+
+    def _is_duplicate(self, data) -> bool:
+        if data.get("stream_id") != self._stream_id:
+            # A new connection starts its numbering over
+            self._stream_id = data.get("stream_id")
+            self._last_msg_id = 0
+        if data["msg_id"] <= self._last_msg_id:
+            return True
+        self._last_msg_id = data["msg_id"]
+        return False
+
+    def _load_executed_plans(self):
+        try:
+            return collections.OrderedDict(
+                json.loads(self._executed_plans_file.read_text())
+            )
+        except FileNotFoundError:
+            return collections.OrderedDict()
+        except Exception as e:
+            self.logger.error(f"Error reading executed plans: {e}")
+            return collections.OrderedDict()
+
+    def _record_executed_plan(self, plan_id, result):
+        self._executed_plans[plan_id] = result
+        while len(self._executed_plans) > self.plan_dedup_size:
+            self._executed_plans.popitem(last=False)
+        try:
+            self._executed_plans_file.write_text(
+                json.dumps(list(self._executed_plans.items()))
+            )
+        except Exception as e:
+            self.logger.error(f"Error saving executed plans: {e}")
+
+    async def _enqueue_plan(self, websocket, data):
+        plan_id = data.get("plan_id")
+        if plan_id in self._plan_runs:
+            # Still queued or running; answer the latest request when it ends
+            print(f"Plan {plan_id} already in progress")
+            self._plan_runs[plan_id].request_id = data.get("request_id")
+            return
+        if plan_id in self._executed_plans:
+            print(f"Plan {plan_id} already executed, resending its result")
+            await self._send_plan_complete(
+                websocket,
+                plan_id,
+                data.get("request_id"),
+                **self._executed_plans[plan_id],
+            )
+            return
+
+        plan_run = PlanRun(
+            data.get("plan_id") or uuid.uuid4().hex,
+            # Ids of commands that already succeeded in an earlier run, so a
+            # failed plan can be resumed from the failed step
+            data.get("completed_commands") or [],
+            timeout=data.get("timeout"),
+            command_timeout=data.get("command_timeout") or self.command_timeout,
+            limits={**self.command_limits, **(data.get("limits") or {})},
+            request_id=data.get("request_id"),
+        )
+        try:
+            self._jobs.put_nowait((plan_run, data["execution_plan"]))
+        except asyncio.QueueFull:
+            self.logger.warning(f"Job queue full, rejecting plan {plan_run.plan_id}")
+            await self._send_plan_complete(
+                websocket,
+                plan_run.plan_id,
+                plan_run.request_id,
+                success=False,
+                error="Job queue is full",
+            )
+            return
+
+        # Registered while queued too, so a queued plan can be cancelled
+        self._plan_runs[plan_run.plan_id] = plan_run
+        print(f"Queued plan {plan_run.plan_id} ({self._jobs.qsize()} waiting)")
+
+    async def _job_worker(self):
+        while True:
+            plan_run, execution_plan = await self._jobs.get()
+            success, error = False, None
+            try:
+                if plan_run.stop_reason:
+                    print(f"Skipping {plan_run.stop_reason} plan {plan_run.plan_id}")
+                else:
+                    plan_run.start()
+                    success = await self._run_plan(
+                        self._connection, execution_plan, plan_run
+                    )
+            except Exception as e:
+                self.logger.error(f"Error running plan {plan_run.plan_id}: {e}")
+                error = str(e)
+            finally:
+                result = {
+                    "success": success,
+                    "stop_reason": plan_run.stop_reason,
+                    "error": error,
+                }
+                self._record_executed_plan(plan_run.plan_id, result)
+                self._plan_runs.pop(plan_run.plan_id, None)
+                await self._send_plan_complete(
+                    self._connection, plan_run.plan_id, plan_run.request_id, **result
+                )
+                self._jobs.task_done()
+
+    async def _send_plan_complete(
+        self, websocket, plan_id, request_id, success, stop_reason=None, error=None
+    ):
+        await self.send_output(
+            websocket,
+            "plan_complete",
+            "",
+            success=success,
+            error=error,
+            plan_id=plan_id,
+            request_id=request_id,
+            stop_reason=stop_reason,
+        )
+
     async def start(self):
-        retries = 0
-        while not self.shutdown_event.is_set() and retries < self.max_retries:
+        workers = [
+            asyncio.create_task(self._job_worker())
+            for _ in range(self.max_concurrent_plans)
+        ]
+        try:
+            await self._reconnect_loop()
+        finally:
+            self._cancel_plans()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _reconnect_loop(self):
+        attempt = 0
+        while not self.shutdown_event.is_set():
+            connections = self._connections
             try:
                 if await self.connect():
-                    retries = 0
-                else:
-                    retries += 1
-                    if retries < self.max_retries and not self.shutdown_event.is_set():
-                        wait_time = self.retry_delay * (2 ** (retries - 1))
-                        print(
-                            f"Reconnecting in {wait_time} seconds... (Attempt {retries}/{self.max_retries})"
-                        )
-                        try:
-                            await asyncio.wait_for(
-                                self.shutdown_event.wait(), timeout=wait_time
-                            )
-                        except asyncio.TimeoutError:
-                            continue
-                    else:
-                        print("Max retries reached or shutdown requested. Exiting...")
-                        break
+                    break
             except Exception as e:
                 print(f"Critical error: {e}")
+
+            if self.shutdown_event.is_set():
                 break
+            # A connection that was up starts the backoff over
+            attempt = 1 if self._connections != connections else attempt + 1
+
+            # Full jitter spreads a fleet's reconnects across the whole window
+            # instead of every client retrying in lockstep after an outage
+            ceiling = min(
+                self.max_retry_delay, self.retry_delay * 2 ** min(attempt - 1, 16)
+            )
+            wait_time = random.uniform(0, ceiling)
+            print(f"Reconnecting in {wait_time:.1f} seconds... (Attempt {attempt})")
+            try:
+                await asyncio.wait_for(self.shutdown_event.wait(), timeout=wait_time)
+            except asyncio.TimeoutError:
+                continue
 
 
 async def main_async():
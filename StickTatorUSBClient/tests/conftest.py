@@ -0,0 +1,11 @@
+import pytest
+
+from main import WSClient
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # Keep spilled output and the executed plans file out of the real temp dir
+    monkeypatch.setenv("OUTPUT_DIR", str(tmp_path / "output"))
+    monkeypatch.chdir(tmp_path)
+    return WSClient()
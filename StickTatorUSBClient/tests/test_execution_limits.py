@@ -0,0 +1,127 @@
+import asyncio
+import json
+import resource
+import sys
+import time
+from pathlib import Path
+
+from main import PlanRun
+
+
+def alive(pid: int) -> bool:
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+    except FileNotFoundError:
+        return False
+    # Zombies are dead, just not yet reaped by whoever inherited them
+    return stat.rsplit(")", 1)[1].split()[0] != "Z"
+
+
+def buffered(client, message_type):
+    # Not resumed, so every message stays in the replay buffer
+    return [m for m, _ in client._replay_buffer if m["type"] == message_type]
+
+
+def run_commands(client, commands, plan_run):
+    category = {
+        "id": "category-1",
+        "commands": [
+            {"id": f"cmd-{i}", "order": i, **command}
+            for i, command in enumerate(commands)
+        ],
+    }
+    return asyncio.run(client._run_category(None, category, plan_run))
+
+
+async def wait_for_file(path: Path, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not path.exists() or not path.read_text().strip():
+        assert time.monotonic() < deadline, f"{path} was never written"
+        await asyncio.sleep(0.02)
+
+
+def test_timeout_kills_the_whole_process_group(client, tmp_path):
+    pid_file = tmp_path / "child.pid"
+    # The shell and its child ignore SIGTERM, so only the SIGKILL to the
+    # process group stops them
+    command = f"trap '' TERM; sleep 30 & echo $! > {pid_file}; wait"
+
+    started = time.monotonic()
+    success = run_commands(
+        client, [{"command": command, "timeout": 0.5}], PlanRun("plan-1")
+    )
+    elapsed = time.monotonic() - started
+
+    (result,) = buffered(client, "command_result")
+    assert not success
+    assert result["stop_reason"] == "timeout"
+    assert elapsed < 10
+    assert not alive(int(pid_file.read_text()))
+
+
+def test_cancel_stops_a_running_plan(client, tmp_path):
+    pid_file = tmp_path / "child.pid"
+    after = tmp_path / "after"
+    plan = {
+        "categories": [
+            {
+                "id": "category-1",
+                "commands": [
+                    {
+                        "command": f"sleep 30 & echo $! > {pid_file}; wait",
+                        "order": 1,
+                    },
+                    {"command": f"touch {after}", "order": 2},
+                ],
+            }
+        ]
+    }
+
+    async def run():
+        worker = asyncio.create_task(client._job_worker())
+        await client.handle_message(
+            None,
+            json.dumps(
+                {"type": "execute", "plan_id": "plan-1", "execution_plan": plan}
+            ),
+        )
+        await wait_for_file(pid_file)
+        await client.handle_message(
+            None, json.dumps({"type": "cancel", "plan_id": "plan-1"})
+        )
+        await asyncio.wait_for(client._jobs.join(), timeout=10)
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+
+    asyncio.run(run())
+    (complete,) = buffered(client, "plan_complete")
+    assert not complete["success"]
+    assert complete["stop_reason"] == "cancelled"
+    assert not after.exists()
+    assert not alive(int(pid_file.read_text()))
+
+
+def test_resource_limits_apply_in_the_child(client):
+    plan_run = PlanRun("plan-1", limits={"cpu_seconds": 7, "memory_mb": 256})
+    allocate = f"{sys.executable} -c 'bytearray(512 * 1024 * 1024)'"
+
+    run_commands(
+        client,
+        [{"command": "ulimit -t; ulimit -v"}, {"command": allocate}],
+        plan_run,
+    )
+
+    limits, allocation = buffered(client, "command_result")
+    assert limits["output"].split() == ["7", str(256 * 1024)]
+    assert not allocation["success"]
+    assert "MemoryError" in allocation["output"]
+
+
+def test_limits_do_not_leak_into_the_client(client):
+    before = resource.getrlimit(resource.RLIMIT_AS)
+    run_commands(
+        client,
+        [{"command": "true"}],
+        PlanRun("plan-1", limits={"memory_mb": 64}),
+    )
+    assert resource.getrlimit(resource.RLIMIT_AS) == before
@@ -0,0 +1,44 @@
+import asyncio
+
+from main import PlanRun
+
+
+def test_plans_run_one_at_a_time_in_arrival_order_by_default(client, tmp_path):
+    log = tmp_path / "order.log"
+
+    def plan(name):
+        return {
+            "categories": [
+                {
+                    "id": "category-1",
+                    "commands": [
+                        {"command": f"echo start-{name} >> {log}", "order": 1},
+                        {"command": "sleep 0.2", "order": 2},
+                        {"command": f"echo end-{name} >> {log}", "order": 3},
+                    ],
+                }
+            ]
+        }
+
+    async def run():
+        workers = [
+            asyncio.create_task(client._job_worker())
+            for _ in range(client.max_concurrent_plans)
+        ]
+        for name in ["a", "b", "c"]:
+            client._jobs.put_nowait((PlanRun(f"plan-{name}"), plan(name)))
+        await asyncio.wait_for(client._jobs.join(), timeout=10)
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    assert client.max_concurrent_plans == 1
+    asyncio.run(run())
+    assert log.read_text().split() == [
+        "start-a",
+        "end-a",
+        "start-b",
+        "end-b",
+        "start-c",
+        "end-c",
+    ]
@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+import pytest
+
+from main import OutputStore, PlanRun
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+def fetch(client, **request):
+    websocket = RecordingWebSocket()
+    asyncio.run(
+        client._send_output_data(websocket, {"request_id": "request-1", **request})
+    )
+    return websocket.sent[0]
+
+
+def test_only_the_tail_stays_in_memory(tmp_path):
+    store = OutputStore(tmp_path, tail_bytes=64, max_bytes=1024 * 1024)
+    lines = [f"line {i:04d}" for i in range(1000)]
+    for line in lines:
+        store.add(line)
+    store.close()
+
+    full = "".join(f"{line}\n" for line in lines).encode()
+    assert store.path.read_bytes() == full
+    assert len(store.tail()) <= 64
+    assert store.tail().endswith("line 0999")
+    assert store.summary() == {
+        "output_id": store.output_id,
+        "bytes": len(full),
+        "lines": 1000,
+        "sha256": hashlib.sha256(full).hexdigest(),
+        "truncated": False,
+    }
+
+
+def test_spill_file_stops_at_the_size_cap(tmp_path):
+    store = OutputStore(tmp_path, tail_bytes=64, max_bytes=1000)
+    for i in range(500):
+        store.add(f"line {i:04d}")
+    store.close()
+
+    summary = store.summary()
+    assert store.path.stat().st_size == 1000
+    assert summary["truncated"]
+    # The summary still describes everything the command wrote
+    assert summary["bytes"] == 500 * len("line 0000\n")
+    assert store.tail().endswith("line 0499")
+
+
+def test_command_output_is_spilled_and_summarised(client):
+    client.output_tail_bytes = 100
+    client.output_max_bytes = 4096
+    category = {
+        "id": "category-1",
+        "commands": [{"id": "cmd-1", "command": "seq 1 5000", "order": 1}],
+    }
+
+    asyncio.run(client._run_category(None, category, PlanRun("plan-1")))
+    # Not resumed, so every message stays in the replay buffer
+    result = next(
+        message
+        for message, _ in client._replay_buffer
+        if message["type"] == "command_result"
+    )
+
+    assert len(result["output"]) <= 100
+    assert result["output"].endswith("5000")
+    assert result["output_truncated"]
+    spilled = client.output_dir / f"{result['output_id']}.log"
+    assert spilled.stat().st_size == 4096
+    assert spilled.read_text().startswith("1\n2\n3\n")
+
+
+def test_old_spill_files_are_pruned(client):
+    client.output_retain_count = 3
+    for _ in range(5):
+        client._create_output_store().close()
+        # mtime decides which files are oldest
+        time.sleep(0.01)
+
+    assert len(list(client.output_dir.glob("*.log"))) == 3
+
+
+def test_fetch_output_reads_a_byte_range(client):
+    store = client._create_output_store()
+    for i in range(100):
+        store.add(f"line {i:02d}")
+    store.close()
+
+    reply = fetch(client, output_id=store.output_id, offset=8, limit=16)
+    assert reply["data"] == "line 01\nline 02\n"
+    assert reply["next_offset"] == 24
+    assert reply["total_bytes"] == 800
+    assert not reply["eof"]
+
+
+@pytest.mark.parametrize(
+    "output_id",
+    [
+        "../owner",
+        "../../etc/passwd",
+        "/etc/passwd",
+        "executed_plans",
+        "",
+        "{12345678-1234-5678-1234-567812345678}",
+        "12345678-1234-5678-1234-567812345678",
+    ],
+)
+def test_fetch_output_rejects_ids_that_are_not_output_ids(client, output_id):
+    # A file right outside the output directory, where ../ would lead
+    (client.output_dir.parent / "owner.log").write_text("someone@example.com")
+
+    reply = fetch(client, output_id=output_id)
+    assert reply["error"] == "Invalid output id"
+    assert "data" not in reply
+
+
+def test_fetch_output_only_serves_outputs_of_this_client(client, tmp_path):
+    # A well-formed id whose file lives in another client's output directory
+    other = tmp_path / "other-output"
+    other.mkdir()
+    store = OutputStore(other, tail_bytes=64, max_bytes=1024)
+    store.add("secret")
+    store.close()
+
+    reply = fetch(client, output_id=store.output_id)
+    assert reply["error"] == "Output not found"
+    assert "data" not in reply
+    assert os.path.exists(store.path)
@@ -0,0 +1,41 @@
+import asyncio
+
+from main import PlanRun
+
+
+def category(category_id, command, depends_on):
+    return {
+        "id": category_id,
+        "depends_on": depends_on,
+        "commands": [{"id": f"{category_id}-1", "command": command, "order": 1}],
+    }
+
+
+def test_dependents_of_a_failed_category_are_skipped(client, tmp_path):
+    plan = {
+        "categories": [
+            category("build", "false", []),
+            category("deploy", f"touch {tmp_path / 'deployed'}", ["build"]),
+            category("notify", f"touch {tmp_path / 'notified'}", ["deploy"]),
+            category("lint", f"touch {tmp_path / 'linted'}", []),
+        ]
+    }
+
+    success = asyncio.run(client._run_plan(None, plan, PlanRun("plan-1")))
+    # Not resumed, so every message stays in the replay buffer
+    completed = {
+        message["category_id"]: message
+        for message, _ in client._replay_buffer
+        if message["type"] == "command_complete"
+    }
+
+    assert not success
+    assert not completed["build"]["success"]
+    for skipped in ("deploy", "notify"):
+        assert completed[skipped]["stop_reason"] == "dependency_failed"
+        assert not completed[skipped]["success"]
+    assert not (tmp_path / "deployed").exists()
+    assert not (tmp_path / "notified").exists()
+    # Independent categories still run
+    assert completed["lint"]["success"]
+    assert (tmp_path / "linted").exists()
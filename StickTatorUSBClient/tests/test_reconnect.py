@@ -0,0 +1,191 @@
+import asyncio
+import collections
+import json
+import ssl
+import time
+
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+from main import WSClient
+
+CLIENTS = 50
+BASE_DELAY = 0.05
+MAX_DELAY = 0.4
+OUTAGE_SECONDS = 0.5
+OUTPUT_INTERVAL = 0.02
+BUCKET_SECONDS = 0.05
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+def test_confirmed_messages_are_not_replayed(client):
+    async def run():
+        websocket = RecordingWebSocket()
+        for i in range(5):
+            await client.send_output(websocket, "command_output", "ls", output=str(i))
+        await client.handle_message(
+            websocket, json.dumps({"type": "seq_ack", "out_seq": 3})
+        )
+        # A restarted server has forgotten the sequence and asks from zero
+        await client._replay(websocket, 0)
+        return websocket.sent
+
+    sent = asyncio.run(run())
+    assert [message["out_seq"] for message in sent] == [4, 5]
+    assert client._replay_bytes == sum(size for _, size in client._replay_buffer)
+
+
+def test_output_flows_when_the_server_never_resumes(client):
+    client.resume_timeout = 0.05
+
+    async def run():
+        websocket = RecordingWebSocket()
+        await client.send_output(websocket, "command_output", "ls", output="held")
+        await client._resume_after_timeout(websocket)
+        await client.send_output(websocket, "command_output", "ls", output="live")
+        return websocket.sent
+
+    sent = asyncio.run(run())
+    assert [message["output"] for message in sent] == ["held", "live"]
+    assert client._resumed.is_set()
+
+
+class FakeServer:
+    """Just enough of the backend: resumes each machine by token, drops
+    replayed duplicates and confirms every message. A restart forgets where
+    every machine was, like the real one"""
+
+    def __init__(self):
+        self.received = collections.defaultdict(list)
+        self.connected_at = collections.defaultdict(list)
+        self._sequences = {}
+        self._server = None
+
+    async def start(self, port: int = 0) -> int:
+        self._sequences = {}
+        self._server = await serve(self._handle, "127.0.0.1", port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, connection):
+        machine_id = connection.request.path.rsplit("/", 1)[-1]
+        try:
+            async for raw in connection:
+                message = json.loads(raw)
+                if message["type"] == "device_connected":
+                    self.connected_at[machine_id].append(time.perf_counter())
+                    sequence = self._sequences.get(machine_id)
+                    if sequence is None or sequence["token"] != message["resume_token"]:
+                        sequence = {"token": message["resume_token"], "last_seq": 0}
+                        self._sequences[machine_id] = sequence
+                    await connection.send(
+                        json.dumps({"type": "resume", "last_seq": sequence["last_seq"]})
+                    )
+                elif "out_seq" in message:
+                    sequence = self._sequences[machine_id]
+                    if message["out_seq"] <= sequence["last_seq"]:
+                        continue
+                    sequence["last_seq"] = message["out_seq"]
+                    self.received[machine_id].append(message["out_seq"])
+                    await connection.send(
+                        json.dumps({"type": "seq_ack", "out_seq": message["out_seq"]})
+                    )
+        except ConnectionClosed:
+            pass
+
+
+def test_fleet_reconnect_storm_after_backend_restart(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("RECONNECT_BASE_DELAY", str(BASE_DELAY))
+    monkeypatch.setenv("RECONNECT_MAX_DELAY", str(MAX_DELAY))
+    # Each simulated client stands for its own machine, so the ~30ms of CPU
+    # building a TLS context per attempt must not queue them behind each other
+    context = ssl.create_default_context()
+    monkeypatch.setattr(ssl, "create_default_context", lambda *args, **kwargs: context)
+
+    async def produce(client, stop):
+        # A long-running command keeps writing through the outage
+        while not stop.is_set():
+            await client.send_output(
+                client._current_websocket, "command_output", "tail -f", output="x"
+            )
+            await asyncio.sleep(OUTPUT_INTERVAL)
+
+    async def run():
+        server = FakeServer()
+        port = await server.start()
+        clients = []
+        for i in range(CLIENTS):
+            monkeypatch.setenv("OUTPUT_DIR", str(tmp_path / f"output-{i}"))
+            client = WSClient()
+            client.client_id = f"machine-{i}"
+            client.server_url = f"ws://127.0.0.1:{port}/ws/v1/machine"
+            clients.append(client)
+
+        runs = [asyncio.create_task(client.start()) for client in clients]
+        stop = asyncio.Event()
+        producers = [asyncio.create_task(produce(c, stop)) for c in clients]
+        await asyncio.sleep(0.3)
+
+        await server.stop()
+        await asyncio.sleep(OUTAGE_SECONDS)
+        restarted_at = time.perf_counter()
+        await server.start(port)
+        await asyncio.sleep(MAX_DELAY * 2)
+
+        stop.set()
+        await asyncio.gather(*producers)
+        deadline = time.perf_counter() + 5
+        while time.perf_counter() < deadline and any(
+            len(set(server.received[c.client_id])) < c._out_seq for c in clients
+        ):
+            await asyncio.sleep(0.05)
+
+        for client in clients:
+            client.shutdown_event.set()
+        await asyncio.gather(*runs)
+        await server.stop()
+        return server, clients, restarted_at
+
+    server, clients, restarted_at = asyncio.run(run())
+
+    reconnects = [
+        min(t for t in server.connected_at[c.client_id] if t >= restarted_at)
+        - restarted_at
+        for c in clients
+    ]
+    busiest = max(
+        collections.Counter(
+            int(delay / BUCKET_SECONDS) for delay in reconnects
+        ).values()
+    )
+    duplicates = sum(
+        len(server.received[c.client_id]) - len(set(server.received[c.client_id]))
+        for c in clients
+    )
+    print(
+        f"\n{CLIENTS} clients, {OUTAGE_SECONDS}s outage, backoff capped at "
+        f"{MAX_DELAY}s\n"
+        f"  reconnects spread over {max(reconnects) * 1000:.0f}ms, "
+        f"busiest {BUCKET_SECONDS * 1000:.0f}ms window had {busiest}\n"
+        f"  {sum(c._out_seq for c in clients)} messages, {duplicates} duplicates"
+    )
+    # Full jitter keeps the fleet from coming back in one burst
+    assert busiest < CLIENTS / 2
+    # Every message arrives despite the outage and the forgotten sequences
+    for client in clients:
+        assert sorted(set(server.received[client.client_id])) == list(
+            range(1, client._out_seq + 1)
+        )
+    # Confirmed messages are not replayed to the restarted server
+    assert duplicates <= CLIENTS
@@ -0,0 +1,71 @@
+import asyncio
+
+from main import PlanRun
+
+
+def run_category(client, commands):
+    category = {
+        "id": "category-1",
+        "commands": [
+            {"id": f"cmd-{i}", "command": command, "order": i}
+            for i, command in enumerate(commands)
+        ],
+    }
+
+    async def run():
+        return await client._run_category(None, category, PlanRun("plan-1"))
+
+    success = asyncio.run(run())
+    # Not resumed, so every message stays in the replay buffer
+    results = {
+        message["command_id"]: message
+        for message, _ in client._replay_buffer
+        if message["type"] == "command_result"
+    }
+    return success, results
+
+
+def test_environment_carries_over_between_commands(client):
+    success, results = run_category(
+        client,
+        ["export FOO=bar", 'echo "FOO=$FOO"', "unset HOME", 'echo "HOME=${HOME:-}"'],
+    )
+    assert success
+    assert results["cmd-1"]["output"] == "FOO=bar"
+    assert results["cmd-3"]["output"] == "HOME="
+
+
+def test_sourced_scripts_carry_over(client, tmp_path):
+    (tmp_path / "activate").write_text("export VIRTUAL_ENV=/opt/venv\n")
+    success, results = run_category(
+        client, [f". {tmp_path}/activate", 'echo "$VIRTUAL_ENV"']
+    )
+    assert success
+    assert results["cmd-1"]["output"] == "/opt/venv"
+
+
+def test_working_directory_and_umask_carry_over(client, tmp_path):
+    success, results = run_category(
+        client, [f"cd {tmp_path}", "umask 027", "pwd", "umask"]
+    )
+    assert success
+    assert results["cmd-2"]["output"] == str(tmp_path)
+    assert results["cmd-3"]["output"] == "0027"
+
+
+def test_set_e_carries_over(client):
+    success, results = run_category(
+        client, ["set -e", "false; echo still running", "echo unreachable"]
+    )
+    assert not success
+    assert results["cmd-1"]["status"] != 0
+    assert results["cmd-1"].get("output", "") == ""
+    assert "cmd-2" not in results
+
+
+def test_set_x_does_not_trace_the_state_capture(client):
+    success, results = run_category(client, ["set -x", "echo traced"])
+    assert success
+    # stdout and stderr may arrive in either order
+    lines = results["cmd-1"]["output"].split("\n")
+    assert sorted(lines) == ["ERROR: + echo traced", "traced"]
@@ -0,0 +1,120 @@
+import asyncio
+import sys
+import time
+
+LINES = 200_000
+LINE = "x" * 99
+
+# Writes to one stream only for a long stretch before touching the other, so a
+# reader that alternates between the pipes stalls once the other pipe fills
+ONE_SIDED = f"""
+import sys
+for i in range({LINES}):
+    sys.stderr.write("e%d {LINE}\\n" % i)
+for i in range({LINES}):
+    sys.stdout.write("o%d {LINE}\\n" % i)
+"""
+
+INTERLEAVED = f"""
+import sys
+for i in range({LINES}):
+    sys.stdout.write("o%d {LINE}\\n" % i)
+    sys.stderr.write("e%d {LINE}\\n" % i)
+"""
+
+NO_NEWLINES = """
+import sys
+sys.stdout.write("y" * (8 * 1024 * 1024))
+"""
+
+
+async def read_all(client, script: str):
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-c",
+        script,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    lines = []
+
+    async def on_line(line):
+        lines.append(line)
+
+    started = time.perf_counter()
+    await asyncio.wait_for(client._read_process_output(process, on_line), timeout=60)
+    elapsed = time.perf_counter() - started
+    assert await process.wait() == 0
+    return lines, elapsed
+
+
+def report(name: str, lines, elapsed: float):
+    megabytes = sum(len(line) + 1 for line in lines) / 1024 / 1024
+    print(
+        f"\n{name}: {megabytes:.1f} MB in {elapsed:.2f}s ({megabytes / elapsed:.0f} MB/s)"
+    )
+
+
+async def serialized_read(script: str) -> bool:
+    # The old executor loop: one stdout line, then one stderr line
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-c",
+        script,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+    async def read():
+        while True:
+            stdout = await process.stdout.readline()
+            stderr = await process.stderr.readline()
+            if not stdout and not stderr:
+                return
+
+    try:
+        await asyncio.wait_for(read(), timeout=3)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        if process.returncode is None:
+            process.kill()
+        # Drains whatever the pipes still hold so the process can be reaped
+        await process.communicate()
+
+
+def test_serialized_reader_deadlocks_on_one_sided_writer():
+    # Guards the harness itself: the generator must be able to catch the bug
+    assert not asyncio.run(serialized_read(ONE_SIDED))
+
+
+def test_one_sided_writer_does_not_deadlock(client):
+    lines, elapsed = asyncio.run(read_all(client, ONE_SIDED))
+    report("stderr then stdout", lines, elapsed)
+
+    stdout = [line for line in lines if not line.startswith("ERROR: ")]
+    stderr = [line[len("ERROR: ") :] for line in lines if line.startswith("ERROR: ")]
+    assert stdout == [f"o{i} {LINE}" for i in range(LINES)]
+    assert stderr == [f"e{i} {LINE}" for i in range(LINES)]
+
+
+def test_interleaved_streams_keep_per_stream_order(client):
+    lines, elapsed = asyncio.run(read_all(client, INTERLEAVED))
+    report("interleaved", lines, elapsed)
+
+    assert len(lines) == 2 * LINES
+    assert [line for line in lines if line.startswith("o")] == [
+        f"o{i} {LINE}" for i in range(LINES)
+    ]
+    assert [line for line in lines if line.startswith("ERROR: ")] == [
+        f"ERROR: e{i} {LINE}" for i in range(LINES)
+    ]
+
+
+def test_output_without_newlines_is_chunked(client):
+    lines, elapsed = asyncio.run(read_all(client, NO_NEWLINES))
+    report("no newlines", lines, elapsed)
+
+    assert "".join(lines) == "y" * (8 * 1024 * 1024)
+    assert max(len(line) for line in lines) <= 2 * client.read_chunk_size
@@ -0,0 +1,73 @@
+from fastapi import APIRouter, Response
+from fastapi import Request as ServerRequest
+
+from app.services.FleetService import FleetService
+from app.utils.logger import CustomLogger
+from app.utils.response import error_response, success_response
+
+router = APIRouter()
+
+
+def _int_field(data: dict, name: str) -> int:
+    value = data.get(name) or 0
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"{name} must be an integer")
+    try:
+        return int(value)
+    except (OverflowError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+
+
+@router.post("/dispatch")
+async def dispatch_plan(req: ServerRequest, res: Response):
+    try:
+        data = await req.json()
+
+        if not isinstance(data, dict):
+            return error_response("Request body must be a JSON object", 400, res)
+        if not data.get("targets"):
+            return error_response("Targets are required", 400, res)
+
+        run = await FleetService.dispatch(
+            data.get("execution_plan"),
+            data["targets"],
+            parallelism=_int_field(data, "parallelism"),
+            canary=_int_field(data, "canary"),
+            wave_size=_int_field(data, "wave_size"),
+            max_failures=_int_field(data, "max_failures"),
+            options=data,
+        )
+        return success_response("Fleet run started", 202, res, run)
+    except ValueError as e:
+        CustomLogger.create_log("error", f"Error dispatching fleet run: {str(e)}")
+        return error_response(str(e), 400, res)
+    except Exception as e:
+        CustomLogger.create_log("error", f"Unexpected Error: {str(e)}")
+        raise e
+
+
+@router.get("/runs/{run_id}")
+async def get_run(run_id: str, res: Response):
+    try:
+        run = await FleetService.get_run(run_id)
+
+        if not run:
+            return error_response("Fleet run not found", 404, res)
+
+        return success_response("Fleet run fetched successfully", 200, res, run)
+    except Exception as e:
+        CustomLogger.create_log("error", f"Unexpected Error: {str(e)}")
+        raise e
+
+
+@router.post("/runs/{run_id}/cancel")
+async def cancel_run(run_id: str, res: Response):
+    try:
+        run = await FleetService.cancel_run(run_id)
+        return success_response("Fleet run cancelled", 200, res, run)
+    except ValueError as e:
+        CustomLogger.create_log("error", f"Error cancelling fleet run: {str(e)}")
+        return error_response(str(e), 400, res)
+    except Exception as e:
+        CustomLogger.create_log("error", f"Unexpected Error: {str(e)}")
+        raise e
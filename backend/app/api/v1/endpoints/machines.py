@@ -1,7 +1,11 @@
-from fastapi import APIRouter, Response
+from typing import Optional
+
+from fastapi import APIRouter, Query, Response
 from fastapi import Request as ServerRequest
 
+from app.config import settings
 from app.services.AIService import AIService
+from app.services.IntentCacheService import IntentCacheService
 from app.services.WebSocketService import WebSocketService
 from app.utils.logger import CustomLogger
 from app.utils.response import error_response, success_response
@@ -18,8 +22,11 @@ async def get_commands(req: ServerRequest, res: Response):
         if not user_intent:
             return error_response("User intent is required", 400, res)
 
-        service = AIService()
-        operation = service.generate_commands(user_intent)
+        operation = await IntentCacheService.get(user_intent)
+        if operation is None:
+            service = AIService()
+            operation = await service.generate_commands(user_intent)
+            await IntentCacheService.set(user_intent, operation)
         CustomLogger.create_log("info", f"Commands generated successfully: {operation}")
         return success_response("Commands generated successfully", 200, res, operation)
     except ValueError as e:
@@ -30,6 +37,17 @@ async def get_commands(req: ServerRequest, res: Response):
         raise e
 
 
+@router.get("/get-commands/stats")
+async def get_commands_stats():
+    return success_response(
+        "Command generation stats fetched successfully",
+        data={
+            "attempts": AIService.get_attempt_stats(),
+            "cache": IntentCacheService.get_stats(),
+        },
+    )
+
+
 @router.post("/send_message/{machine_id}")
 async def send_message(machine_id: str, message: dict):
     await WebSocketService.send_to_machine(machine_id, message)
@@ -37,3 +55,67 @@ async def send_message(machine_id: str, message: dict):
         "info", f"Sent message to machine: {machine_id}, message: {message}"
     )
     return success_response("Message sent to machine")
+
+
+@router.post("/cancel/{machine_id}")
+async def cancel_execution(
+    machine_id: str, res: Response, plan_id: Optional[str] = None
+):
+    # Without a plan id every plan running on the machine is cancelled
+    message = {"type": "cancel"}
+    if plan_id:
+        message["plan_id"] = plan_id
+
+    if not await WebSocketService.send_to_machine(machine_id, message):
+        return error_response(f"Machine {machine_id} not connected", 404, res)
+
+    CustomLogger.create_log(
+        "info", f"Sent cancel to machine: {machine_id}, plan: {plan_id or 'all'}"
+    )
+    return success_response("Cancel sent to machine", 200, res)
+
+
+@router.get("/output/{machine_id}/{output_id}")
+async def get_command_output(
+    machine_id: str,
+    output_id: str,
+    res: Response,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(settings.OUTPUT_FETCH_MAX_BYTES, ge=1),
+):
+    try:
+        reply = await WebSocketService.request_machine(
+            machine_id,
+            {
+                "type": "fetch_output",
+                "output_id": output_id,
+                "offset": offset,
+                "limit": min(limit, settings.OUTPUT_FETCH_MAX_BYTES),
+            },
+        )
+
+        if reply.get("error"):
+            return error_response(reply["error"], 404, res)
+
+        return success_response(
+            "Command output fetched successfully",
+            200,
+            res,
+            {
+                key: reply.get(key)
+                for key in [
+                    "output_id",
+                    "offset",
+                    "data",
+                    "next_offset",
+                    "total_bytes",
+                    "eof",
+                ]
+            },
+        )
+    except ValueError as e:
+        CustomLogger.create_log("error", f"Error fetching command output: {str(e)}")
+        return error_response(str(e), 400, res)
+    except Exception as e:
+        CustomLogger.create_log("error", f"Unexpected Error: {str(e)}")
+        raise e
@@ -1,19 +1,39 @@
-from fastapi import APIRouter, Response
+import asyncio
+from typing import Optional
+
+from fastapi import APIRouter, Query, Response
 from fastapi import Request as ServerRequest
 
-from app.database.mongo import MongoDBHandler
-from app.database.s3 import S3Handler
+from app.database.registry import ResourceRegistry
 from app.services.AIService import AIService
+from app.services.WebSocketService import WebSocketService
 from app.utils.logger import CustomLogger
 from app.utils.response import error_response, success_response
 
 router = APIRouter()
 
 
+async def _send_report_error(
+    client_id: Optional[str], machine_name: str, error: str
+) -> None:
+    # A streaming frontend may already hold partial chunks; tell it the report
+    # will not complete
+    if client_id:
+        await WebSocketService.send_to_frontend(
+            client_id,
+            {"type": "report_error", "machine_name": machine_name, "error": error},
+        )
+
+
 @router.post("/generate-report/{user_email}/{machine_name}")
 async def generate_report(
-    req: ServerRequest, res: Response, user_email: str, machine_name: str
+    req: ServerRequest,
+    res: Response,
+    user_email: str,
+    machine_name: str,
+    client_id: Optional[str] = None,
 ):
+    report_failed = asyncio.Event()
     try:
         data = await req.json()
 
@@ -28,19 +48,41 @@ async def generate_report(
             "info", f"Generating report for user: {user_email}, machine: {machine_name}"
         )
 
+        # When a frontend client id is given, stream the report to its socket as
+        # it is generated; upload and persistence happen once the stream closes
+        on_token = None
+        if client_id:
+
+            async def on_token(token: str):
+                # report_error is the last frame the frontend gets
+                if report_failed.is_set():
+                    return
+                await WebSocketService.send_to_frontend(
+                    client_id,
+                    {
+                        "type": "report_chunk",
+                        "machine_name": machine_name,
+                        "content": token,
+                    },
+                )
+
         ai_service = AIService()
-        report_content, description = ai_service.generate_report(data)
+        report_content, description = await ai_service.generate_report(
+            data, on_token=on_token
+        )
 
         CustomLogger.create_log("info", f"Report generated: {report_content}")
 
-        s3_handler = S3Handler()
-        mongo_handler = MongoDBHandler()
+        s3_handler = ResourceRegistry.get_s3()
+        mongo_handler = ResourceRegistry.get_mongo()
 
-        s3_response = s3_handler.upload_report(user_email, report_content)
+        s3_response = await asyncio.to_thread(
+            s3_handler.upload_report, user_email, report_content
+        )
 
         CustomLogger.create_log("info", f"Report uploaded to S3: {s3_response['url']}")
 
-        mongo_handler.add_report(
+        await mongo_handler.add_report(
             email=user_email,
             machine_name=machine_name,
             s3_url=s3_response["url"],
@@ -51,28 +93,61 @@ async def generate_report(
             "info", f"Report details stored in MongoDB: {s3_response['url']}"
         )
 
+        if client_id:
+            await WebSocketService.send_to_frontend(
+                client_id,
+                {
+                    "type": "report_complete",
+                    "machine_name": machine_name,
+                    "description": description,
+                    "data": s3_response,
+                },
+            )
+
         return success_response(
             "Report generated and stored successfully", 200, res, s3_response
         )
     except ValueError as e:
         CustomLogger.create_log("error", f"Error generating report: {str(e)}")
+        report_failed.set()
+        await _send_report_error(client_id, machine_name, str(e))
         return error_response(str(e), 400, res)
     except Exception as e:
         CustomLogger.create_log("error", f"Unexpected Error: {str(e)}")
+        report_failed.set()
+        await _send_report_error(client_id, machine_name, str(e))
         raise e
 
 
 @router.get("/reports/{user_email}")
-async def get_all_reports(user_email: str, res: Response):
+async def get_all_reports(
+    user_email: str,
+    res: Response,
+    limit: int = Query(20, ge=1, le=100),
+    after: Optional[str] = None,
+    machine_name: Optional[str] = None,
+    fields: Optional[str] = None,
+):
     try:
         user_email = user_email.lower() + "@gmail.com"
-        mongo_handler = MongoDBHandler()
+        mongo_handler = ResourceRegistry.get_mongo()
 
-        reports = mongo_handler.get_all_reports(user_email)
+        reports, next_cursor = await mongo_handler.get_all_reports(
+            user_email,
+            limit=limit,
+            after=after,
+            machine_name=machine_name,
+            fields=fields.split(",") if fields else None,
+        )
         for report in reports:
             report["_id"] = str(report["_id"])
 
-        return success_response("Reports fetched successfully", 200, res, reports)
+        return success_response(
+            "Reports fetched successfully",
+            200,
+            res,
+            {"reports": reports, "next_cursor": next_cursor},
+        )
     except ValueError as e:
         CustomLogger.create_log("error", f"Error fetching reports: {str(e)}")
         return error_response(str(e), 400, res)
@@ -85,9 +160,9 @@ async def get_all_reports(user_email: str, res: Response):
 async def get_report(user_email: str, report_id: str, res: Response):
     try:
         user_email = user_email.lower() + "@gmail.com"
-        mongo_handler = MongoDBHandler()
+        mongo_handler = ResourceRegistry.get_mongo()
 
-        report = mongo_handler.get_report(user_email, report_id)
+        report = await mongo_handler.get_report(user_email, report_id)
 
         if not report:
             return error_response("Report not found", 404, res)
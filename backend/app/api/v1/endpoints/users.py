@@ -16,7 +16,7 @@ async def add_new_user(req: ServerRequest, res: Response):
         email = data.get("email")
         image = data.get("image")
 
-        new_user = UserService.create_user(name, email, image)
+        new_user = await UserService.create_user(name, email, image)
         new_user["_id"] = str(new_user["_id"])
         CustomLogger.create_log("info", f"User created: {new_user}")
         return success_response("User created successfully", 201, res, new_user)
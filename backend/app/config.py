@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 
 from app.constants import PROJECT_NAME
@@ -7,11 +9,40 @@ class Settings(BaseSettings):
     PROJECT_NAME: str = PROJECT_NAME
     LOG_LEVEL: str = "INFO"
     MONGO_URI: str
+    MONGO_MAX_POOL_SIZE: int = 100
     AWS_ACCESS_KEY_ID: str
     AWS_SECRET_ACCESS_KEY: str
     AWS_DEFAULT_REGION: str
     S3_BUCKET_NAME: str
+    S3_MAX_POOL_CONNECTIONS: int = 50
     OPENAI_API_KEY: str
+    OPENAI_MAX_CONNECTIONS: int = 100
+    AI_COMMANDS_MAX_ATTEMPTS: int = 3
+    AI_COMMANDS_RETRY_BACKOFF_SECONDS: float = 0.5
+    AI_COMMANDS_DEADLINE_SECONDS: float = 30.0
+    # "memory" for a single process, "redis" to route across workers and nodes
+    MESSAGE_BUS_BACKEND: str = "memory"
+    REDIS_URL: Optional[str] = None
+    NODE_ID: Optional[str] = None
+    FRONTEND_SEND_QUEUE_SIZE: int = 256
+    FRONTEND_SEND_TIMEOUT_SECONDS: float = 5.0
+    INTENT_CACHE_TTL_SECONDS: int = 86400
+    INTENT_CACHE_MAX_ENTRIES: int = 1000
+    # 1.0 disables similarity matching; only exact normalized intents hit
+    INTENT_CACHE_SIMILARITY_THRESHOLD: float = 1.0
+    MACHINE_REQUEST_TIMEOUT_SECONDS: float = 10.0
+    OUTPUT_FETCH_MAX_BYTES: int = 1024 * 1024
+    FLEET_DEFAULT_PARALLELISM: int = 10
+    FLEET_MACHINE_TIMEOUT_SECONDS: float = 3600.0
+    OUTBOX_TTL_SECONDS: int = 86400
+    OUTBOX_MAX_MESSAGES_PER_MACHINE: int = 100
+    MACHINE_RETRANSMIT_WINDOW: int = 256
+    # Machine messages received before the server confirms them; heartbeats
+    # confirm whatever is left over
+    MACHINE_SEQ_CONFIRM_INTERVAL: int = 32
+    # Machines heartbeat well within the timeout; the sweep runs every interval
+    PRESENCE_SWEEP_INTERVAL_SECONDS: float = 5.0
+    PRESENCE_TIMEOUT_SECONDS: float = 45.0
 
     class Config:
         env_file = ".env"
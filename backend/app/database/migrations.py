@@ -0,0 +1,82 @@
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+from app.utils.logger import CustomLogger
+
+
+async def create_users_email_index(db: AsyncIOMotorDatabase) -> None:
+    await db.users.create_index("email", unique=True)
+
+
+async def move_history_to_reports(db: AsyncIOMotorDatabase) -> None:
+    # Keyset pagination sorts on (created_at, _id), so _id is part of the
+    # indexes for the sort to stay index-backed
+    await db.reports.create_index(
+        [("email", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]
+    )
+    await db.reports.create_index(
+        [
+            ("email", ASCENDING),
+            ("machine_name", ASCENDING),
+            ("created_at", DESCENDING),
+            ("_id", DESCENDING),
+        ]
+    )
+
+    async for user in db.users.find(
+        {"history": {"$exists": True}}, {"email": 1, "history": 1}
+    ):
+        # Upsert by _id so a partially applied migration can be rerun safely
+        operations = [
+            ReplaceOne(
+                {"_id": report["_id"]},
+                {**report, "email": user["email"]},
+                upsert=True,
+            )
+            for report in user.get("history", [])
+        ]
+        if operations:
+            await db.reports.bulk_write(operations, ordered=False)
+
+        await db.users.update_one({"_id": user["_id"]}, {"$unset": {"history": ""}})
+
+
+async def create_intent_cache_ttl_index(db: AsyncIOMotorDatabase) -> None:
+    await db.intent_cache.create_index("expires_at", expireAfterSeconds=0)
+
+
+async def create_outbox_indexes(db: AsyncIOMotorDatabase) -> None:
+    await db.outbox.create_index([("machine_id", ASCENDING), ("_id", ASCENDING)])
+    await db.outbox.create_index("expires_at", expireAfterSeconds=0)
+
+
+# Applied in order, each exactly once per database. Never edit or reorder an
+# entry that has shipped; append a new one instead.
+MIGRATIONS: List[Tuple[str, Callable[[AsyncIOMotorDatabase], Awaitable[None]]]] = [
+    ("0001_users_email_index", create_users_email_index),
+    ("0002_move_history_to_reports", move_history_to_reports),
+    ("0003_intent_cache_ttl_index", create_intent_cache_ttl_index),
+    ("0004_outbox_indexes", create_outbox_indexes),
+]
+
+
+async def run_migrations(db: AsyncIOMotorDatabase) -> None:
+    applied = {doc["_id"] async for doc in db.migrations.find({}, {"_id": 1})}
+
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+
+        await migration(db)
+        try:
+            await db.migrations.insert_one(
+                {"_id": name, "applied_at": datetime.now(timezone.utc).isoformat()}
+            )
+        except DuplicateKeyError:
+            # Another worker applied it concurrently; migrations are idempotent
+            pass
+        CustomLogger.create_log("info", f"Applied migration: {name}")
@@ -1,25 +1,46 @@
+import base64
 from datetime import datetime, timezone
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
-from app.config import settings
 from bson import ObjectId
-from pymongo import MongoClient
+from bson.errors import InvalidId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+
+MACHINES_PROJECTION = {"_id": 0, "machines": 1}
+REPORTS_SORT = [("created_at", DESCENDING), ("_id", DESCENDING)]
+REPORT_FIELDS = {"markdown_report_s3_url", "machine_name", "created_at", "description"}
+
+
+def _encode_report_cursor(report: Dict) -> str:
+    raw = f"{report['created_at']}|{report['_id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_report_cursor(cursor: str) -> Tuple[str, ObjectId]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, report_id = raw.rsplit("|", 1)
+        return created_at, ObjectId(report_id)
+    except (ValueError, InvalidId):
+        raise ValueError("Invalid pagination cursor")
 
 
 class MongoDBHandler:
-    def __init__(self):
-        mongo_uri = settings.MONGO_URI
-        self.client = MongoClient(mongo_uri)
+    def __init__(self, client: AsyncIOMotorClient):
+        self.client = client
         self.db = self.client.device_management
         self.users = self.db.users
+        self.reports = self.db.reports
+        self.intent_cache = self.db.intent_cache
+        self.fleet_runs = self.db.fleet_runs
+        self.outbox = self.db.outbox
 
-        self.users.create_index("email", unique=True)
-
-    def create_user(self, name: str, email: str, image: str) -> Dict:
+    async def create_user(self, name: str, email: str, image: str) -> Dict:
         if not name or not email:
             raise ValueError("Name and email are required")
 
-        if self.users.find_one({"email": email}):
+        if await self.users.find_one({"email": email}):
             raise ValueError(f"User with email {email} already exists")
 
         user = {
@@ -27,131 +48,177 @@ class MongoDBHandler:
             "email": email,
             "image": image,
             "machines": [],
-            "history": [],
             "created_at": datetime.now(timezone.utc).isoformat(),
         }
 
-        result = self.users.insert_one(user)
-        return self.users.find_one({"_id": result.inserted_id})
+        result = await self.users.insert_one(user)
+        return await self.users.find_one({"_id": result.inserted_id})
 
-    def find_user_by_email(self, email: str) -> Optional[Dict]:
-        return self.users.find_one({"email": email})
-
-    def add_machine(self, email: str, machine_name: str) -> Dict:
-        user = self.find_user_by_email(email)
-        if not user:
-            raise ValueError(f"User with email {email} not found")
-
-        for machine in user["machines"]:
-            if machine["name"] == machine_name:
-                if machine["status"] == "disconnected":
-                    query = {"email": email, "machines.name": machine_name}
-                    update = {"$set": {"machines.$.status": "connected"}}
-                    self.users.update_one(query, update)
-                updated_user = self.find_user_by_email(email)
-                for machine in updated_user["machines"]:
-                    machine["_id"] = str(machine["_id"])
-                return updated_user
+    async def find_user_by_email(self, email: str) -> Optional[Dict]:
+        return await self.users.find_one({"email": email})
 
+    async def add_machine(self, email: str, machine_name: str) -> Dict:
         machine = {
             "_id": ObjectId(),
             "name": machine_name,
             "status": "connected",
             "created_at": datetime.now(timezone.utc).isoformat(),
         }
+        machines = {"$ifNull": ["$machines", []]}
+        name = {"$literal": machine_name}
+
+        # Mark an existing machine as connected or append a new one in a single
+        # atomic pipeline update, so concurrent connects cannot insert duplicates
+        update = [
+            {
+                "$set": {
+                    "machines": {
+                        "$cond": [
+                            {"$in": [name, {"$ifNull": ["$machines.name", []]}]},
+                            {
+                                "$map": {
+                                    "input": machines,
+                                    "in": {
+                                        "$cond": [
+                                            {"$eq": ["$$this.name", name]},
+                                            {
+                                                "$mergeObjects": [
+                                                    "$$this",
+                                                    {"status": "connected"},
+                                                ]
+                                            },
+                                            "$$this",
+                                        ]
+                                    },
+                                }
+                            },
+                            {"$concatArrays": [machines, {"$literal": [machine]}]},
+                        ]
+                    }
+                }
+            }
+        ]
 
-        result = self.users.update_one(
-            {"email": email}, {"$push": {"machines": machine}}
+        result = await self.users.find_one_and_update(
+            {"email": email},
+            update,
+            projection=MACHINES_PROJECTION,
+            return_document=ReturnDocument.AFTER,
         )
+        if not result:
+            raise ValueError(f"User with email {email} not found")
 
-        if result.modified_count == 0:
-            raise ValueError(f"Failed to add machine for user {email}")
-
-        updated_user = self.find_user_by_email(email)
-        for machine in updated_user["machines"]:
-            machine["_id"] = str(machine["_id"])
-
-        return updated_user
+        return self._serialize_machines(result)
 
-    def update_machine_status(self, email: str, machine_name: str, status: str) -> Dict:
+    async def update_machine_status(
+        self, email: str, machine_name: str, status: str
+    ) -> Dict:
         if status not in ["connected", "disconnected"]:
             raise ValueError("Status must be either 'connected' or 'disconnected'")
 
-        user = self.find_user_by_email(email)
-        if not user:
-            raise ValueError(f"User with email {email} not found")
-
-        machine_exists = any(
-            machine["name"] == machine_name for machine in user["machines"]
+        result = await self.users.find_one_and_update(
+            {"email": email, "machines.name": machine_name},
+            {"$set": {"machines.$.status": status}},
+            projection=MACHINES_PROJECTION,
+            return_document=ReturnDocument.AFTER,
         )
-        if not machine_exists:
+        if not result:
+            # Only pay for the extra lookup on the error path
+            if not await self.users.find_one({"email": email}, {"_id": 1}):
+                raise ValueError(f"User with email {email} not found")
             raise ValueError(f"Machine {machine_name} not found for user {email}")
 
-        query = {"email": email, "machines.name": machine_name}
-        update = {"$set": {"machines.$.status": status}}
-
-        self.users.update_one(query, update)
+        return self._serialize_machines(result)
+
+    async def mark_machines_disconnected(self, machines: List[Tuple[str, str]]) -> None:
+        # Single unordered bulk write for a batch of (email, machine name) pairs
+        await self.users.bulk_write(
+            [
+                UpdateOne(
+                    {"email": email, "machines.name": machine_name},
+                    {"$set": {"machines.$.status": "disconnected"}},
+                )
+                for email, machine_name in machines
+            ],
+            ordered=False,
+        )
 
-        updated_user = self.find_user_by_email(email)
-        for machine in updated_user["machines"]:
+    @staticmethod
+    def _serialize_machines(result: Dict) -> Dict:
+        for machine in result.get("machines", []):
             machine["_id"] = str(machine["_id"])
+        return result
 
-        return updated_user
-
-    def add_report(
+    async def add_report(
         self, email: str, machine_name: str, s3_url: str, description: str
     ) -> Dict:
-        user = self.find_user_by_email(email)
-        if not user:
-            raise ValueError(f"User with email {email} not found")
-
-        # Ensure machine_name is treated as a string
-        machine_exists = any(
-            machine["name"] == machine_name for machine in user["machines"]
-        )
-        if not machine_exists:
+        if not await self.users.find_one(
+            {"email": email, "machines.name": machine_name}, {"_id": 1}
+        ):
+            if not await self.users.find_one({"email": email}, {"_id": 1}):
+                raise ValueError(f"User with email {email} not found")
             raise ValueError(f"Machine {machine_name} not found for user {email}")
 
         report = {
             "_id": ObjectId(),
+            "email": email,
             "markdown_report_s3_url": s3_url,
             "machine_name": machine_name,
             "created_at": datetime.now(timezone.utc).isoformat(),
             "description": description,
         }
 
-        result = self.users.update_one({"email": email}, {"$push": {"history": report}})
+        await self.reports.insert_one(report)
+        return report
 
-        if result.modified_count == 0:
-            raise ValueError(f"Failed to add report for user {email}")
-
-        return self.find_user_by_email(email)
-
-    def get_machine_reports(self, email: str, machine_id: str) -> List[Dict]:
-        user = self.find_user_by_email(email)
-        if not user:
-            raise ValueError(f"User with email {email} not found")
-
-        machine_obj_id = ObjectId(machine_id)
-        reports = [
-            report
-            for report in user["history"]
-            if report["machine_id"] == machine_obj_id
-        ]
-
-        return sorted(reports, key=lambda x: x["created_at"], reverse=True)
-
-    def get_all_reports(self, email: str) -> List[Dict]:
-        user = self.find_user_by_email(email)
-        if not user:
-            raise ValueError(f"User with email {email} not found")
+    async def get_machine_reports(self, email: str, machine_name: str) -> List[Dict]:
+        cursor = self.reports.find({"email": email, "machine_name": machine_name}).sort(
+            REPORTS_SORT
+        )
+        return await cursor.to_list(length=None)
+
+    async def get_all_reports(
+        self,
+        email: str,
+        limit: int = 20,
+        after: Optional[str] = None,
+        machine_name: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        query = {"email": email}
+        if machine_name:
+            query["machine_name"] = machine_name
+        if after:
+            created_at, report_id = _decode_report_cursor(after)
+            query["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "_id": {"$lt": report_id}},
+            ]
+
+        projection = None
+        if fields:
+            unknown = set(fields) - REPORT_FIELDS
+            if unknown:
+                raise ValueError(f"Unknown report fields: {', '.join(sorted(unknown))}")
+            # created_at is always needed to build the next cursor
+            projection = {field: 1 for field in fields}
+            projection["created_at"] = 1
+
+        # Fetch one extra document to know whether another page exists
+        cursor = (
+            self.reports.find(query, projection).sort(REPORTS_SORT).limit(limit + 1)
+        )
+        reports = await cursor.to_list(length=limit + 1)
 
-        reports = [report for report in user["history"]]
+        next_cursor = None
+        if len(reports) > limit:
+            reports = reports[:limit]
+            next_cursor = _encode_report_cursor(reports[-1])
 
-        return sorted(reports, key=lambda x: x["created_at"], reverse=True)
+        return reports, next_cursor
 
-    def get_machine_by_id(self, email: str, machine_id: str) -> Optional[Dict]:
-        user = self.find_user_by_email(email)
+    async def get_machine_by_id(self, email: str, machine_id: str) -> Optional[Dict]:
+        user = await self.find_user_by_email(email)
         if not user:
             raise ValueError(f"User with email {email} not found")
 
@@ -161,34 +228,79 @@ class MongoDBHandler:
                 return machine
         return None
 
-    def delete_machine(self, email: str, machine_id: str) -> Dict:
+    async def delete_machine(self, email: str, machine_id: str) -> Dict:
         machine_obj_id = ObjectId(machine_id)
-        result = self.users.update_one(
+        result = await self.users.update_one(
             {"email": email}, {"$pull": {"machines": {"_id": machine_obj_id}}}
         )
 
         if result.modified_count == 0:
             raise ValueError(f"Machine {machine_id} not found for user {email}")
 
-        return self.find_user_by_email(email)
+        return await self.find_user_by_email(email)
 
-    def get_machines(self, email: str) -> List[Dict]:
-        user = self.find_user_by_email(email)
+    async def get_machines(self, email: str) -> List[Dict]:
+        user = await self.users.find_one({"email": email}, MACHINES_PROJECTION)
         if not user:
             raise ValueError(f"User with email {email} not found")
 
-        machines = user.get("machines", [])
-        for machine in machines:
-            machine["_id"] = str(machine["_id"])
-        return machines
+        return self._serialize_machines(user).get("machines", [])
 
-    def get_report(self, email: str, report_id: str) -> Optional[Dict]:
-        user = self.find_user_by_email(email)
-        if not user:
-            raise ValueError(f"User with email {email} not found")
+    async def get_report(self, email: str, report_id: str) -> Optional[Dict]:
+        return await self.reports.find_one({"_id": ObjectId(report_id), "email": email})
 
-        report_obj_id = ObjectId(report_id)
-        for report in user["history"]:
-            if report["_id"] == report_obj_id:
-                return report
-        return None
+    async def get_cached_plan(self, intent_key: str) -> Optional[Dict]:
+        entry = await self.intent_cache.find_one(
+            {"_id": intent_key, "expires_at": {"$gt": datetime.now(timezone.utc)}}
+        )
+        return entry["plan"] if entry else None
+
+    async def cache_plan(
+        self, intent_key: str, plan: Dict, expires_at: datetime
+    ) -> None:
+        await self.intent_cache.replace_one(
+            {"_id": intent_key},
+            {
+                "plan": plan,
+                "created_at": datetime.now(timezone.utc),
+                "expires_at": expires_at,
+            },
+            upsert=True,
+        )
+
+    async def save_fleet_run(self, run: Dict) -> None:
+        await self.fleet_runs.replace_one(
+            {"_id": run["run_id"]}, {"_id": run["run_id"], **run}, upsert=True
+        )
+
+    async def get_fleet_run(self, run_id: str) -> Optional[Dict]:
+        return await self.fleet_runs.find_one({"_id": run_id}, {"_id": 0})
+
+    async def add_outbox_message(self, entry: Dict) -> None:
+        await self.outbox.insert_one(entry)
+
+    async def count_outbox_messages(self, machine_id: str) -> int:
+        return await self.outbox.count_documents(
+            {
+                "machine_id": machine_id,
+                "expires_at": {"$gt": datetime.now(timezone.utc)},
+            }
+        )
+
+    async def get_outbox_messages(self, machine_id: str) -> List[Dict]:
+        cursor = self.outbox.find(
+            {
+                "machine_id": machine_id,
+                "expires_at": {"$gt": datetime.now(timezone.utc)},
+            }
+        ).sort("_id", ASCENDING)
+        return await cursor.to_list(length=None)
+
+    async def delete_outbox_messages(self, entry_ids: List[ObjectId]) -> None:
+        await self.outbox.delete_many({"_id": {"$in": entry_ids}})
+
+    async def delete_outbox_plan(self, machine_id: str, plan_id: str) -> int:
+        result = await self.outbox.delete_many(
+            {"machine_id": machine_id, "message.plan_id": plan_id}
+        )
+        return result.deleted_count
@@ -0,0 +1,83 @@
+from typing import Optional
+
+import boto3
+import httpx
+from botocore.client import BaseClient
+from botocore.config import Config
+from motor.motor_asyncio import AsyncIOMotorClient
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from app.config import settings
+from app.database.migrations import run_migrations
+from app.database.mongo import MongoDBHandler
+from app.database.s3 import S3Handler
+from app.utils.logger import CustomLogger
+
+
+class ResourceRegistry:
+    _mongo_client: Optional[AsyncIOMotorClient] = None
+    _s3_client: Optional[BaseClient] = None
+    _mongo: Optional[MongoDBHandler] = None
+    _s3: Optional[S3Handler] = None
+    _openai_client: Optional[AsyncOpenAI] = None
+
+    @staticmethod
+    async def startup():
+        ResourceRegistry._mongo_client = AsyncIOMotorClient(
+            settings.MONGO_URI, maxPoolSize=settings.MONGO_MAX_POOL_SIZE
+        )
+        ResourceRegistry._s3_client = boto3.client(
+            "s3",
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            region_name=settings.AWS_DEFAULT_REGION,
+            config=Config(max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS),
+        )
+        ResourceRegistry._mongo = MongoDBHandler(ResourceRegistry._mongo_client)
+        ResourceRegistry._s3 = S3Handler(ResourceRegistry._s3_client)
+        ResourceRegistry._openai_client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=settings.OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.OPENAI_MAX_CONNECTIONS,
+                )
+            ),
+        )
+        CustomLogger.create_log("info", "Shared Mongo, S3 and OpenAI clients created")
+
+        await run_migrations(ResourceRegistry._mongo.db)
+
+    @staticmethod
+    async def shutdown():
+        if ResourceRegistry._mongo_client is not None:
+            ResourceRegistry._mongo_client.close()
+        if ResourceRegistry._s3_client is not None:
+            ResourceRegistry._s3_client.close()
+        if ResourceRegistry._openai_client is not None:
+            await ResourceRegistry._openai_client.close()
+
+        ResourceRegistry._mongo_client = None
+        ResourceRegistry._s3_client = None
+        ResourceRegistry._mongo = None
+        ResourceRegistry._s3 = None
+        ResourceRegistry._openai_client = None
+        CustomLogger.create_log("info", "Shared Mongo, S3 and OpenAI clients closed")
+
+    @staticmethod
+    def get_mongo() -> MongoDBHandler:
+        if ResourceRegistry._mongo is None:
+            raise RuntimeError("ResourceRegistry has not been started")
+        return ResourceRegistry._mongo
+
+    @staticmethod
+    def get_s3() -> S3Handler:
+        if ResourceRegistry._s3 is None:
+            raise RuntimeError("ResourceRegistry has not been started")
+        return ResourceRegistry._s3
+
+    @staticmethod
+    def get_openai() -> AsyncOpenAI:
+        if ResourceRegistry._openai_client is None:
+            raise RuntimeError("ResourceRegistry has not been started")
+        return ResourceRegistry._openai_client
@@ -2,20 +2,15 @@ import os
 import uuid
 from typing import Dict, List
 
-import boto3
+from botocore.client import BaseClient
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
 class S3Handler:
-    def __init__(self):
-        self.s3 = boto3.client(
-            "s3",
-            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-            region_name=os.getenv("AWS_DEFAULT_REGION"),
-        )
+    def __init__(self, client: BaseClient):
+        self.s3 = client
         self.bucket_name = os.getenv("S3_BUCKET_NAME")
 
     def upload_report(self, user_email: str, markdown_content: str) -> Dict[str, str]:
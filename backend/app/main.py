@@ -1,17 +1,34 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
 from app.api.v1.router import api_router
 from app.config import settings
+from app.database.registry import ResourceRegistry
+from app.services.MessageBusService import MessageBusService
+from app.services.PresenceService import PresenceService
+from app.services.WebSocketService import WebSocketService
 from app.utils.exception_handlers import register_exception_handlers
 from app.utils.logger import CustomLogger
 from app.utils.response import success_response
 from app.websocket.v1.router import websocket_router
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await ResourceRegistry.startup()
+    await MessageBusService.start(WebSocketService.handle_bus_message)
+    PresenceService.start()
+    yield
+    await PresenceService.stop()
+    await MessageBusService.stop()
+    await ResourceRegistry.shutdown()
+
+
 def create_app() -> FastAPI:
-    app: FastAPI = FastAPI(title=settings.PROJECT_NAME)
+    app: FastAPI = FastAPI(title=settings.PROJECT_NAME, lifespan=lifespan)
 
     app.add_middleware(
         CORSMiddleware,
@@ -1,11 +1,13 @@
+import asyncio
 import json
-import os
-from typing import Dict, List, Tuple, Union
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
 
-from dotenv import load_dotenv
-from openai import OpenAI
+from openai.types.chat import ChatCompletion
 
-load_dotenv()
+from app.config import settings
+from app.database.registry import ResourceRegistry
+from app.utils.logger import CustomLogger
 
 
 class ValidationError(Exception):
@@ -13,10 +15,43 @@ class ValidationError(Exception):
 
 
 class AIService:
+    # Attempts-per-request metrics for generate_commands, shared by all instances
+    _attempt_counts: Dict[int, int] = {}
+    _failed_requests: int = 0
+
     def __init__(self):
-        self.client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        self.client = ResourceRegistry.get_openai()
+
+    @staticmethod
+    def _record_attempts(attempts: int, succeeded: bool) -> None:
+        AIService._attempt_counts[attempts] = (
+            AIService._attempt_counts.get(attempts, 0) + 1
+        )
+        if not succeeded:
+            AIService._failed_requests += 1
+        CustomLogger.create_log(
+            "info",
+            f"generate_commands finished after {attempts} attempt(s), "
+            f"succeeded: {succeeded}",
+        )
 
-    def generate_commands(self, user_intent: str) -> Dict:
+    @staticmethod
+    def get_attempt_stats() -> Dict:
+        total_requests = sum(AIService._attempt_counts.values())
+        total_attempts = sum(
+            attempts * count for attempts, count in AIService._attempt_counts.items()
+        )
+        return {
+            "requests": total_requests,
+            "failed_requests": AIService._failed_requests,
+            "attempts": total_attempts,
+            "average_attempts": total_attempts / total_requests
+            if total_requests
+            else 0,
+            "attempts_histogram": dict(sorted(AIService._attempt_counts.items())),
+        }
+
+    async def generate_commands(self, user_intent: str) -> Dict:
         try:
             messages = [
                 {
@@ -58,24 +93,69 @@ class AIService:
                 },
             ]
 
-            while True:
-                response = self.client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=messages,
-                    temperature=0.1,
-                    response_format={"type": "json_object"},
-                )
+            deadline = time.monotonic() + settings.AI_COMMANDS_DEADLINE_SECONDS
+            last_error = None
+            attempt = 0
+
+            while attempt < settings.AI_COMMANDS_MAX_ATTEMPTS:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                attempt += 1
 
                 try:
-                    structured_response = json.loads(
-                        response.choices[0].message.content
+                    response = await asyncio.wait_for(
+                        self._timed_completion(
+                            "commands",
+                            messages,
+                            temperature=0.1,
+                            response_format={"type": "json_object"},
+                        ),
+                        timeout=remaining,
                     )
+                except asyncio.TimeoutError:
+                    last_error = "deadline exceeded while waiting for the model"
+                    break
+
+                content = response.choices[0].message.content
+                try:
+                    structured_response = json.loads(content)
                     self._validate_response_structure(structured_response)
+                    AIService._record_attempts(attempt, succeeded=True)
                     return structured_response
                 except json.JSONDecodeError:
+                    AIService._record_attempts(attempt, succeeded=False)
                     raise ValueError("Invalid response format from AI")
-                except ValidationError:
-                    continue
+                except ValidationError as e:
+                    last_error = str(e)
+                    CustomLogger.create_log(
+                        "warning", f"Rejected execution plan on attempt {attempt}: {e}"
+                    )
+
+                # Tell the model why the previous plan was rejected so the next
+                # attempt converges instead of repeating the same mistake
+                messages = messages + [
+                    {"role": "assistant", "content": content},
+                    {
+                        "role": "user",
+                        "content": f"That response was rejected: {last_error}. "
+                        "Return a corrected response with the same structure.",
+                    },
+                ]
+
+                if attempt < settings.AI_COMMANDS_MAX_ATTEMPTS:
+                    backoff = settings.AI_COMMANDS_RETRY_BACKOFF_SECONDS * (
+                        2 ** (attempt - 1)
+                    )
+                    await asyncio.sleep(
+                        min(backoff, max(deadline - time.monotonic(), 0))
+                    )
+
+            AIService._record_attempts(attempt, succeeded=False)
+            raise ValueError(
+                f"Could not generate a valid execution plan after {attempt} "
+                f"attempt(s): {last_error}"
+            )
 
         except Exception:
             raise
@@ -105,8 +185,10 @@ class AIService:
                             f"Dangerous command pattern detected: {pattern}"
                         )
 
-    def generate_report(
-        self, execution_result: Dict[str, Union[str, List[str]]]
+    async def generate_report(
+        self,
+        execution_result: Dict[str, Union[str, List[str]]],
+        on_token: Optional[Callable[[str], Awaitable[None]]] = None,
     ) -> Tuple[str, str]:
         try:
             messages = [
@@ -143,14 +225,6 @@ class AIService:
                 },
             ]
 
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                temperature=0.7,
-            )
-
-            report_content = response.choices[0].message.content
-
             # Generate a one-liner description
             description_messages = [
                 {
@@ -169,10 +243,29 @@ class AIService:
                 },
             ]
 
-            description_response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=description_messages,
-                temperature=0.7,
+            # Both completions only depend on the execution result, so issue them
+            # concurrently and pay for the slower one instead of their sum
+            started_at = time.perf_counter()
+            tasks = [
+                asyncio.create_task(self._generate_report_content(messages, on_token)),
+                asyncio.create_task(
+                    self._timed_completion(
+                        "description", description_messages, temperature=0.7
+                    )
+                ),
+            ]
+            try:
+                report_content, description_response = await asyncio.gather(*tasks)
+            except BaseException:
+                # Stop the other completion before the error propagates, so a
+                # failed description doesn't leave the report streaming on
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            CustomLogger.create_log(
+                "info",
+                f"Report generation took {time.perf_counter() - started_at:.2f}s",
             )
 
             description = description_response.choices[0].message.content
@@ -181,3 +274,56 @@ class AIService:
 
         except Exception as e:
             raise Exception(f"Error generating report: {str(e)}")
+
+    async def _generate_report_content(
+        self,
+        messages: List[Dict],
+        on_token: Optional[Callable[[str], Awaitable[None]]],
+    ) -> str:
+        if on_token is None:
+            response = await self._timed_completion("report", messages, temperature=0.7)
+            return response.choices[0].message.content
+
+        # Forward tokens as they arrive and assemble the full report for storage
+        started_at = time.perf_counter()
+        first_token_at = None
+        parts = []
+        stream = await self.client.chat.completions.create(
+            model="gpt-4o-mini", messages=messages, temperature=0.7, stream=True
+        )
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if not token:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+                CustomLogger.create_log(
+                    "info",
+                    f"OpenAI report first token after "
+                    f"{first_token_at - started_at:.2f}s",
+                )
+            parts.append(token)
+            await on_token(token)
+
+        CustomLogger.create_log(
+            "info",
+            f"OpenAI report stream took {time.perf_counter() - started_at:.2f}s",
+        )
+        return "".join(parts)
+
+    async def _timed_completion(
+        self, label: str, messages: List[Dict], **kwargs
+    ) -> ChatCompletion:
+        started_at = time.perf_counter()
+        try:
+            return await self.client.chat.completions.create(
+                model="gpt-4o-mini", messages=messages, **kwargs
+            )
+        finally:
+            CustomLogger.create_log(
+                "info",
+                f"OpenAI {label} completion took "
+                f"{time.perf_counter() - started_at:.2f}s",
+            )
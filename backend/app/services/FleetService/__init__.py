@@ -0,0 +1,330 @@
+import asyncio
+import uuid
+from datetime import datetime, timezone
+from typing import Awaitable, Dict, List, Optional
+
+from app.config import settings
+from app.database.registry import ResourceRegistry
+from app.services.WebSocketService import WebSocketService
+from app.utils.logger import CustomLogger
+
+# Execute options passed through to every machine in the run
+EXECUTE_OPTIONS = ["timeout", "command_timeout", "limits"]
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class FleetRun:
+    def __init__(
+        self,
+        execution_plan: Dict,
+        machine_ids: List[str],
+        parallelism: int,
+        canary: int,
+        wave_size: int,
+        max_failures: int,
+        options: Dict,
+    ):
+        self.run_id = uuid.uuid4().hex
+        self.execution_plan = execution_plan
+        self.parallelism = parallelism
+        self.canary = canary
+        self.wave_size = wave_size
+        self.max_failures = max_failures
+        self.options = options
+        self.status = "running"
+        self.wave = 0
+        self.created_at = _now()
+        self.ended_at = None
+        self.machines: Dict[str, Dict] = {
+            machine_id: {"status": "pending"} for machine_id in machine_ids
+        }
+        self.cancelled = asyncio.Event()
+
+    def waves(self) -> List[List[str]]:
+        # Canary machines go first on their own; the rest follow in waves
+        machine_ids = list(self.machines)
+        waves = []
+        if self.canary:
+            waves.append(machine_ids[: self.canary])
+            machine_ids = machine_ids[self.canary :]
+        size = self.wave_size or len(machine_ids) or 1
+        waves.extend(
+            machine_ids[i : i + size] for i in range(0, len(machine_ids), size)
+        )
+        return waves
+
+    @property
+    def failures(self) -> int:
+        return sum(state["status"] == "failed" for state in self.machines.values())
+
+    def counts(self) -> Dict[str, int]:
+        counts = {}
+        for state in self.machines.values():
+            counts[state["status"]] = counts.get(state["status"], 0) + 1
+        return counts
+
+    def to_dict(self, include_machines: bool = True) -> Dict:
+        run = {
+            "run_id": self.run_id,
+            "status": self.status,
+            "wave": self.wave,
+            "waves": len(self.waves()),
+            "parallelism": self.parallelism,
+            "canary": self.canary,
+            "wave_size": self.wave_size,
+            "max_failures": self.max_failures,
+            "created_at": self.created_at,
+            "ended_at": self.ended_at,
+            "counts": self.counts(),
+        }
+        if include_machines:
+            run["execution_plan"] = self.execution_plan
+            run["machines"] = self.machines
+        return run
+
+
+class FleetService:
+    _runs: Dict[str, FleetRun] = {}
+    _tasks: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def resolve_targets(targets: Dict) -> List[str]:
+        if not isinstance(targets, dict):
+            raise ValueError("targets must be an object")
+        machine_ids = targets.get("machine_ids")
+        if machine_ids:
+            if not isinstance(machine_ids, list) or not all(
+                isinstance(machine_id, str) for machine_id in machine_ids
+            ):
+                raise ValueError("machine_ids must be a list of strings")
+            # Keep the caller's order, which decides the canary and waves
+            return list(dict.fromkeys(machine_ids))
+        if targets.get("owner") or targets.get("tag"):
+            # Owners and tags are only known for machines on this node
+            if settings.MESSAGE_BUS_BACKEND != "memory":
+                raise ValueError(
+                    "owner and tag targets are not supported with multiple nodes; "
+                    "pass machine_ids instead"
+                )
+            return WebSocketService.find_machines(
+                owner=targets.get("owner"), tag=targets.get("tag")
+            )
+        raise ValueError("Targets must include machine_ids, owner or tag")
+
+    @staticmethod
+    async def dispatch(
+        execution_plan: Dict,
+        targets: Dict,
+        parallelism: Optional[int] = None,
+        canary: int = 0,
+        wave_size: int = 0,
+        max_failures: int = 0,
+        options: Optional[Dict] = None,
+    ) -> Dict:
+        if not isinstance(execution_plan, dict) or "categories" not in execution_plan:
+            raise ValueError("execution_plan with categories is required")
+        if min(canary, wave_size, max_failures) < 0:
+            raise ValueError("canary, wave_size and max_failures cannot be negative")
+
+        machine_ids = FleetService.resolve_targets(targets)
+        if not machine_ids:
+            raise ValueError("No machines match the given targets")
+
+        run = FleetRun(
+            execution_plan,
+            machine_ids,
+            max(parallelism or settings.FLEET_DEFAULT_PARALLELISM, 1),
+            canary,
+            wave_size,
+            max_failures,
+            {
+                key: options[key]
+                for key in EXECUTE_OPTIONS
+                if options and options.get(key) is not None
+            },
+        )
+        FleetService._runs[run.run_id] = run
+        await FleetService._save(run)
+        FleetService._tasks[run.run_id] = asyncio.create_task(FleetService._run(run))
+
+        CustomLogger.create_log(
+            "info",
+            f"Fleet run {run.run_id} dispatching to {len(machine_ids)} machines "
+            f"in {len(run.waves())} waves",
+        )
+        return run.to_dict()
+
+    @staticmethod
+    async def _run(run: FleetRun):
+        semaphore = asyncio.Semaphore(run.parallelism)
+        try:
+            for number, wave in enumerate(run.waves(), start=1):
+                if run.status != "running":
+                    break
+                run.wave = number
+                await FleetService._publish_run(run)
+                await asyncio.gather(
+                    *(
+                        FleetService._run_machine(run, machine_id, semaphore)
+                        for machine_id in wave
+                    )
+                )
+                # Stop rolling out once the failure budget is spent, so a bad
+                # plan only reaches the canary or the current wave
+                if run.status == "running" and run.failures > run.max_failures:
+                    run.status = "aborted"
+                    CustomLogger.create_log(
+                        "warning",
+                        f"Fleet run {run.run_id} aborted after wave {number}: "
+                        f"{run.failures} failures",
+                    )
+        except Exception as e:
+            CustomLogger.create_log("error", f"Fleet run {run.run_id} failed: {e}")
+            run.status = "failed"
+        finally:
+            for state in run.machines.values():
+                if state["status"] == "pending":
+                    state["status"] = "skipped"
+            if run.status == "running":
+                run.status = "completed"
+            run.ended_at = _now()
+            await FleetService._save(run)
+            await FleetService._publish_run(run)
+            # Finished runs are served from Mongo
+            FleetService._tasks.pop(run.run_id, None)
+            FleetService._runs.pop(run.run_id, None)
+
+    @staticmethod
+    async def _run_machine(
+        run: FleetRun, machine_id: str, semaphore: asyncio.Semaphore
+    ):
+        async with semaphore:
+            if run.status != "running":
+                return
+
+            state = run.machines[machine_id]
+            state.update(
+                status="running",
+                plan_id=f"{run.run_id}-{machine_id}",
+                started_at=_now(),
+            )
+            await FleetService._publish_machine(run, machine_id)
+
+            try:
+                # The client answers with plan_complete once the whole plan ran
+                reply = await FleetService._wait_for_machine(
+                    run,
+                    WebSocketService.request_machine(
+                        machine_id,
+                        {
+                            "type": "execute",
+                            "plan_id": state["plan_id"],
+                            "execution_plan": run.execution_plan,
+                            **run.options,
+                        },
+                        timeout=settings.FLEET_MACHINE_TIMEOUT_SECONDS,
+                    ),
+                )
+                if reply.get("success"):
+                    state["status"] = "succeeded"
+                elif reply.get("stop_reason") == "cancelled":
+                    state["status"] = "cancelled"
+                else:
+                    state["status"] = "failed"
+                state["stop_reason"] = reply.get("stop_reason")
+                state["error"] = reply.get("error")
+            except ValueError as e:
+                state.update(status="failed", error=str(e))
+
+            state["ended_at"] = _now()
+            await FleetService._publish_machine(run, machine_id)
+
+    @staticmethod
+    async def _wait_for_machine(run: FleetRun, request: Awaitable[Dict]) -> Dict:
+        request = asyncio.ensure_future(request)
+        cancelled = asyncio.ensure_future(run.cancelled.wait())
+        try:
+            await asyncio.wait(
+                {request, cancelled}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not request.done():
+                # Give the machine a moment to confirm the cancel, but don't
+                # wait out the full timeout for a plan that was dropped from the
+                # outbox or a machine that went away
+                await asyncio.wait(
+                    {request}, timeout=settings.MACHINE_REQUEST_TIMEOUT_SECONDS
+                )
+        finally:
+            cancelled.cancel()
+
+        if request.done():
+            return request.result()
+        request.cancel()
+        return {"success": False, "stop_reason": "cancelled"}
+
+    @staticmethod
+    async def get_run(run_id: str) -> Optional[Dict]:
+        run = FleetService._runs.get(run_id)
+        if run is not None:
+            return run.to_dict()
+        return await ResourceRegistry.get_mongo().get_fleet_run(run_id)
+
+    @staticmethod
+    async def cancel_run(run_id: str) -> Dict:
+        run = FleetService._runs.get(run_id)
+        if run is None:
+            raise ValueError(f"Fleet run {run_id} is not active")
+
+        if run.status == "running":
+            run.status = "cancelled"
+            running = [
+                (machine_id, state["plan_id"])
+                for machine_id, state in run.machines.items()
+                if state["status"] == "running"
+            ]
+            await asyncio.gather(
+                *(
+                    WebSocketService.send_to_machine(
+                        machine_id, {"type": "cancel", "plan_id": plan_id}
+                    )
+                    for machine_id, plan_id in running
+                )
+            )
+            # Stops the waits on machines that never confirm the cancel
+            run.cancelled.set()
+            CustomLogger.create_log(
+                "info",
+                f"Fleet run {run_id} cancelled, {len(running)} machines stopping",
+            )
+        return run.to_dict(include_machines=False)
+
+    @staticmethod
+    async def _save(run: FleetRun):
+        try:
+            await ResourceRegistry.get_mongo().save_fleet_run(run.to_dict())
+        except Exception as e:
+            CustomLogger.create_log("error", f"Failed to save fleet run: {e}")
+
+    @staticmethod
+    async def _publish_run(run: FleetRun):
+        await WebSocketService.publish_run_event(
+            run.run_id,
+            {"type": "fleet_run_update", "run": run.to_dict(include_machines=False)},
+        )
+
+    @staticmethod
+    async def _publish_machine(run: FleetRun, machine_id: str):
+        # Per-machine updates stay small; subscribers fold them into the run
+        await WebSocketService.publish_run_event(
+            run.run_id,
+            {
+                "type": "fleet_machine_update",
+                "run_id": run.run_id,
+                "machine_id": machine_id,
+                "state": run.machines[machine_id],
+                "counts": run.counts(),
+            },
+        )
@@ -0,0 +1,131 @@
+import copy
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Set, Tuple
+
+from app.config import settings
+from app.database.registry import ResourceRegistry
+from app.utils.logger import CustomLogger
+
+
+class IntentCacheService:
+    # normalized intent -> (execution plan, expiry as monotonic time, shingles)
+    _entries: "OrderedDict[str, Tuple[Dict, float, Set[str]]]" = OrderedDict()
+    _stats: Dict[str, int] = {
+        "exact_hits": 0,
+        "similar_hits": 0,
+        "persistent_hits": 0,
+        "misses": 0,
+    }
+
+    @staticmethod
+    def normalize(user_intent: str) -> str:
+        # The cached plan is executable, so anything that can change what it
+        # targets (case, paths, flags, globs, redirections, quoting) stays in
+        # the key; only spacing and a sentence's final period are dropped
+        text = re.sub(r"(?<=\w)\.\s*$", "", user_intent.strip())
+        return " ".join(text.split())
+
+    @staticmethod
+    def _shingles(text: str, size: int = 3) -> Set[str]:
+        padded = f" {text} "
+        return {padded[i : i + size] for i in range(max(len(padded) - size + 1, 1))}
+
+    @staticmethod
+    async def get(user_intent: str) -> Optional[Dict]:
+        key = IntentCacheService.normalize(user_intent)
+        if not key:
+            IntentCacheService._stats["misses"] += 1
+            return None
+        now = time.monotonic()
+
+        entry = IntentCacheService._entries.get(key)
+        if entry and entry[1] > now:
+            IntentCacheService._entries.move_to_end(key)
+            IntentCacheService._stats["exact_hits"] += 1
+            return copy.deepcopy(entry[0])
+        if entry:
+            del IntentCacheService._entries[key]
+
+        if settings.INTENT_CACHE_SIMILARITY_THRESHOLD < 1:
+            match = IntentCacheService._find_similar(key, now)
+            if match is not None:
+                IntentCacheService._entries.move_to_end(match)
+                IntentCacheService._stats["similar_hits"] += 1
+                CustomLogger.create_log(
+                    "debug", f"Intent cache similar hit: '{key}' -> '{match}'"
+                )
+                return copy.deepcopy(IntentCacheService._entries[match][0])
+
+        try:
+            plan = await ResourceRegistry.get_mongo().get_cached_plan(key)
+        except Exception as e:
+            CustomLogger.create_log("warning", f"Intent cache lookup failed: {e}")
+            plan = None
+
+        if plan is not None:
+            IntentCacheService._store(key, plan)
+            IntentCacheService._stats["persistent_hits"] += 1
+            return copy.deepcopy(plan)
+
+        IntentCacheService._stats["misses"] += 1
+        return None
+
+    @staticmethod
+    async def set(user_intent: str, plan: Dict) -> None:
+        key = IntentCacheService.normalize(user_intent)
+        if not key:
+            return
+        IntentCacheService._store(key, copy.deepcopy(plan))
+
+        expires_at = datetime.now(timezone.utc) + timedelta(
+            seconds=settings.INTENT_CACHE_TTL_SECONDS
+        )
+        try:
+            await ResourceRegistry.get_mongo().cache_plan(key, plan, expires_at)
+        except Exception as e:
+            CustomLogger.create_log("warning", f"Intent cache write failed: {e}")
+
+    @staticmethod
+    def get_stats() -> Dict:
+        return {**IntentCacheService._stats, "size": len(IntentCacheService._entries)}
+
+    @staticmethod
+    def _store(key: str, plan: Dict) -> None:
+        expires_at = time.monotonic() + settings.INTENT_CACHE_TTL_SECONDS
+        IntentCacheService._entries[key] = (
+            plan,
+            expires_at,
+            IntentCacheService._shingles(key),
+        )
+        IntentCacheService._entries.move_to_end(key)
+
+        while len(IntentCacheService._entries) > settings.INTENT_CACHE_MAX_ENTRIES:
+            IntentCacheService._entries.popitem(last=False)
+
+    @staticmethod
+    def _find_similar(key: str, now: float) -> Optional[str]:
+        shingles = IntentCacheService._shingles(key)
+        numbers = re.findall(r"\d+", key)
+        best_key, best_score = None, settings.INTENT_CACHE_SIMILARITY_THRESHOLD
+
+        for candidate, (_, expires_at, candidate_shingles) in list(
+            IntentCacheService._entries.items()
+        ):
+            if expires_at <= now:
+                del IntentCacheService._entries[candidate]
+                continue
+            # "install node 18" must never be served the plan for "install node 20"
+            if re.findall(r"\d+", candidate) != numbers:
+                continue
+
+            # Jaccard similarity of character trigrams
+            score = len(shingles & candidate_shingles) / len(
+                shingles | candidate_shingles
+            )
+            if score >= best_score:
+                best_key, best_score = candidate, score
+
+        return best_key
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import os
+import socket
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from app.config import settings
+from app.utils.logger import CustomLogger
+
+BusHandler = Callable[[dict], Awaitable[None]]
+
+BROADCAST_CHANNEL = "broadcast"
+
+
+def node_channel(node_id: str) -> str:
+    return f"node:{node_id}"
+
+
+# Cross-process transport between server nodes, plus a presence directory of
+# which node currently holds each machine's socket
+class MessageBus(ABC):
+    @abstractmethod
+    async def start(self, node_id: str, handler: BusHandler) -> None: ...
+
+    @abstractmethod
+    async def stop(self) -> None: ...
+
+    # Returns the number of receivers the message was delivered to
+    @abstractmethod
+    async def publish(self, channel: str, message: dict) -> int: ...
+
+    @abstractmethod
+    async def set_presence(self, machine_id: str, node_id: str) -> None: ...
+
+    @abstractmethod
+    async def remove_presence(self, machine_id: str, node_id: str) -> None: ...
+
+    @abstractmethod
+    async def get_presence(self, machine_id: str) -> Optional[str]: ...
+
+
+class InMemoryMessageBus(MessageBus):
+    # Shared at class level so several nodes in one process (e.g. in tests) can
+    # talk to each other
+    _handlers: Dict[str, List[BusHandler]] = {}
+    _presence: Dict[str, str] = {}
+    _tasks: Set[asyncio.Task] = set()
+
+    def __init__(self):
+        self._channels: List[str] = []
+        self._handler: Optional[BusHandler] = None
+
+    async def start(self, node_id: str, handler: BusHandler) -> None:
+        self._handler = handler
+        self._channels = [node_channel(node_id), BROADCAST_CHANNEL]
+        for channel in self._channels:
+            InMemoryMessageBus._handlers.setdefault(channel, []).append(handler)
+
+    async def stop(self) -> None:
+        for channel in self._channels:
+            handlers = InMemoryMessageBus._handlers.get(channel, [])
+            if self._handler in handlers:
+                handlers.remove(self._handler)
+        self._channels = []
+
+    async def publish(self, channel: str, message: dict) -> int:
+        handlers = list(InMemoryMessageBus._handlers.get(channel, []))
+        for handler in handlers:
+            task = asyncio.create_task(handler(message))
+            InMemoryMessageBus._tasks.add(task)
+            task.add_done_callback(InMemoryMessageBus._tasks.discard)
+        return len(handlers)
+
+    async def set_presence(self, machine_id: str, node_id: str) -> None:
+        InMemoryMessageBus._presence[machine_id] = node_id
+
+    async def remove_presence(self, machine_id: str, node_id: str) -> None:
+        if InMemoryMessageBus._presence.get(machine_id) == node_id:
+            del InMemoryMessageBus._presence[machine_id]
+
+    async def get_presence(self, machine_id: str) -> Optional[str]:
+        return InMemoryMessageBus._presence.get(machine_id)
+
+
+class RedisMessageBus(MessageBus):
+    PREFIX = "sticktator"
+
+    # Only delete the presence entry if it still points at this node, so a node
+    # that lost a machine cannot erase the entry of the node that now holds it
+    _REMOVE_PRESENCE_SCRIPT = """
+    if redis.call("GET", KEYS[1]) == ARGV[1] then
+        return redis.call("DEL", KEYS[1])
+    end
+    return 0
+    """
+
+    # Backoff between attempts to resubscribe after the connection drops
+    RECONNECT_MIN_DELAY = 0.5
+    RECONNECT_MAX_DELAY = 30.0
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError(
+                "The redis package is required for MESSAGE_BUS_BACKEND=redis"
+            )
+
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._pubsub = None
+        self._channels: List[str] = []
+        self._listener: Optional[asyncio.Task] = None
+
+    def _key(self, *parts: str) -> str:
+        return ":".join([self.PREFIX, *parts])
+
+    async def start(self, node_id: str, handler: BusHandler) -> None:
+        self._channels = [
+            self._key(node_channel(node_id)),
+            self._key(BROADCAST_CHANNEL),
+        ]
+        await self._subscribe()
+        self._listener = asyncio.create_task(self._listen(handler))
+
+    async def _subscribe(self) -> None:
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(*self._channels)
+
+    async def _close_pubsub(self) -> None:
+        pubsub, self._pubsub = self._pubsub, None
+        if pubsub is not None:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+    async def _listen(self, handler: BusHandler) -> None:
+        # A dropped Redis connection ends the subscription; keep resubscribing
+        # so this node does not go deaf to the other nodes
+        delay = self.RECONNECT_MIN_DELAY
+        while True:
+            try:
+                if self._pubsub is None:
+                    await self._subscribe()
+                    CustomLogger.create_log("info", "Message bus resubscribed")
+                async for item in self._pubsub.listen():
+                    delay = self.RECONNECT_MIN_DELAY
+                    try:
+                        await handler(json.loads(item["data"]))
+                    except Exception as e:
+                        CustomLogger.create_log(
+                            "error", f"Error handling bus message: {e}"
+                        )
+                error = "subscription ended"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = str(e)
+
+            CustomLogger.create_log(
+                "error",
+                f"Message bus connection lost ({error}), resubscribing in {delay:.1f}s",
+            )
+            await self._close_pubsub()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+        await self._close_pubsub()
+        await self._redis.aclose()
+
+    async def publish(self, channel: str, message: dict) -> int:
+        return await self._redis.publish(self._key(channel), json.dumps(message))
+
+    async def set_presence(self, machine_id: str, node_id: str) -> None:
+        await self._redis.set(self._key("presence", machine_id), node_id)
+
+    async def remove_presence(self, machine_id: str, node_id: str) -> None:
+        await self._redis.eval(
+            self._REMOVE_PRESENCE_SCRIPT,
+            1,
+            self._key("presence", machine_id),
+            node_id,
+        )
+
+    async def get_presence(self, machine_id: str) -> Optional[str]:
+        return await self._redis.get(self._key("presence", machine_id))
+
+
+class MessageBusService:
+    node_id: str = settings.NODE_ID or f"{socket.gethostname()}-{os.getpid()}"
+    _bus: Optional[MessageBus] = None
+
+    @staticmethod
+    async def start(handler: BusHandler):
+        if settings.MESSAGE_BUS_BACKEND == "redis":
+            if not settings.REDIS_URL:
+                raise RuntimeError(
+                    "REDIS_URL is required for MESSAGE_BUS_BACKEND=redis"
+                )
+            bus = RedisMessageBus(settings.REDIS_URL)
+        elif settings.MESSAGE_BUS_BACKEND == "memory":
+            bus = InMemoryMessageBus()
+        else:
+            raise RuntimeError(
+                f"Unknown MESSAGE_BUS_BACKEND: {settings.MESSAGE_BUS_BACKEND}"
+            )
+
+        await bus.start(MessageBusService.node_id, handler)
+        MessageBusService._bus = bus
+        CustomLogger.create_log(
+            "info",
+            f"Message bus started: {settings.MESSAGE_BUS_BACKEND}, "
+            f"node: {MessageBusService.node_id}",
+        )
+
+    @staticmethod
+    async def stop():
+        if MessageBusService._bus is not None:
+            await MessageBusService._bus.stop()
+            MessageBusService._bus = None
+
+    @staticmethod
+    def get_bus() -> MessageBus:
+        if MessageBusService._bus is None:
+            raise RuntimeError("MessageBusService has not been started")
+        return MessageBusService._bus
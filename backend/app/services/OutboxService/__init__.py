@@ -0,0 +1,174 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from bson import ObjectId
+
+from app.config import settings
+from app.database.registry import ResourceRegistry
+from app.utils.logger import CustomLogger
+
+
+# Messages for machines that are offline, delivered in order when they come
+# back. Entries live in Mongo so they survive restarts and reach whichever node
+# the machine reconnects to; the in-memory tier only holds what this node could
+# not write there yet, so it is never delivered a second time from here
+class OutboxService:
+    _entries: Dict[str, "OrderedDict[ObjectId, Dict]"] = {}
+    _flushing: Set[str] = set()
+
+    @staticmethod
+    async def enqueue(
+        machine_id: str, message: dict, ttl_seconds: Optional[int] = None
+    ) -> Dict:
+        try:
+            stored = await ResourceRegistry.get_mongo().count_outbox_messages(
+                machine_id
+            )
+        except Exception as e:
+            CustomLogger.create_log("warning", f"Outbox count failed: {e}")
+            stored = 0
+        held = len(OutboxService._entries.get(machine_id, {}))
+        if stored + held >= settings.OUTBOX_MAX_MESSAGES_PER_MACHINE:
+            raise ValueError(f"Outbox for machine {machine_id} is full")
+
+        now = datetime.now(timezone.utc)
+        entry = {
+            "_id": ObjectId(),
+            "machine_id": machine_id,
+            "message": message,
+            "created_at": now,
+            "expires_at": now
+            + timedelta(seconds=ttl_seconds or settings.OUTBOX_TTL_SECONDS),
+        }
+        await OutboxService._store(machine_id, entry)
+
+        CustomLogger.create_log(
+            "info", f"Queued message for offline machine {machine_id}"
+        )
+        return entry
+
+    @staticmethod
+    async def _store(machine_id: str, entry: Dict) -> None:
+        # Held in memory while the write is in flight, so a flush starting
+        # meanwhile still delivers it
+        OutboxService._entries.setdefault(machine_id, OrderedDict())[entry["_id"]] = (
+            entry
+        )
+        try:
+            await ResourceRegistry.get_mongo().add_outbox_message(entry)
+        except Exception as e:
+            CustomLogger.create_log(
+                "warning", f"Outbox write failed, keeping message in memory: {e}"
+            )
+            return
+
+        entries = OutboxService._entries.get(machine_id)
+        if entries is not None and entries.pop(entry["_id"], None) is not None:
+            if not entries:
+                del OutboxService._entries[machine_id]
+            return
+
+        # A flush took it during the write; the stored copy would come back
+        # on the next reconnect
+        try:
+            await ResourceRegistry.get_mongo().delete_outbox_messages([entry["_id"]])
+        except Exception as e:
+            CustomLogger.create_log("warning", f"Outbox cleanup failed: {e}")
+
+    @staticmethod
+    def is_flushing(machine_id: str) -> bool:
+        return machine_id in OutboxService._flushing
+
+    @staticmethod
+    def begin_flush(machine_id: str) -> bool:
+        if machine_id in OutboxService._flushing:
+            return False
+        OutboxService._flushing.add(machine_id)
+        return True
+
+    @staticmethod
+    async def flush(machine_id: str, send: Callable[[dict], Awaitable[bool]]) -> int:
+        """Delivers the queued messages in order; the caller marks the machine
+        with begin_flush first so new executes queue up behind them"""
+        delivered = []
+        taken = set()
+        try:
+            # Taken before the read, so a write finishing in between is
+            # either in the read or still held here
+            held = OutboxService._entries.pop(machine_id, {})
+            try:
+                stored = await ResourceRegistry.get_mongo().get_outbox_messages(
+                    machine_id
+                )
+            except Exception as e:
+                CustomLogger.create_log("warning", f"Outbox read failed: {e}")
+                stored = []
+            pending = {entry["_id"]: entry for entry in stored}
+
+            while True:
+                taken.update(held)
+                pending.update(held)
+                if not pending:
+                    break
+
+                for entry_id in sorted(pending):
+                    entry = pending[entry_id]
+                    if not OutboxService._expired(entry) and not await send(
+                        entry["message"]
+                    ):
+                        # Keep the rest for the next reconnect; what came from
+                        # memory is not in Mongo yet
+                        for unsent_id in sorted(pending):
+                            if unsent_id in taken:
+                                await OutboxService._store(
+                                    machine_id, pending[unsent_id]
+                                )
+                        return len(delivered)
+                    del pending[entry_id]
+                    delivered.append(entry_id)
+
+                # Also picks up messages queued while this flush was sending
+                held = OutboxService._entries.pop(machine_id, {})
+        finally:
+            OutboxService._flushing.discard(machine_id)
+            if delivered:
+                try:
+                    await ResourceRegistry.get_mongo().delete_outbox_messages(delivered)
+                except Exception as e:
+                    CustomLogger.create_log("warning", f"Outbox cleanup failed: {e}")
+
+        if delivered:
+            CustomLogger.create_log(
+                "info",
+                f"Flushed {len(delivered)} queued message(s) to machine {machine_id}",
+            )
+        return len(delivered)
+
+    @staticmethod
+    async def discard(machine_id: str, plan_id: str) -> int:
+        entries = OutboxService._entries.get(machine_id, {})
+        matching = [
+            entry_id
+            for entry_id, entry in entries.items()
+            if entry["message"].get("plan_id") == plan_id
+        ]
+        for entry_id in matching:
+            del entries[entry_id]
+
+        try:
+            stored = await ResourceRegistry.get_mongo().delete_outbox_plan(
+                machine_id, plan_id
+            )
+        except Exception as e:
+            CustomLogger.create_log("warning", f"Outbox delete failed: {e}")
+            stored = 0
+        return max(len(matching), stored)
+
+    @staticmethod
+    def _expired(entry: Dict) -> bool:
+        expires_at = entry["expires_at"]
+        # Mongo hands datetimes back without a timezone
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        return expires_at <= datetime.now(timezone.utc)
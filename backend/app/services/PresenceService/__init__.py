@@ -0,0 +1,163 @@
+import asyncio
+import math
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.config import settings
+from app.database.registry import ResourceRegistry
+from app.services.WebSocketService import WebSocketService
+from app.utils.logger import CustomLogger
+
+
+# Tracks when each connected machine was last heard from. Deadlines live in a
+# timer wheel with one slot per sweep interval, so a heartbeat is O(1) and each
+# sweep only looks at the machines whose deadline fell in the current slot
+class PresenceService:
+    # machine id -> (owner email, machine name)
+    _machines: Dict[str, Tuple[str, str]] = {}
+    _wheel: List[Set[str]] = []
+    _slots: Dict[str, int] = {}
+    _cursor: int = 0
+    # Machines whose socket closed, marked disconnected on the next sweep
+    _departed: Dict[str, Tuple[str, str]] = {}
+    _task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def start():
+        ticks = math.ceil(
+            settings.PRESENCE_TIMEOUT_SECONDS / settings.PRESENCE_SWEEP_INTERVAL_SECONDS
+        )
+        PresenceService._wheel = [set() for _ in range(ticks + 1)]
+        PresenceService._slots = {}
+        PresenceService._cursor = 0
+        PresenceService._task = asyncio.create_task(PresenceService._sweep_loop())
+
+    @staticmethod
+    async def stop():
+        if PresenceService._task is not None:
+            PresenceService._task.cancel()
+            try:
+                await PresenceService._task
+            except asyncio.CancelledError:
+                pass
+            PresenceService._task = None
+        # Don't leave machines that dropped just before shutdown marked connected
+        try:
+            await PresenceService._mark_offline({})
+        except Exception as e:
+            CustomLogger.create_log("error", f"Presence flush failed: {e}")
+
+    @staticmethod
+    async def machine_online(machine_id: str, email: str, machine_name: str):
+        PresenceService._departed.pop(machine_id, None)
+        PresenceService._machines[machine_id] = (email, machine_name)
+        PresenceService.heartbeat(machine_id)
+        await PresenceService._publish(machine_id, email, machine_name, "connected")
+
+    @staticmethod
+    def heartbeat(machine_id: str):
+        if machine_id not in PresenceService._machines or not PresenceService._wheel:
+            return
+        wheel = PresenceService._wheel
+        previous = PresenceService._slots.get(machine_id)
+        if previous is not None:
+            wheel[previous].discard(machine_id)
+        slot = (PresenceService._cursor + len(wheel) - 1) % len(wheel)
+        wheel[slot].add(machine_id)
+        PresenceService._slots[machine_id] = slot
+
+    @staticmethod
+    async def machine_offline(machine_id: str, reason: str):
+        # The machine said goodbye itself and its status is already stored
+        info = PresenceService._untrack(machine_id)
+        if info is not None:
+            await PresenceService._publish(machine_id, *info, "disconnected", reason)
+
+    @staticmethod
+    def machine_left(machine_id: str):
+        info = PresenceService._untrack(machine_id)
+        if info is not None:
+            PresenceService._departed[machine_id] = info
+
+    @staticmethod
+    def _untrack(machine_id: str) -> Optional[Tuple[str, str]]:
+        slot = PresenceService._slots.pop(machine_id, None)
+        if slot is not None:
+            PresenceService._wheel[slot].discard(machine_id)
+        return PresenceService._machines.pop(machine_id, None)
+
+    @staticmethod
+    async def _sweep_loop():
+        while True:
+            await asyncio.sleep(settings.PRESENCE_SWEEP_INTERVAL_SECONDS)
+            try:
+                await PresenceService._sweep()
+            except Exception as e:
+                CustomLogger.create_log("error", f"Presence sweep failed: {e}")
+
+    @staticmethod
+    async def _sweep():
+        wheel = PresenceService._wheel
+        PresenceService._cursor = (PresenceService._cursor + 1) % len(wheel)
+        expired = wheel[PresenceService._cursor]
+        wheel[PresenceService._cursor] = set()
+
+        stale = {}
+        for machine_id in expired:
+            PresenceService._slots.pop(machine_id, None)
+            stale[machine_id] = PresenceService._machines.pop(machine_id)
+
+        for machine_id in stale:
+            CustomLogger.create_log(
+                "warning", f"Machine {machine_id} missed its heartbeats, dropping"
+            )
+            await WebSocketService.drop_machine(machine_id)
+
+        await PresenceService._mark_offline(stale)
+
+    @staticmethod
+    async def _mark_offline(stale: Dict[str, Tuple[str, str]]):
+        # Machines that came back before the sweep were already dropped from
+        # _departed by machine_online
+        offline = {**PresenceService._departed, **stale}
+        PresenceService._departed = {}
+        if not offline:
+            return
+
+        # One batched write for every machine that went away since last sweep
+        try:
+            await ResourceRegistry.get_mongo().mark_machines_disconnected(
+                list(offline.values())
+            )
+        except Exception:
+            # Retry on the next sweep
+            PresenceService._departed.update(offline)
+            raise
+
+        for machine_id, (email, machine_name) in offline.items():
+            await PresenceService._publish(
+                machine_id,
+                email,
+                machine_name,
+                "disconnected",
+                "heartbeat_timeout" if machine_id in stale else "connection_closed",
+            )
+
+    @staticmethod
+    async def _publish(
+        machine_id: str,
+        email: str,
+        machine_name: str,
+        status: str,
+        reason: Optional[str] = None,
+    ):
+        await WebSocketService.publish_machine_event(
+            machine_id,
+            {
+                "type": "presence_changed",
+                "machine_id": machine_id,
+                "machine_name": machine_name,
+                "status": status,
+                "reason": reason,
+            },
+            owner=email,
+        )
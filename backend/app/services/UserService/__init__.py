@@ -1,9 +1,9 @@
 from typing import Dict
 
-from app.database.mongo import MongoDBHandler
+from app.database.registry import ResourceRegistry
 
 
 class UserService:
     @staticmethod
-    def create_user(name: str, email: str, image: str) -> Dict:
-        return MongoDBHandler().create_user(name, email, image)
+    async def create_user(name: str, email: str, image: str) -> Dict:
+        return await ResourceRegistry.get_mongo().create_user(name, email, image)
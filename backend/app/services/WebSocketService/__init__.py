@@ -1,18 +1,116 @@
-from typing import Dict
+import asyncio
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 from fastapi import WebSocket
 
+from app.config import settings
+from app.services.MessageBusService import (
+    BROADCAST_CHANNEL,
+    MessageBusService,
+    node_channel,
+)
+from app.services.OutboxService import OutboxService
 from app.utils.logger import CustomLogger
 
 
+# A frontend socket with a bounded send queue drained by its own writer task, so
+# one slow browser tab never delays delivery to the others
+class FrontendConnection:
+    def __init__(self, client_id: str, websocket: WebSocket):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(
+            maxsize=settings.FRONTEND_SEND_QUEUE_SIZE
+        )
+        self.writer = asyncio.create_task(self._write())
+
+    def enqueue(self, message: dict) -> bool:
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _write(self):
+        while True:
+            message = await self.queue.get()
+            try:
+                await asyncio.wait_for(
+                    self.websocket.send_json(message),
+                    timeout=settings.FRONTEND_SEND_TIMEOUT_SECONDS,
+                )
+            except Exception as e:
+                CustomLogger.create_log(
+                    "error", f"Failed to send message to frontend {self.client_id}: {e}"
+                )
+                WebSocketService._evict_frontend(self.client_id)
+                return
+
+    def close(self):
+        self.writer.cancel()
+
+    def __repr__(self) -> str:
+        return f"FrontendConnection({self.client_id}, queued={self.queue.qsize()})"
+
+
 class WebSocketService:
     _machine_connections: Dict[str, WebSocket] = {}
-    _frontend_connections: Dict[str, WebSocket] = {}
+    _frontend_connections: Dict[str, FrontendConnection] = {}
+
+    # Subscription registry: frontends only receive events for the owners and
+    # machines they subscribed to
+    _machine_owners: Dict[str, str] = {}
+    _machine_tags: Dict[str, Set[str]] = {}
+    _owner_subscribers: Dict[str, Set[str]] = {}
+    _machine_subscribers: Dict[str, Set[str]] = {}
+    _run_subscribers: Dict[str, Set[str]] = {}
+    _client_topics: Dict[str, Set[Tuple[str, str]]] = {}
+
+    # Requests sent to machines that are waiting for a reply, by request id
+    _pending_requests: Dict[str, asyncio.Future] = {}
+    _background_tasks: Set[asyncio.Task] = set()
+
+    # Messages to each machine are numbered per connection and kept until the
+    # machine acks them; unacked ones are handled again if the machine drops
+    _machine_streams: Dict[str, Dict] = {}
+
+    # Last numbered message received from each machine under its resume token,
+    # kept across reconnects so the machine only replays what was missed
+    _machine_sequences: Dict[str, Dict] = {}
 
     @staticmethod
     async def connect_machine(websocket: WebSocket, machine_id: str):
         await websocket.accept()
+        await WebSocketService._requeue_unacked(machine_id)
+        # Marked before the connection is visible, so an execute arriving now
+        # queues behind the outbox instead of overtaking it
+        flushing = OutboxService.begin_flush(machine_id)
         WebSocketService._machine_connections[machine_id] = websocket
+        WebSocketService._machine_streams[machine_id] = {
+            "stream_id": uuid.uuid4().hex,
+            "next_id": 1,
+            "unacked": OrderedDict(),
+            "lock": asyncio.Lock(),
+        }
+
+        # Deliver whatever was queued while the machine was offline
+        if flushing:
+            task = asyncio.create_task(
+                OutboxService.flush(
+                    machine_id,
+                    lambda message: WebSocketService._send_to_local_machine(
+                        machine_id, message
+                    ),
+                )
+            )
+            WebSocketService._background_tasks.add(task)
+            task.add_done_callback(WebSocketService._background_tasks.discard)
+
+        await MessageBusService.get_bus().set_presence(
+            machine_id, MessageBusService.node_id
+        )
         CustomLogger.create_log("info", f"Machine connected: {machine_id}")
         CustomLogger.create_log(
             "debug", f"Machine connections: {WebSocketService._machine_connections}"
@@ -24,7 +122,12 @@ class WebSocketService:
     @staticmethod
     async def connect_frontend(websocket: WebSocket, client_id: str):
         await websocket.accept()
-        WebSocketService._frontend_connections[client_id] = websocket
+        previous = WebSocketService._frontend_connections.get(client_id)
+        if previous is not None:
+            previous.close()
+        WebSocketService._frontend_connections[client_id] = FrontendConnection(
+            client_id, websocket
+        )
         CustomLogger.create_log("info", f"Frontend client connected: {client_id}")
         CustomLogger.create_log(
             "debug", f"Machine connections: {WebSocketService._machine_connections}"
@@ -34,22 +137,36 @@ class WebSocketService:
         )
 
     @staticmethod
-    def disconnect_machine(machine_id: str):
-        if machine_id in WebSocketService._machine_connections:
-            del WebSocketService._machine_connections[machine_id]
-            CustomLogger.create_log("info", f"Machine disconnected: {machine_id}")
-            CustomLogger.create_log(
-                "debug", f"Machine connections: {WebSocketService._machine_connections}"
-            )
-            CustomLogger.create_log(
-                "debug",
-                f"Frontend connections: {WebSocketService._frontend_connections}",
-            )
+    async def disconnect_machine(
+        machine_id: str, websocket: Optional[WebSocket] = None
+    ) -> bool:
+        current = WebSocketService._machine_connections.get(machine_id)
+        # A socket closing after the machine reconnected leaves the new one be
+        if current is None or (websocket is not None and current is not websocket):
+            return False
+
+        del WebSocketService._machine_connections[machine_id]
+        WebSocketService._machine_owners.pop(machine_id, None)
+        WebSocketService._machine_tags.pop(machine_id, None)
+        await WebSocketService._requeue_unacked(machine_id)
+        await MessageBusService.get_bus().remove_presence(
+            machine_id, MessageBusService.node_id
+        )
+        CustomLogger.create_log("info", f"Machine disconnected: {machine_id}")
+        CustomLogger.create_log(
+            "debug", f"Machine connections: {WebSocketService._machine_connections}"
+        )
+        CustomLogger.create_log(
+            "debug",
+            f"Frontend connections: {WebSocketService._frontend_connections}",
+        )
+        return True
 
     @staticmethod
     def disconnect_frontend(client_id: str):
         if client_id in WebSocketService._frontend_connections:
-            del WebSocketService._frontend_connections[client_id]
+            WebSocketService._frontend_connections.pop(client_id).close()
+            WebSocketService.unsubscribe_frontend(client_id)
             CustomLogger.create_log(
                 "info", f"Frontend client disconnected: {client_id}"
             )
@@ -61,40 +178,440 @@ class WebSocketService:
                 f"Frontend connections: {WebSocketService._frontend_connections}",
             )
 
+    @staticmethod
+    def set_machine_owner(machine_id: str, email: str):
+        WebSocketService._machine_owners[machine_id] = email
+
+    @staticmethod
+    def set_machine_tags(machine_id: str, tags: Iterable[str]):
+        WebSocketService._machine_tags[machine_id] = set(tags)
+
+    @staticmethod
+    def find_machines(
+        owner: Optional[str] = None, tag: Optional[str] = None
+    ) -> List[str]:
+        # Only machines connected to this node are known here
+        return [
+            machine_id
+            for machine_id in WebSocketService._machine_connections
+            if (
+                owner is None
+                or WebSocketService._machine_owners.get(machine_id) == owner
+            )
+            and (
+                tag is None or tag in WebSocketService._machine_tags.get(machine_id, ())
+            )
+        ]
+
+    @staticmethod
+    def subscribe_frontend(
+        client_id: str,
+        email: Optional[str] = None,
+        machine_ids: Optional[List[str]] = None,
+        run_ids: Optional[List[str]] = None,
+    ):
+        topics = WebSocketService._client_topics.setdefault(client_id, set())
+        if email:
+            WebSocketService._owner_subscribers.setdefault(email, set()).add(client_id)
+            topics.add(("owner", email))
+        for machine_id in machine_ids or []:
+            WebSocketService._machine_subscribers.setdefault(machine_id, set()).add(
+                client_id
+            )
+            topics.add(("machine", machine_id))
+        for run_id in run_ids or []:
+            WebSocketService._run_subscribers.setdefault(run_id, set()).add(client_id)
+            topics.add(("run", run_id))
+        CustomLogger.create_log(
+            "debug",
+            f"Frontend {client_id} subscribed to owner: {email}, "
+            f"machines: {machine_ids}, runs: {run_ids}",
+        )
+
+    @staticmethod
+    def unsubscribe_frontend(client_id: str):
+        registries = {
+            "owner": WebSocketService._owner_subscribers,
+            "machine": WebSocketService._machine_subscribers,
+            "run": WebSocketService._run_subscribers,
+        }
+        for kind, key in WebSocketService._client_topics.pop(client_id, set()):
+            subscribers = registries[kind].get(key)
+            if subscribers is None:
+                continue
+            subscribers.discard(client_id)
+            if not subscribers:
+                del registries[kind][key]
+
+    @staticmethod
+    async def publish_to_owner(email: str, message: dict):
+        await WebSocketService._publish_frontend_event(email, None, message)
+
+    @staticmethod
+    async def publish_machine_event(
+        machine_id: str, message: dict, owner: Optional[str] = None
+    ):
+        owner = owner or WebSocketService._machine_owners.get(machine_id)
+        await WebSocketService._publish_frontend_event(owner, machine_id, message)
+
+    @staticmethod
+    async def publish_run_event(run_id: str, message: dict):
+        await WebSocketService._publish_frontend_event(
+            None, None, message, run_id=run_id
+        )
+
     @staticmethod
     async def broadcast_to_frontends(message: dict):
         CustomLogger.create_log("debug", f"Broadcasting message: {message}")
         CustomLogger.create_log(
             "debug", f"Frontend connections: {WebSocketService._frontend_connections}"
         )
+        WebSocketService._deliver(
+            list(WebSocketService._frontend_connections.keys()), message
+        )
+        await WebSocketService._publish_to_nodes(
+            {"kind": "broadcast", "message": message}
+        )
 
-        disconnected = []
-        for client_id, connection in WebSocketService._frontend_connections.items():
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                CustomLogger.create_log(
-                    "error", f"Failed to send message to frontend {client_id}: {e}"
+    @staticmethod
+    async def _publish_frontend_event(
+        email: Optional[str],
+        machine_id: Optional[str],
+        message: dict,
+        run_id: Optional[str] = None,
+    ):
+        WebSocketService._deliver_frontend_event(email, machine_id, message, run_id)
+        # Subscribers connected to other nodes get it through the bus
+        await WebSocketService._publish_to_nodes(
+            {
+                "kind": "frontend_event",
+                "email": email,
+                "machine_id": machine_id,
+                "run_id": run_id,
+                "message": message,
+            }
+        )
+
+    @staticmethod
+    def _deliver_frontend_event(
+        email: Optional[str],
+        machine_id: Optional[str],
+        message: dict,
+        run_id: Optional[str] = None,
+    ):
+        subscribers = set()
+        if run_id:
+            subscribers |= WebSocketService._run_subscribers.get(run_id, set())
+        if machine_id:
+            subscribers |= WebSocketService._machine_subscribers.get(machine_id, set())
+        if email:
+            subscribers |= WebSocketService._owner_subscribers.get(email, set())
+        WebSocketService._deliver(subscribers, message)
+
+    @staticmethod
+    async def _publish_to_nodes(payload: dict):
+        payload["origin"] = MessageBusService.node_id
+        try:
+            await MessageBusService.get_bus().publish(BROADCAST_CHANNEL, payload)
+        except Exception as e:
+            CustomLogger.create_log("error", f"Failed to publish to message bus: {e}")
+
+    @staticmethod
+    async def handle_bus_message(payload: dict):
+        kind = payload.get("kind")
+
+        if kind == "to_machine":
+            if not await WebSocketService._send_to_local_machine(
+                payload["machine_id"], payload["message"]
+            ):
+                await WebSocketService._handle_undelivered(
+                    payload["machine_id"], payload["message"]
                 )
-                disconnected.append(client_id)
+            return
 
-        for client_id in disconnected:
-            WebSocketService.disconnect_frontend(client_id)
+        # Broadcast-channel messages were already delivered locally by the sender
+        if payload.get("origin") == MessageBusService.node_id:
+            return
+
+        if kind == "frontend_event":
+            WebSocketService._deliver_frontend_event(
+                payload.get("email"),
+                payload.get("machine_id"),
+                payload["message"],
+                payload.get("run_id"),
+            )
+        elif kind == "to_frontend":
+            if payload["client_id"] in WebSocketService._frontend_connections:
+                await WebSocketService.send_to_frontend(
+                    payload["client_id"], payload["message"]
+                )
+        elif kind == "broadcast":
+            WebSocketService._deliver(
+                list(WebSocketService._frontend_connections.keys()),
+                payload["message"],
+            )
+        elif kind == "machine_response":
+            WebSocketService._resolve_local_request(payload["message"])
+
+    @staticmethod
+    def _deliver(client_ids: Iterable[str], message: dict):
+        # Enqueueing never blocks; each connection's writer task does the sending
+        slow_consumers = []
+        for client_id in client_ids:
+            connection = WebSocketService._frontend_connections.get(client_id)
+            if connection is not None and not connection.enqueue(message):
+                slow_consumers.append(client_id)
+
+        for client_id in slow_consumers:
+            WebSocketService._evict_frontend(client_id)
+
+    @staticmethod
+    async def send_to_frontend(client_id: str, message: dict) -> bool:
+        connection = WebSocketService._frontend_connections.get(client_id)
+        if connection is None:
+            # The frontend may be connected to another node
+            await WebSocketService._publish_to_nodes(
+                {"kind": "to_frontend", "client_id": client_id, "message": message}
+            )
+            return True
+
+        if not connection.enqueue(message):
+            WebSocketService._evict_frontend(client_id)
+            return False
+        return True
+
+    @staticmethod
+    def _evict_frontend(client_id: str):
+        connection = WebSocketService._frontend_connections.get(client_id)
+        if connection is None:
+            return
+
+        CustomLogger.create_log(
+            "warning", f"Evicting unresponsive frontend {client_id}"
+        )
+        WebSocketService.disconnect_frontend(client_id)
+        task = asyncio.create_task(
+            WebSocketService._close_quietly(connection.websocket)
+        )
+        WebSocketService._background_tasks.add(task)
+        task.add_done_callback(WebSocketService._background_tasks.discard)
+
+    @staticmethod
+    async def drop_machine(machine_id: str):
+        websocket = WebSocketService._machine_connections.get(machine_id)
+        if websocket is None:
+            return
+        await WebSocketService.disconnect_machine(machine_id, websocket)
+        # 1001: going away
+        await WebSocketService._close_quietly(websocket, code=1001)
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket, code: int = 1013):
+        try:
+            # 1013 by default: try again later
+            await websocket.close(code=code)
+        except Exception:
+            pass
 
     @staticmethod
     async def send_to_machine(machine_id: str, message: dict) -> bool:
+        # Every execution gets a plan id so the machine can tell a redelivered
+        # plan from a new one
+        if message.get("type") == "execute" and not message.get("plan_id"):
+            message = {**message, "plan_id": uuid.uuid4().hex}
+
+        # Queue behind an outbox that is still draining to keep execute order
+        if message.get("type") == "execute" and OutboxService.is_flushing(machine_id):
+            return await WebSocketService._handle_undelivered(machine_id, message)
+
         if machine_id in WebSocketService._machine_connections:
+            if await WebSocketService._send_to_local_machine(machine_id, message):
+                return True
+            return await WebSocketService._handle_undelivered(machine_id, message)
+
+        # Look up which node holds the machine's socket and route through the bus
+        bus = MessageBusService.get_bus()
+        node_id = await bus.get_presence(machine_id)
+        if node_id and node_id != MessageBusService.node_id:
+            delivered = await bus.publish(
+                node_channel(node_id),
+                {"kind": "to_machine", "machine_id": machine_id, "message": message},
+            )
+            if delivered:
+                return True
+            # Nobody is listening on that node's channel, so the entry is stale
+            await bus.remove_presence(machine_id, node_id)
+
+        CustomLogger.create_log("error", f"Machine {machine_id} not connected")
+        return await WebSocketService._handle_undelivered(machine_id, message)
+
+    @staticmethod
+    def resume_machine(machine_id: str, resume_token: Optional[str]) -> int:
+        sequence = WebSocketService._machine_sequences.get(machine_id)
+        if sequence is None or sequence["token"] != resume_token:
+            # A new client process, or one this node never heard from
+            sequence = {"token": resume_token, "last_seq": 0, "confirmed_seq": 0}
+            WebSocketService._machine_sequences[machine_id] = sequence
+        return sequence["last_seq"]
+
+    @staticmethod
+    def accept_machine_seq(machine_id: str, out_seq: int) -> bool:
+        sequence = WebSocketService._machine_sequences.get(machine_id)
+        if sequence is None:
+            return True
+        if out_seq <= sequence["last_seq"]:
+            return False
+        sequence["last_seq"] = out_seq
+        return True
+
+    @staticmethod
+    async def confirm_machine_seq(
+        machine_id: str, websocket: WebSocket, due: bool = False
+    ):
+        # Lets the machine drop handled messages from its replay buffer, so a
+        # restarted server that lost last_seq only gets the recent ones again
+        sequence = WebSocketService._machine_sequences.get(machine_id)
+        if sequence is None or sequence["last_seq"] <= sequence["confirmed_seq"]:
+            return
+        pending = sequence["last_seq"] - sequence["confirmed_seq"]
+        if not due and pending < settings.MACHINE_SEQ_CONFIRM_INTERVAL:
+            return
+        sequence["confirmed_seq"] = sequence["last_seq"]
+        await WebSocketService._write_to_machine(
+            machine_id, websocket, {"type": "seq_ack", "out_seq": sequence["last_seq"]}
+        )
+
+    @staticmethod
+    def ack_machine(machine_id: str, msg_id: int):
+        # Messages arrive in order, so an ack covers everything before it too
+        stream = WebSocketService._machine_streams.get(machine_id)
+        if stream is None:
+            return
+        unacked = stream["unacked"]
+        while unacked and next(iter(unacked)) <= msg_id:
+            unacked.popitem(last=False)
+
+    @staticmethod
+    def _track_unacked(stream: Dict, message: dict):
+        unacked = stream["unacked"]
+        unacked[message["msg_id"]] = message
+        if len(unacked) > settings.MACHINE_RETRANSMIT_WINDOW:
+            msg_id, _ = unacked.popitem(last=False)
+            CustomLogger.create_log(
+                "warning", f"Retransmit window full, dropping message {msg_id}"
+            )
+
+    @staticmethod
+    async def _requeue_unacked(machine_id: str):
+        stream = WebSocketService._machine_streams.pop(machine_id, None)
+        if not stream or not stream["unacked"]:
+            return
+
+        CustomLogger.create_log(
+            "warning",
+            f"Machine {machine_id} left {len(stream['unacked'])} message(s) "
+            "unacknowledged, requeueing",
+        )
+        for message in stream["unacked"].values():
+            message = {
+                key: value
+                for key, value in message.items()
+                if key not in ("msg_id", "stream_id")
+            }
+            await WebSocketService._handle_undelivered(machine_id, message)
+
+    @staticmethod
+    async def _handle_undelivered(machine_id: str, message: dict) -> bool:
+        # Executions wait in the outbox for the machine to come back, and
+        # cancelling one that never left the outbox just removes it
+        if message.get("type") == "execute":
             try:
-                await WebSocketService._machine_connections[machine_id].send_json(
-                    message
-                )
+                await OutboxService.enqueue(machine_id, message)
                 return True
-            except Exception as e:
-                CustomLogger.create_log(
-                    "error", f"Failed to send message to machine {machine_id}. {e}"
-                )
-                WebSocketService.disconnect_machine(machine_id)
+            except ValueError as e:
+                CustomLogger.create_log("error", str(e))
                 return False
-        else:
+        if message.get("type") == "cancel" and message.get("plan_id"):
+            return await OutboxService.discard(machine_id, message["plan_id"]) > 0
+        return False
+
+    @staticmethod
+    async def _send_to_local_machine(machine_id: str, message: dict) -> bool:
+        websocket = WebSocketService._machine_connections.get(machine_id)
+        if websocket is None:
             CustomLogger.create_log("error", f"Machine {machine_id} not connected")
+            return False
+
+        stream = WebSocketService._machine_streams.get(machine_id)
+        if stream is None:
+            if await WebSocketService._write_to_machine(machine_id, websocket, message):
+                return True
+        else:
+            # Numbered and written one at a time, so the machine sees msg_ids
+            # in order and never takes a new message for a duplicate
+            async with stream["lock"]:
+                message = {
+                    **message,
+                    "msg_id": stream["next_id"],
+                    "stream_id": stream["stream_id"],
+                }
+                stream["next_id"] += 1
+                if await WebSocketService._write_to_machine(
+                    machine_id, websocket, message
+                ):
+                    WebSocketService._track_unacked(stream, message)
+                    return True
+
+        await WebSocketService.disconnect_machine(machine_id, websocket)
         return False
+
+    @staticmethod
+    async def _write_to_machine(
+        machine_id: str, websocket: WebSocket, message: dict
+    ) -> bool:
+        try:
+            await websocket.send_json(message)
+            return True
+        except Exception as e:
+            CustomLogger.create_log(
+                "error", f"Failed to send message to machine {machine_id}. {e}"
+            )
+            return False
+
+    @staticmethod
+    async def request_machine(
+        machine_id: str, message: dict, timeout: Optional[float] = None
+    ) -> dict:
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        WebSocketService._pending_requests[request_id] = future
+
+        try:
+            if not await WebSocketService.send_to_machine(
+                machine_id, {**message, "request_id": request_id}
+            ):
+                raise ValueError(f"Machine {machine_id} not connected")
+            return await asyncio.wait_for(
+                future, timeout or settings.MACHINE_REQUEST_TIMEOUT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            raise ValueError(f"Machine {machine_id} did not respond in time")
+        finally:
+            WebSocketService._pending_requests.pop(request_id, None)
+
+    @staticmethod
+    async def resolve_request(message: dict):
+        if WebSocketService._resolve_local_request(message):
+            return
+        # The request may have been made on the node serving the HTTP call
+        await WebSocketService._publish_to_nodes(
+            {"kind": "machine_response", "message": message}
+        )
+
+    @staticmethod
+    def _resolve_local_request(message: dict) -> bool:
+        future = WebSocketService._pending_requests.get(message.get("request_id"))
+        if future is None or future.done():
+            return False
+        future.set_result(message)
+        return True
@@ -2,17 +2,17 @@ import json
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
-from app.database.mongo import MongoDBHandler
+from app.database.registry import ResourceRegistry
 from app.services.WebSocketService import WebSocketService
 from app.utils.logger import CustomLogger
 
 router = APIRouter()
-db = MongoDBHandler()
 
 
 @router.websocket("/{client_id}")
 async def frontend_websocket_endpoint(websocket: WebSocket, client_id: str):
     await WebSocketService.connect_frontend(websocket, client_id)
+    db = ResourceRegistry.get_mongo()
 
     try:
         while True:
@@ -24,16 +24,31 @@ async def frontend_websocket_endpoint(websocket: WebSocket, client_id: str):
                 )
 
                 # If the frontend requests for machines, send the list of machines
+                # and subscribe the frontend to that owner's machine events
                 if message.get("type") == "get_machines":
                     email = message.get("email")
-                    machines = db.get_machines(email)
-                    await websocket.send_json(
-                        {"type": "machines_list", "data": machines}
+                    machines = await db.get_machines(email)
+                    WebSocketService.subscribe_frontend(client_id, email=email)
+                    await WebSocketService.send_to_frontend(
+                        client_id, {"type": "machines_list", "data": machines}
                     )
 
+                # Subscribe to events of an owner's machines, specific machines
+                # and/or fleet runs
+                elif message.get("type") == "subscribe":
+                    WebSocketService.subscribe_frontend(
+                        client_id,
+                        email=message.get("email"),
+                        machine_ids=message.get("machine_ids"),
+                        run_ids=message.get("run_ids"),
+                    )
+
+                elif message.get("type") == "unsubscribe":
+                    WebSocketService.unsubscribe_frontend(client_id)
+
             except json.JSONDecodeError:
-                await websocket.send_json(
-                    {"type": "error", "message": "Invalid JSON format"}
+                await WebSocketService.send_to_frontend(
+                    client_id, {"type": "error", "message": "Invalid JSON format"}
                 )
 
     except WebSocketDisconnect:
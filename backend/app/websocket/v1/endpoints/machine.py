@@ -2,17 +2,36 @@ import json
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
-from app.database.mongo import MongoDBHandler
+from app.database.registry import ResourceRegistry
+from app.services.PresenceService import PresenceService
 from app.services.WebSocketService import WebSocketService
 from app.utils.logger import CustomLogger
 
 router = APIRouter()
-db = MongoDBHandler()
+
+COMMAND_RESULT_FIELDS = [
+    "category_id",
+    "command_id",
+    "command",
+    "started_at",
+    "ended_at",
+    "duration_ms",
+    "status",
+    "success",
+    "bytes_out",
+    "output",
+    "output_id",
+    "output_sha256",
+    "output_truncated",
+    "plan_id",
+    "stop_reason",
+]
 
 
 @router.websocket("/{machine_id}")
 async def machine_websocket_endpoint(websocket: WebSocket, machine_id: str):
     await WebSocketService.connect_machine(websocket, machine_id)
+    db = ResourceRegistry.get_mongo()
 
     try:
         while True:
@@ -20,50 +39,162 @@ async def machine_websocket_endpoint(websocket: WebSocket, machine_id: str):
             try:
                 message = json.loads(data)
                 CustomLogger.create_log(
-                    "info", f"Received message from machine: {message}"
+                    "debug",
+                    f"Received {message.get('type')} message from machine: "
+                    f"{machine_id}",
                 )
+                # Any message proves the machine is alive, not just heartbeats
+                PresenceService.heartbeat(machine_id)
+
+                # Replayed after a reconnect but already handled
+                out_seq = message.get("out_seq")
+                if out_seq is not None and not WebSocketService.accept_machine_seq(
+                    machine_id, out_seq
+                ):
+                    continue
+
+                if out_seq is not None:
+                    await WebSocketService.confirm_machine_seq(machine_id, websocket)
+
+                if message.get("type") == "heartbeat":
+                    await WebSocketService.confirm_machine_seq(
+                        machine_id, websocket, due=True
+                    )
+                    continue
+
+                # The machine received every message up to msg_id
+                elif message.get("type") == "ack":
+                    WebSocketService.ack_machine(machine_id, message.get("msg_id", 0))
 
                 # If a device connects to the websocket, add the device to DB if not there already and then tell the frontend about the device
-                if message.get("type") == "device_connected":
+                elif message.get("type") == "device_connected":
                     email = message.get("email")
                     machine_name = message.get("machine_name")
-                    result = db.add_machine(email, machine_name)
-                    await WebSocketService.broadcast_to_frontends(
-                        {"type": "device_connected", "data": result["machines"]}
+                    result = await db.add_machine(email, machine_name)
+                    WebSocketService.set_machine_owner(machine_id, email)
+                    WebSocketService.set_machine_tags(
+                        machine_id, message.get("tags") or []
+                    )
+                    await PresenceService.machine_online(
+                        machine_id, email, machine_name
+                    )
+                    # Tell the machine where to resume its buffered output from
+                    await WebSocketService.send_to_machine(
+                        machine_id,
+                        {
+                            "type": "resume",
+                            "last_seq": WebSocketService.resume_machine(
+                                machine_id, message.get("resume_token")
+                            ),
+                        },
+                    )
+                    await WebSocketService.publish_to_owner(
+                        email, {"type": "device_connected", "data": result["machines"]}
                     )
 
                 # If a device is disconnected, change the status of the device in the DB and tell the frontend about the disconnection
                 elif message.get("type") == "device_disconnected":
                     email = message.get("email")
                     machine_name = message.get("machine_name")
-                    result = db.update_machine_status(
+                    result = await db.update_machine_status(
                         email, machine_name, "disconnected"
                     )
-                    await WebSocketService.broadcast_to_frontends(
+                    await PresenceService.machine_offline(
+                        machine_id, reason="device_disconnected"
+                    )
+                    await WebSocketService.publish_to_owner(
+                        email,
                         {
                             "type": "device_disconnected",
                             "data": result["machines"],
-                        }
+                        },
+                    )
+
+                # Relay a batch of streamed command output to the frontend
+                elif message.get("type") == "command_output":
+                    await WebSocketService.publish_machine_event(
+                        machine_id,
+                        {
+                            "type": "command_output",
+                            "machine_id": machine_id,
+                            "command": message.get("command"),
+                            "output": message.get("output"),
+                            "seq": message.get("seq"),
+                            "category_id": message.get("category_id"),
+                            "command_id": message.get("command_id"),
+                        },
                     )
 
-                # Log command output
+                # Relay the execution record of a single command in the plan
+                elif message.get("type") == "command_result":
+                    CustomLogger.create_log(
+                        "info",
+                        f"Command {message.get('command_id')} on {machine_id} exited "
+                        f"with {message.get('status')} in {message.get('duration_ms')}ms",
+                    )
+                    await WebSocketService.publish_machine_event(
+                        machine_id,
+                        {
+                            "type": "command_result",
+                            "machine_id": machine_id,
+                            **{key: message.get(key) for key in COMMAND_RESULT_FIELDS},
+                        },
+                    )
+
+                # The completion only carries a summary and the output tail; the
+                # full output stays on the machine and is fetched on demand
                 elif message.get("type") == "command_complete":
                     command = message.get("command")
-                    output = message.get("output")
+                    outputs = message.get("outputs") or []
                     CustomLogger.create_log(
                         "info",
-                        f"Command output from {machine_id}: {command} -> {output}",
+                        f"Command completed on {machine_id}: {command} -> "
+                        f"status {message.get('status')}, "
+                        f"{message.get('bytes_out')} bytes of output",
                     )
                     # Send command output to frontend
-                    await WebSocketService.broadcast_to_frontends(
+                    await WebSocketService.publish_machine_event(
+                        machine_id,
                         {
                             "type": "command_complete",
                             "machine_id": machine_id,
                             "command": command,
-                            "output": output,
-                        }
+                            "output": message.get("output"),
+                            "status": message.get("status"),
+                            "success": message.get("success"),
+                            "category_id": message.get("category_id"),
+                            "plan_id": message.get("plan_id"),
+                            "stop_reason": message.get("stop_reason"),
+                            "bytes_out": message.get("bytes_out"),
+                            "outputs": outputs,
+                        },
                     )
 
+                # The whole plan finished; fleet runs wait on this reply
+                elif message.get("type") == "plan_complete":
+                    CustomLogger.create_log(
+                        "info",
+                        f"Plan {message.get('plan_id')} on {machine_id} finished, "
+                        f"success: {message.get('success')}",
+                    )
+                    await WebSocketService.publish_machine_event(
+                        machine_id,
+                        {
+                            "type": "plan_complete",
+                            "machine_id": machine_id,
+                            "plan_id": message.get("plan_id"),
+                            "success": message.get("success"),
+                            "stop_reason": message.get("stop_reason"),
+                            "error": message.get("error"),
+                        },
+                    )
+                    if message.get("request_id"):
+                        await WebSocketService.resolve_request(message)
+
+                # Reply to a fetch_output request made through the API
+                elif message.get("type") == "output_data":
+                    await WebSocketService.resolve_request(message)
+
                 # Log command error
                 elif message.get("type") == "command_error":
                     command = message.get("command")
@@ -72,13 +203,15 @@ async def machine_websocket_endpoint(websocket: WebSocket, machine_id: str):
                         "error",
                         f"Command error from {machine_id}: {command} -> {error}",
                     )
-                    await WebSocketService.broadcast_to_frontends(
+                    await WebSocketService.publish_machine_event(
+                        machine_id,
                         {
                             "type": "command_error",
                             "machine_id": machine_id,
                             "command": command,
                             "error": error,
-                        }
+                            "plan_id": message.get("plan_id"),
+                        },
                     )
 
             except json.JSONDecodeError:
@@ -90,8 +223,10 @@ async def machine_websocket_endpoint(websocket: WebSocket, machine_id: str):
                 await websocket.send_json({"type": "error", "message": str(e)})
 
     except WebSocketDisconnect:
-        WebSocketService.disconnect_machine(machine_id)
+        if await WebSocketService.disconnect_machine(machine_id, websocket):
+            PresenceService.machine_left(machine_id)
         CustomLogger.create_log("info", f"Machine {machine_id} disconnected")
     except Exception as e:
         CustomLogger.create_log("error", f"Unexpected error: {e}")
-        WebSocketService.disconnect_machine(machine_id)
+        if await WebSocketService.disconnect_machine(machine_id, websocket):
+            PresenceService.machine_left(machine_id)
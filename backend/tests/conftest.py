@@ -0,0 +1,71 @@
+import asyncio
+import os
+
+import pytest
+
+# Settings are read at import time; tests never reach these services
+for name, value in {
+    "MONGO_URI": "mongodb://localhost:27017",
+    "AWS_ACCESS_KEY_ID": "test",
+    "AWS_SECRET_ACCESS_KEY": "test",
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "S3_BUCKET_NAME": "test",
+    "OPENAI_API_KEY": "test",
+}.items():
+    os.environ.setdefault(name, value)
+
+from app.database.registry import ResourceRegistry  # noqa: E402
+from app.services.FleetService import FleetService  # noqa: E402
+from app.services.IntentCacheService import IntentCacheService  # noqa: E402
+from app.services.MessageBusService import (  # noqa: E402
+    InMemoryMessageBus,
+    MessageBusService,
+)
+from app.services.OutboxService import OutboxService  # noqa: E402
+from app.services.PresenceService import PresenceService  # noqa: E402
+from app.services.WebSocketService import WebSocketService  # noqa: E402
+from fakes import FakeMongo  # noqa: E402
+
+SERVICE_STATE = {
+    WebSocketService: [
+        "_machine_connections",
+        "_frontend_connections",
+        "_machine_owners",
+        "_machine_tags",
+        "_owner_subscribers",
+        "_machine_subscribers",
+        "_run_subscribers",
+        "_client_topics",
+        "_pending_requests",
+        "_background_tasks",
+        "_machine_streams",
+        "_machine_sequences",
+    ],
+    OutboxService: ["_entries", "_flushing"],
+    PresenceService: ["_machines", "_slots", "_departed"],
+    FleetService: ["_runs", "_tasks"],
+    IntentCacheService: ["_entries"],
+}
+
+
+@pytest.fixture(autouse=True)
+def services():
+    # Services keep their state at class level, so every test starts clean
+    for service, names in SERVICE_STATE.items():
+        for name in names:
+            getattr(service, name).clear()
+    PresenceService._wheel = []
+    PresenceService._cursor = 0
+    InMemoryMessageBus._handlers.clear()
+    InMemoryMessageBus._presence.clear()
+    InMemoryMessageBus._tasks.clear()
+
+    bus = InMemoryMessageBus()
+    asyncio.run(
+        bus.start(MessageBusService.node_id, WebSocketService.handle_bus_message)
+    )
+    MessageBusService._bus = bus
+    ResourceRegistry._mongo = FakeMongo()
+    yield ResourceRegistry._mongo
+    MessageBusService._bus = None
+    ResourceRegistry._mongo = None
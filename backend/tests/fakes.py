@@ -0,0 +1,231 @@
+import asyncio
+import math
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from fastapi import WebSocketDisconnect
+
+CLOSE = object()
+
+
+def percentile(samples: List[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(len(ordered) * p / 100) - 1, 0)]
+
+
+class FakeWebSocket:
+    """Stands in for a Starlette WebSocket: incoming frames are fed through
+    receive(), outgoing JSON is recorded in sent"""
+
+    def __init__(self, send_delay: float = 0.0):
+        self.sent: List[Dict] = []
+        self.closed = False
+        self.send_delay = send_delay
+        self._incoming: asyncio.Queue = asyncio.Queue()
+        self._waiters: List = []
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message: Dict):
+        if self.closed:
+            raise RuntimeError("WebSocket is closed")
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+        self.sent.append(message)
+        for waiter in list(self._waiters):
+            predicate, future = waiter
+            if predicate(message) and not future.done():
+                future.set_result(message)
+                self._waiters.remove(waiter)
+
+    async def receive_text(self) -> str:
+        item = await self._incoming.get()
+        if item is CLOSE:
+            self.closed = True
+            raise WebSocketDisconnect(1000)
+        return item
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+        self._incoming.put_nowait(CLOSE)
+
+    def receive(self, text: str):
+        self._incoming.put_nowait(text)
+
+    def disconnect(self):
+        self._incoming.put_nowait(CLOSE)
+
+    def wait_for(self, predicate) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        for message in self.sent:
+            if predicate(message):
+                future.set_result(message)
+                return future
+        self._waiters.append((predicate, future))
+        return future
+
+    def of_type(self, message_type: str) -> List[Dict]:
+        return [m for m in self.sent if m.get("type") == message_type]
+
+
+class FakeResult:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class FakeCursor:
+    def __init__(self, documents: List[Dict], latency: float):
+        self._documents = documents
+        self._latency = latency
+
+    def sort(self, *args, **kwargs):
+        return self
+
+    def limit(self, count: int):
+        self._documents = self._documents[:count]
+        return self
+
+    async def to_list(self, length: Optional[int] = None):
+        await asyncio.sleep(self._latency)
+        return list(self._documents)
+
+
+class FakeCollection:
+    """The slice of a Motor collection that MongoDBHandler uses for machine
+    connects, answering after a fixed network latency"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    async def find_one_and_update(self, query, update, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return {"machines": [{"_id": ObjectId(), "name": query["email"]}]}
+
+    def find(self, *args, **kwargs):
+        return FakeCursor([], self.latency)
+
+    async def delete_many(self, query):
+        await asyncio.sleep(self.latency)
+        return FakeResult(deleted_count=0)
+
+
+class FakeMotorDatabase:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        collection = FakeCollection(self.latency)
+        setattr(self, name, collection)
+        return collection
+
+
+class FakeMotorClient:
+    def __init__(self, latency: float = 0.0):
+        self.device_management = FakeMotorDatabase(latency)
+
+
+class FakeMongo:
+    """In-memory stand-in for MongoDBHandler covering what the services use"""
+
+    def __init__(self):
+        self.outbox: Dict[ObjectId, Dict] = {}
+        self.fleet_runs: Dict[str, Dict] = {}
+        self.intent_cache: Dict[str, Dict] = {}
+        self.disconnected: List = []
+        self.fail_outbox_writes = False
+
+    async def add_machine(self, email: str, machine_name: str) -> Dict:
+        return {"machines": [{"name": machine_name, "status": "connected"}]}
+
+    async def update_machine_status(
+        self, email: str, machine_name: str, status: str
+    ) -> Dict:
+        return {"machines": [{"name": machine_name, "status": status}]}
+
+    async def mark_machines_disconnected(self, machines) -> None:
+        self.disconnected.extend(machines)
+
+    async def get_cached_plan(self, intent_key: str) -> Optional[Dict]:
+        return self.intent_cache.get(intent_key)
+
+    async def cache_plan(self, intent_key: str, plan: Dict, expires_at) -> None:
+        self.intent_cache[intent_key] = plan
+
+    async def save_fleet_run(self, run: Dict) -> None:
+        self.fleet_runs[run["run_id"]] = run
+
+    async def get_fleet_run(self, run_id: str) -> Optional[Dict]:
+        return self.fleet_runs.get(run_id)
+
+    async def add_outbox_message(self, entry: Dict) -> None:
+        if self.fail_outbox_writes:
+            raise ConnectionError("Mongo is unavailable")
+        self.outbox[entry["_id"]] = entry
+
+    async def count_outbox_messages(self, machine_id: str) -> int:
+        return len(await self.get_outbox_messages(machine_id))
+
+    async def get_outbox_messages(self, machine_id: str) -> List[Dict]:
+        return [
+            entry
+            for _, entry in sorted(self.outbox.items())
+            if entry["machine_id"] == machine_id
+        ]
+
+    async def delete_outbox_messages(self, entry_ids) -> None:
+        for entry_id in entry_ids:
+            self.outbox.pop(entry_id, None)
+
+    async def delete_outbox_plan(self, machine_id: str, plan_id: str) -> int:
+        matching = [
+            entry_id
+            for entry_id, entry in self.outbox.items()
+            if entry["machine_id"] == machine_id
+            and entry["message"].get("plan_id") == plan_id
+        ]
+        for entry_id in matching:
+            del self.outbox[entry_id]
+        return len(matching)
+
+
+class FakeOpenAI:
+    """Answers chat completions like AsyncOpenAI: a streamed report yields one
+    token per interval, and the description either answers or raises"""
+
+    def __init__(
+        self,
+        tokens: int = 50,
+        token_interval: float = 0.01,
+        description_error: Optional[Exception] = None,
+    ):
+        self.tokens = tokens
+        self.token_interval = token_interval
+        self.description_error = description_error
+        self.streamed = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, stream=False, **kwargs):
+        if stream:
+            return self._stream()
+        await asyncio.sleep(self.token_interval * 3)
+        if self.description_error is not None:
+            raise self.description_error
+        return self._completion("All good")
+
+    async def _stream(self):
+        for i in range(self.tokens):
+            await asyncio.sleep(self.token_interval)
+            self.streamed += 1
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=f"t{i} "))]
+            )
+
+    @staticmethod
+    def _completion(content: str):
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))]
+        )
@@ -0,0 +1,67 @@
+import asyncio
+import json
+import time
+
+from app.database.mongo import MongoDBHandler
+from app.database.registry import ResourceRegistry
+from app.websocket.v1.endpoints.machine import machine_websocket_endpoint
+from fakes import FakeMongo, FakeMotorClient, FakeWebSocket, percentile
+
+MACHINES = 200
+DB_LATENCY = 0.005
+
+
+class BlockingMongo(FakeMongo):
+    # What the handler did before: a synchronous pymongo round trip that
+    # holds the event loop for the whole network latency
+    async def add_machine(self, email: str, machine_name: str):
+        time.sleep(DB_LATENCY)
+        return await super().add_machine(email, machine_name)
+
+
+async def connect_storm(db) -> list:
+    ResourceRegistry._mongo = db
+    sockets = [FakeWebSocket() for _ in range(MACHINES)]
+
+    async def connect(i: int, websocket: FakeWebSocket) -> float:
+        started = time.perf_counter()
+        websocket.receive(
+            json.dumps(
+                {
+                    "type": "device_connected",
+                    "email": f"owner{i}@example.com",
+                    "machine_name": f"machine-{i}",
+                }
+            )
+        )
+        # Connected once the server tells the machine where to resume from
+        await websocket.wait_for(lambda m: m.get("type") == "resume")
+        return time.perf_counter() - started
+
+    endpoints = [
+        asyncio.create_task(machine_websocket_endpoint(websocket, f"machine-{i}"))
+        for i, websocket in enumerate(sockets)
+    ]
+    latencies = await asyncio.gather(
+        *(connect(i, websocket) for i, websocket in enumerate(sockets))
+    )
+    for websocket in sockets:
+        websocket.disconnect()
+    await asyncio.gather(*endpoints)
+    return latencies
+
+
+def test_connect_storm_latency_before_and_after():
+    before = asyncio.run(connect_storm(BlockingMongo()))
+    after = asyncio.run(connect_storm(MongoDBHandler(FakeMotorClient(DB_LATENCY))))
+
+    print(
+        f"\n{MACHINES} machines, {DB_LATENCY * 1000:.0f}ms per Mongo round trip\n"
+        f"  blocking pymongo: p50 {percentile(before, 50) * 1000:.1f}ms, "
+        f"p99 {percentile(before, 99) * 1000:.1f}ms\n"
+        f"  async motor:      p50 {percentile(after, 50) * 1000:.1f}ms, "
+        f"p99 {percentile(after, 99) * 1000:.1f}ms"
+    )
+    # Blocking calls serialize the storm; awaited ones overlap
+    assert percentile(before, 99) >= MACHINES * DB_LATENCY * 0.9
+    assert percentile(after, 99) < percentile(before, 99) / 5
@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+from app.config import settings
+from app.services.WebSocketService import WebSocketService
+from fakes import FakeWebSocket, percentile
+
+FRONTENDS = 1000
+SLOW_FRONTENDS = 5
+SLOW_SEND_SECONDS = 0.1
+EVENTS = 5
+EVENT_INTERVAL = 0.05
+
+
+class TimedWebSocket(FakeWebSocket):
+    def __init__(self, send_delay: float = 0.0):
+        super().__init__(send_delay)
+        self.received_at = {}
+
+    async def send_json(self, message):
+        await super().send_json(message)
+        self.received_at[message["seq"]] = time.perf_counter()
+
+
+class SlowClosingWebSocket(FakeWebSocket):
+    async def close(self, code: int = 1000):
+        await asyncio.sleep(0.2)
+        await super().close(code)
+
+
+async def sequential_broadcast(sockets, message):
+    # What broadcast_to_frontends did before: one awaited send per socket
+    for websocket in sockets:
+        await websocket.send_json(message)
+
+
+async def fan_out(broadcast) -> list:
+    sockets = [
+        TimedWebSocket(SLOW_SEND_SECONDS if i < SLOW_FRONTENDS else 0.0)
+        for i in range(FRONTENDS)
+    ]
+    for i, websocket in enumerate(sockets):
+        await WebSocketService.connect_frontend(websocket, f"frontend-{i}")
+        WebSocketService.subscribe_frontend(f"frontend-{i}", email="owner@example.com")
+
+    published_at = {}
+    for seq in range(EVENTS):
+        published_at[seq] = time.perf_counter()
+        await broadcast(sockets, {"type": "command_output", "seq": seq})
+        await asyncio.sleep(EVENT_INTERVAL)
+
+    healthy = sockets[SLOW_FRONTENDS:]
+    deadline = time.perf_counter() + 10
+    while (
+        any(len(websocket.received_at) < EVENTS for websocket in healthy)
+        and time.perf_counter() < deadline
+    ):
+        await asyncio.sleep(0.01)
+
+    for i in range(FRONTENDS):
+        WebSocketService.disconnect_frontend(f"frontend-{i}")
+
+    # The slow tabs lag by design; what matters is everyone else
+    return [
+        websocket.received_at[seq] - published_at[seq]
+        for websocket in healthy
+        for seq in range(EVENTS)
+    ]
+
+
+def test_fan_out_p99_latency_with_1000_frontends():
+    async def queued(sockets, message):
+        await WebSocketService.publish_to_owner("owner@example.com", message)
+
+    before = asyncio.run(fan_out(sequential_broadcast))
+    after = asyncio.run(fan_out(queued))
+
+    print(
+        f"\n{FRONTENDS} frontends, {SLOW_FRONTENDS} taking "
+        f"{SLOW_SEND_SECONDS * 1000:.0f}ms per send, {EVENTS} events\n"
+        f"  sequential sends:  p50 {percentile(before, 50) * 1000:.1f}ms, "
+        f"p99 {percentile(before, 99) * 1000:.1f}ms\n"
+        f"  per-client queues: p50 {percentile(after, 50) * 1000:.1f}ms, "
+        f"p99 {percentile(after, 99) * 1000:.1f}ms"
+    )
+    # Sequential sends make every healthy tab wait behind the slow ones
+    assert percentile(before, 99) >= SLOW_FRONTENDS * SLOW_SEND_SECONDS
+    # Per-client queues leave at most scheduling noise, never the slow tabs' sends
+    assert percentile(after, 99) < SLOW_FRONTENDS * SLOW_SEND_SECONDS / 2
+
+
+def test_stalled_frontend_is_evicted_without_holding_back_others():
+    async def run():
+        stalled, healthy = SlowClosingWebSocket(send_delay=60), FakeWebSocket()
+        for client_id, websocket in [("stalled", stalled), ("healthy", healthy)]:
+            await WebSocketService.connect_frontend(websocket, client_id)
+            WebSocketService.subscribe_frontend(client_id, email="owner@example.com")
+
+        for seq in range(settings.FRONTEND_SEND_QUEUE_SIZE + 10):
+            await WebSocketService.publish_to_owner(
+                "owner@example.com", {"type": "command_output", "seq": seq}
+            )
+            # Events arrive from other sockets, giving writers a turn between them
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.05)
+
+        connected = set(WebSocketService._frontend_connections)
+        # The eviction's close is tracked until it finishes
+        closing = set(WebSocketService._background_tasks)
+        await asyncio.gather(*closing)
+        WebSocketService.disconnect_frontend("healthy")
+        return connected, len(healthy.sent), closing, stalled.closed
+
+    connected, delivered, closing, closed = asyncio.run(run())
+    assert connected == {"healthy"}
+    assert closing and closed
+    assert delivered == settings.FRONTEND_SEND_QUEUE_SIZE + 10
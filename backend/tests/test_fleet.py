@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from fastapi import Response
+
+from app.api.v1.endpoints import fleet
+from app.config import settings
+from app.services.FleetService import FleetService
+from app.services.WebSocketService import WebSocketService
+from fakes import FakeWebSocket
+
+PLAN = {"categories": [{"id": "category-1", "commands": [{"command": "true"}]}]}
+
+
+def test_cancel_stops_waiting_on_machines_that_never_reply(monkeypatch, services):
+    monkeypatch.setattr(settings, "MACHINE_REQUEST_TIMEOUT_SECONDS", 0.2)
+
+    async def run():
+        machines = {name: FakeWebSocket() for name in ["m1", "m2"]}
+        for machine_id, websocket in machines.items():
+            await WebSocketService.connect_machine(websocket, machine_id)
+
+        dispatched = await FleetService.dispatch(
+            PLAN, {"machine_ids": list(machines)}, parallelism=2
+        )
+        run_id = dispatched["run_id"]
+        executes = {
+            machine_id: await asyncio.wait_for(
+                websocket.wait_for(lambda m: m["type"] == "execute"), timeout=1
+            )
+            for machine_id, websocket in machines.items()
+        }
+
+        await FleetService.cancel_run(run_id)
+        # m1 confirms the cancel; m2 went away and never answers
+        await WebSocketService.resolve_request(
+            {
+                "request_id": executes["m1"]["request_id"],
+                "success": False,
+                "stop_reason": "cancelled",
+            }
+        )
+        task = FleetService._tasks[run_id]
+        await asyncio.wait_for(task, timeout=2)
+        return run_id, machines
+
+    run_id, machines = asyncio.run(run())
+
+    saved = services.fleet_runs[run_id]
+    assert saved["status"] == "cancelled"
+    assert {m: s["status"] for m, s in saved["machines"].items()} == {
+        "m1": "cancelled",
+        "m2": "cancelled",
+    }
+    assert not FleetService._runs
+    assert not WebSocketService._pending_requests
+    for websocket in machines.values():
+        assert len(websocket.of_type("cancel")) == 1
+
+
+class FakeRequest:
+    def __init__(self, body):
+        self.body = body
+
+    async def json(self):
+        return self.body
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        ["m1"],
+        "m1",
+        {"execution_plan": PLAN, "targets": ["m1"]},
+        {"execution_plan": PLAN, "targets": "m1"},
+        {"execution_plan": PLAN, "targets": {"machine_ids": "m1"}},
+        {"execution_plan": PLAN, "targets": {"machine_ids": [1, 2]}},
+        {"execution_plan": "categories", "targets": {"machine_ids": ["m1"]}},
+        {"execution_plan": PLAN, "targets": {"machine_ids": ["m1"]}, "canary": [1]},
+        {"execution_plan": PLAN, "targets": {"machine_ids": ["m1"]}, "wave_size": "x"},
+    ],
+)
+def test_dispatch_rejects_malformed_bodies(services, body):
+    res = Response()
+    result = asyncio.run(fleet.dispatch_plan(FakeRequest(body), res))
+
+    assert res.status_code == 400
+    assert result.status is False
+    assert not FleetService._runs
+
+
+def test_owner_and_tag_targets_are_rejected_with_multiple_nodes(monkeypatch, services):
+    monkeypatch.setattr(settings, "MESSAGE_BUS_BACKEND", "redis")
+
+    async def run():
+        await WebSocketService.connect_machine(FakeWebSocket(), "m1")
+        res = Response()
+        result = await fleet.dispatch_plan(
+            FakeRequest({"execution_plan": PLAN, "targets": {"owner": "a@b.c"}}), res
+        )
+        return res, result
+
+    res, result = asyncio.run(run())
+
+    assert res.status_code == 400
+    assert "machine_ids" in result.message
+    assert not FleetService._runs
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from app.services.IntentCacheService import IntentCacheService
+
+PLAN = {"execution_plan": {"categories": []}}
+
+
+@pytest.mark.parametrize(
+    "intent, other",
+    [
+        ("delete everything in ~/tmp", "delete everything in /tmp"),
+        ("show size of /", "show size of ~"),
+        ("list files with ls -la", "list files with ls la"),
+        ("open ./config.yaml", "open config yaml"),
+        ("перезапусти nginx", "restart nginx"),
+        ("delete /home/me/Backup", "delete /home/me/backup"),
+        ("rm -R dir", "rm -r dir"),
+        ("show file a*b", "show file a b"),
+        ("list files > out.txt", "list files out.txt"),
+        ("count lines | sort", "count lines sort"),
+        ("print $HOME", "print HOME"),
+        ("echo 'a;b'", "echo a b"),
+        ("find file?.log", "find file.log"),
+    ],
+)
+def test_intents_with_different_targets_get_different_keys(intent, other):
+    assert IntentCacheService.normalize(intent) != IntentCacheService.normalize(other)
+
+
+@pytest.mark.parametrize(
+    "intent, other",
+    [
+        ("Update   packages", "Update packages"),
+        ("  update packages\n", "update packages"),
+        ("update packages.", "update packages"),
+        ("open config.yaml.", "open config.yaml"),
+    ],
+)
+def test_equivalent_intents_share_a_key(intent, other):
+    assert IntentCacheService.normalize(intent) == IntentCacheService.normalize(other)
+
+
+def test_non_latin_intents_are_cached_separately():
+    async def run():
+        await IntentCacheService.set("重启服务器", PLAN)
+        return await IntentCacheService.get("检查磁盘")
+
+    assert IntentCacheService.normalize("重启服务器") == "重启服务器"
+    assert asyncio.run(run()) is None
+
+
+def test_empty_keys_are_never_cached(services):
+    async def run():
+        await IntentCacheService.set("   ", PLAN)
+        return await IntentCacheService.get("\n\t")
+
+    assert asyncio.run(run()) is None
+    assert not IntentCacheService._entries
+    assert not services.intent_cache
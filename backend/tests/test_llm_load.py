@@ -0,0 +1,173 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from openai import AsyncOpenAI, OpenAI
+
+from app.database.registry import ResourceRegistry
+from app.services.AIService import AIService
+from app.services.WebSocketService import WebSocketService
+from app.websocket.v1.endpoints.machine import machine_websocket_endpoint
+from fakes import FakeWebSocket, percentile
+
+GENERATION_SECONDS = 0.5
+CONCURRENT_REQUESTS = 8
+OUTPUT_INTERVAL = 0.02
+
+PLAN = {
+    "metadata": {"id": "op-1", "title": "Disk usage", "description": "Show usage"},
+    "execution_plan": {
+        "categories": [
+            {
+                "id": "category-1",
+                "name": "Disk",
+                "order": 1,
+                "commands": [{"id": "cmd-1", "command": "df -h", "order": 1}],
+            }
+        ]
+    },
+}
+
+
+class StubCompletionHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        # The model takes its time, like a real completion
+        time.sleep(GENERATION_SECONDS)
+        body = json.dumps(
+            {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "gpt-4o-mini",
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": json.dumps(PLAN)},
+                        "finish_reason": "stop",
+                    }
+                ],
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def llm_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubCompletionHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+class BlockingAIService(AIService):
+    # What generate_commands did before: the synchronous client called
+    # straight from the request handler
+    def __init__(self, base_url: str):
+        self.client = OpenAI(api_key="test", base_url=base_url, max_retries=0)
+
+    async def generate_commands(self, user_intent: str):
+        response = self.client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": user_intent}],
+        )
+        return json.loads(response.choices[0].message.content)
+
+
+async def relay_latencies_during(generate) -> list:
+    """Streams command_output from a machine to a subscribed frontend while
+    the generation requests run, and returns how long each frame took"""
+    frontend = FakeWebSocket()
+    received = {}
+    send_json = frontend.send_json
+
+    async def record(message):
+        received[message.get("output")] = time.perf_counter()
+        await send_json(message)
+
+    frontend.send_json = record
+    await WebSocketService.connect_frontend(frontend, "dashboard")
+    WebSocketService.subscribe_frontend("dashboard", machine_ids=["machine-1"])
+
+    machine = FakeWebSocket()
+    endpoint = asyncio.create_task(machine_websocket_endpoint(machine, "machine-1"))
+    generation = asyncio.ensure_future(generate())
+
+    sent = {}
+    seq = 0
+    while not generation.done():
+        seq += 1
+        sent[str(seq)] = time.perf_counter()
+        machine.receive(
+            json.dumps({"type": "command_output", "output": str(seq), "seq": seq})
+        )
+        await asyncio.sleep(OUTPUT_INTERVAL)
+    await generation
+
+    deadline = time.perf_counter() + 5
+    while len(received) < len(sent) and time.perf_counter() < deadline:
+        await asyncio.sleep(OUTPUT_INTERVAL)
+    machine.disconnect()
+    await endpoint
+    WebSocketService.disconnect_frontend("dashboard")
+
+    return [received[key] - sent[key] for key in sent]
+
+
+def test_websocket_traffic_stays_responsive_during_generation(llm_url):
+    async def run_async():
+        ResourceRegistry._openai_client = AsyncOpenAI(
+            api_key="test", base_url=llm_url, max_retries=0
+        )
+        try:
+            started = time.perf_counter()
+            latencies = await relay_latencies_during(
+                lambda: asyncio.gather(
+                    *(
+                        AIService().generate_commands(f"check disk usage {i}")
+                        for i in range(CONCURRENT_REQUESTS)
+                    )
+                )
+            )
+            return latencies, time.perf_counter() - started
+        finally:
+            await ResourceRegistry._openai_client.close()
+            ResourceRegistry._openai_client = None
+
+    async def run_blocking():
+        service = BlockingAIService(llm_url)
+
+        async def generate():
+            for i in range(CONCURRENT_REQUESTS):
+                await service.generate_commands(f"check disk usage {i}")
+
+        return await relay_latencies_during(generate)
+
+    after, elapsed = asyncio.run(run_async())
+    before = asyncio.run(run_blocking())
+
+    print(
+        f"\n{CONCURRENT_REQUESTS} generations of {GENERATION_SECONDS}s each, "
+        f"machine output every {OUTPUT_INTERVAL * 1000:.0f}ms\n"
+        f"  sync client:  relay p50 {percentile(before, 50) * 1000:.1f}ms, "
+        f"p99 {percentile(before, 99) * 1000:.1f}ms\n"
+        f"  async client: relay p50 {percentile(after, 50) * 1000:.1f}ms, "
+        f"p99 {percentile(after, 99) * 1000:.1f}ms, "
+        f"all generations done in {elapsed:.2f}s"
+    )
+    # The shared async client runs the completions side by side
+    assert elapsed < CONCURRENT_REQUESTS * GENERATION_SECONDS / 2
+    assert percentile(after, 99) < GENERATION_SECONDS / 4
+    assert percentile(before, 99) >= GENERATION_SECONDS * 0.9
@@ -0,0 +1,125 @@
+import asyncio
+import json
+
+from app.config import settings
+from app.services.OutboxService import OutboxService
+from app.services.PresenceService import PresenceService
+from app.services.WebSocketService import WebSocketService
+from app.websocket.v1.endpoints.machine import machine_websocket_endpoint
+from fakes import FakeWebSocket
+
+
+class UnevenWebSocket(FakeWebSocket):
+    """Earlier sends take longer, so unordered writes would finish reversed"""
+
+    def __init__(self, delays):
+        super().__init__()
+        self._delays = list(delays)
+
+    async def send_json(self, message):
+        await asyncio.sleep(self._delays.pop(0) if self._delays else 0)
+        await super().send_json(message)
+
+
+def test_concurrent_sends_get_unique_ordered_msg_ids():
+    async def run():
+        for plan_id in ("queued-1", "queued-2", "queued-3"):
+            await OutboxService.enqueue(
+                "machine-1", {"type": "execute", "plan_id": plan_id}
+            )
+
+        websocket = UnevenWebSocket([0.04, 0.03, 0.02, 0.01])
+        await WebSocketService.connect_machine(websocket, "machine-1")
+        # The resume goes out while the outbox is still flushing
+        await WebSocketService.send_to_machine("machine-1", {"type": "resume"})
+        await asyncio.gather(*WebSocketService._background_tasks)
+        return websocket.sent, WebSocketService._machine_streams["machine-1"]
+
+    sent, stream = asyncio.run(run())
+    assert [message["msg_id"] for message in sent] == [1, 2, 3, 4]
+    assert sorted(m.get("plan_id", m["type"]) for m in sent) == [
+        "queued-1",
+        "queued-2",
+        "queued-3",
+        "resume",
+    ]
+    assert list(stream["unacked"]) == [1, 2, 3, 4]
+    assert stream["next_id"] == 5
+
+
+def test_stale_socket_closing_after_reconnect_keeps_the_live_one():
+    async def run():
+        async def connect(websocket: FakeWebSocket) -> asyncio.Task:
+            endpoint = asyncio.create_task(
+                machine_websocket_endpoint(websocket, "machine-1")
+            )
+            websocket.receive(
+                json.dumps(
+                    {
+                        "type": "device_connected",
+                        "email": "owner@example.com",
+                        "machine_name": "machine-1",
+                    }
+                )
+            )
+            await websocket.wait_for(lambda m: m.get("type") == "resume")
+            return endpoint
+
+        old, live = FakeWebSocket(), FakeWebSocket()
+        old_endpoint = await connect(old)
+        live_endpoint = await connect(live)
+        await WebSocketService.send_to_machine(
+            "machine-1", {"type": "execute", "plan_id": "plan-1"}
+        )
+
+        # The dead socket's disconnect only shows up now
+        old.disconnect()
+        await old_endpoint
+        state = (
+            WebSocketService._machine_connections.get("machine-1"),
+            list(WebSocketService._machine_streams["machine-1"]["unacked"]),
+            "machine-1" in PresenceService._machines,
+            "machine-1" in PresenceService._departed,
+        )
+        live.disconnect()
+        await live_endpoint
+        return live, state
+
+    live, (connection, unacked, tracked, departed) = asyncio.run(run())
+    assert connection is live
+    assert unacked == [1, 2]
+    assert tracked and not departed
+
+
+def test_received_machine_messages_are_confirmed(monkeypatch):
+    monkeypatch.setattr(settings, "MACHINE_SEQ_CONFIRM_INTERVAL", 4)
+
+    async def run():
+        websocket = FakeWebSocket()
+        endpoint = asyncio.create_task(
+            machine_websocket_endpoint(websocket, "machine-1")
+        )
+        websocket.receive(
+            json.dumps(
+                {
+                    "type": "device_connected",
+                    "email": "owner@example.com",
+                    "machine_name": "machine-1",
+                    "resume_token": "token-1",
+                }
+            )
+        )
+        for out_seq in range(1, 7):
+            websocket.receive(
+                json.dumps({"type": "command_output", "output": "", "out_seq": out_seq})
+            )
+        # The heartbeat confirms what is left below the interval
+        websocket.receive(json.dumps({"type": "heartbeat"}))
+        await websocket.wait_for(
+            lambda m: m.get("type") == "seq_ack" and m["out_seq"] == 6
+        )
+        websocket.disconnect()
+        await endpoint
+        return websocket.of_type("seq_ack")
+
+    assert [m["out_seq"] for m in asyncio.run(run())] == [4, 6]
@@ -0,0 +1,104 @@
+import asyncio
+import json
+
+import pytest
+
+from app.services.MessageBusService import (
+    InMemoryMessageBus,
+    MessageBus,
+    RedisMessageBus,
+)
+
+
+class FakePubSub:
+    def __init__(self, items, fail: bool):
+        self.items = items
+        self.fail = fail
+        self.channels = ()
+        self.closed = False
+
+    async def subscribe(self, *channels):
+        self.channels = channels
+
+    async def listen(self):
+        for item in self.items:
+            yield {"data": json.dumps(item)}
+        if self.fail:
+            raise ConnectionError("Connection closed by server")
+        await asyncio.Event().wait()
+
+    async def aclose(self):
+        self.closed = True
+
+
+class FakeRedis:
+    def __init__(self):
+        self.subscriptions = []
+
+    def pubsub(self, ignore_subscribe_messages: bool = False):
+        # The first subscription loses its connection after one message
+        first = not self.subscriptions
+        pubsub = FakePubSub([{"n": len(self.subscriptions)}], fail=first)
+        self.subscriptions.append(pubsub)
+        return pubsub
+
+    async def aclose(self):
+        pass
+
+
+def test_message_bus_requires_every_method():
+    class PartialBus(MessageBus):
+        async def publish(self, channel: str, message: dict) -> int:
+            return 0
+
+    with pytest.raises(TypeError):
+        PartialBus()
+
+
+def test_redis_listener_resubscribes_after_connection_loss(monkeypatch):
+    monkeypatch.setattr(RedisMessageBus, "RECONNECT_MIN_DELAY", 0.01)
+    bus = RedisMessageBus.__new__(RedisMessageBus)
+    bus._redis = FakeRedis()
+    bus._pubsub = None
+    bus._listener = None
+
+    async def run():
+        received = []
+
+        async def handler(message):
+            received.append(message)
+
+        await bus.start("node-1", handler)
+        while len(received) < 2:
+            await asyncio.sleep(0.01)
+        await bus.stop()
+        return received
+
+    received = asyncio.run(asyncio.wait_for(run(), timeout=5))
+    assert received == [{"n": 0}, {"n": 1}]
+    first, second = bus._redis.subscriptions
+    assert first.closed
+    assert second.channels == ("sticktator:node:node-1", "sticktator:broadcast")
+
+
+def test_in_memory_publish_keeps_handler_tasks_until_done():
+    async def run():
+        bus = InMemoryMessageBus()
+        done = asyncio.Event()
+
+        async def handler(message):
+            await done.wait()
+
+        await bus.start("node-2", handler)
+        delivered = await bus.publish("broadcast", {"kind": "broadcast", "message": {}})
+        pending = len(InMemoryMessageBus._tasks)
+        done.set()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        await bus.stop()
+        return delivered, pending, len(InMemoryMessageBus._tasks)
+
+    # The broadcast channel also reaches the node started by the fixture
+    delivered, pending, remaining = asyncio.run(run())
+    assert pending == delivered == 2
+    assert remaining == 0
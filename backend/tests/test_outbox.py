@@ -0,0 +1,71 @@
+import asyncio
+
+from app.services.MessageBusService import MessageBusService
+from app.services.OutboxService import OutboxService
+from app.services.WebSocketService import WebSocketService
+from fakes import FakeWebSocket
+
+
+def execute(plan_id: str) -> dict:
+    return {"type": "execute", "plan_id": plan_id, "categories": []}
+
+
+def test_stored_entries_are_not_held_in_memory(services):
+    async def run():
+        await OutboxService.enqueue("machine-1", execute("stored"))
+        services.fail_outbox_writes = True
+        await OutboxService.enqueue("machine-1", execute("held"))
+        return {
+            entry["message"]["plan_id"]
+            for entry in OutboxService._entries.get("machine-1", {}).values()
+        }
+
+    held = asyncio.run(run())
+    assert held == {"held"}
+    assert [e["message"]["plan_id"] for e in services.outbox.values()] == ["stored"]
+
+
+def test_entry_flushed_by_another_node_is_not_delivered_again(services):
+    async def run():
+        await OutboxService.enqueue("machine-1", execute("plan-1"))
+        # The machine came back on another node, which delivered and deleted it
+        services.outbox.clear()
+
+        websocket = FakeWebSocket()
+        await WebSocketService.connect_machine(websocket, "machine-1")
+        await asyncio.gather(*WebSocketService._background_tasks)
+        return websocket.of_type("execute")
+
+    assert asyncio.run(run()) == []
+
+
+def test_execute_sent_while_connecting_waits_for_the_outbox(services):
+    async def run():
+        for plan_id in ("queued-1", "queued-2"):
+            await OutboxService.enqueue("machine-1", execute(plan_id))
+        services.fail_outbox_writes = True
+        await OutboxService.enqueue("machine-1", execute("queued-3"))
+        services.fail_outbox_writes = False
+
+        bus = MessageBusService.get_bus()
+        set_presence = bus.set_presence
+
+        async def slow_set_presence(machine_id, node_id):
+            await asyncio.sleep(0.05)
+            await set_presence(machine_id, node_id)
+
+        bus.set_presence = slow_set_presence
+        websocket = FakeWebSocket(send_delay=0.01)
+        connecting = asyncio.create_task(
+            WebSocketService.connect_machine(websocket, "machine-1")
+        )
+        while "machine-1" not in WebSocketService._machine_connections:
+            await asyncio.sleep(0)
+        await WebSocketService.send_to_machine("machine-1", execute("new"))
+        await connecting
+        await asyncio.gather(*WebSocketService._background_tasks)
+        return [message["plan_id"] for message in websocket.of_type("execute")]
+
+    assert asyncio.run(run()) == ["queued-1", "queued-2", "queued-3", "new"]
+    assert services.outbox == {}
+    assert OutboxService._entries == {}
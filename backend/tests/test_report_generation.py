@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from app.database.registry import ResourceRegistry
+from app.services.AIService import AIService
+from fakes import FakeOpenAI
+
+RESULT = {"machine_id": "m1", "command": "df -h", "output": ["ok"], "type": "cmd"}
+
+
+def test_failed_description_stops_the_report_stream(monkeypatch):
+    client = FakeOpenAI(description_error=ConnectionError("model overloaded"))
+    monkeypatch.setattr(ResourceRegistry, "_openai_client", client)
+    tokens = []
+
+    async def on_token(token: str):
+        tokens.append(token)
+
+    async def run():
+        with pytest.raises(Exception, match="model overloaded"):
+            await AIService().generate_report(RESULT, on_token=on_token)
+        received = len(tokens)
+        # Long enough for several more tokens if the stream were still running
+        await asyncio.sleep(client.token_interval * 10)
+        return received
+
+    received = asyncio.run(run())
+    assert len(tokens) == received
+    assert client.streamed < client.tokens
+
+
+def test_report_and_description_both_complete(monkeypatch):
+    client = FakeOpenAI(tokens=5)
+    monkeypatch.setattr(ResourceRegistry, "_openai_client", client)
+    tokens = []
+
+    async def on_token(token: str):
+        tokens.append(token)
+
+    report, description = asyncio.run(
+        AIService().generate_report(RESULT, on_token=on_token)
+    )
+    assert report == "".join(tokens) == "t0 t1 t2 t3 t4 "
+    assert description == "All good"
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+from fastapi import Response
+
+from app.api.v1.endpoints import report
+from app.database.registry import ResourceRegistry
+from app.services.WebSocketService import WebSocketService
+from fakes import FakeOpenAI, FakeWebSocket
+
+RESULT = {"machine_id": "m1", "command": "df -h", "output": ["ok"], "type": "cmd"}
+
+
+class FakeRequest:
+    async def json(self):
+        return RESULT
+
+
+class FailingS3:
+    def upload_report(self, email: str, content: str):
+        raise ConnectionError("S3 is unavailable")
+
+
+class StreamingAIService:
+    def __init__(self, fail_after_tokens: bool = False):
+        self.fail_after_tokens = fail_after_tokens
+
+    async def generate_report(self, data, on_token=None):
+        for token in ["# Report", "\n\nAll good"]:
+            await on_token(token)
+        if self.fail_after_tokens:
+            raise RuntimeError("stream closed by the model")
+        return "# Report\n\nAll good", "All good"
+
+
+def stream_report(monkeypatch, ai_service, s3=None) -> FakeWebSocket:
+    monkeypatch.setattr(report, "AIService", lambda: ai_service)
+    monkeypatch.setattr(ResourceRegistry, "_s3", s3)
+    frontend = FakeWebSocket()
+
+    async def run():
+        await WebSocketService.connect_frontend(frontend, "dashboard")
+        try:
+            with pytest.raises(Exception):
+                await report.generate_report(
+                    FakeRequest(), Response(), "owner", "machine-1", "dashboard"
+                )
+            # Let the connection's writer task drain its queue
+            await asyncio.sleep(0.01)
+        finally:
+            WebSocketService.disconnect_frontend("dashboard")
+
+    asyncio.run(run())
+    return frontend
+
+
+@pytest.mark.parametrize(
+    "ai_service, s3",
+    [
+        (StreamingAIService(fail_after_tokens=True), None),
+        (StreamingAIService(), FailingS3()),
+    ],
+)
+def test_failed_stream_or_upload_sends_report_error(monkeypatch, ai_service, s3):
+    frontend = stream_report(monkeypatch, ai_service, s3)
+
+    types = [message["type"] for message in frontend.sent]
+    assert types == ["report_chunk", "report_chunk", "report_error"]
+    assert frontend.sent[-1]["machine_name"] == "machine-1"
+
+
+def test_no_chunk_follows_report_error_when_description_fails(monkeypatch):
+    client = FakeOpenAI(description_error=ConnectionError("model overloaded"))
+    monkeypatch.setattr(ResourceRegistry, "_openai_client", client)
+    frontend = FakeWebSocket()
+
+    async def run():
+        await WebSocketService.connect_frontend(frontend, "dashboard")
+        try:
+            with pytest.raises(Exception, match="model overloaded"):
+                await report.generate_report(
+                    FakeRequest(), Response(), "owner", "machine-1", "dashboard"
+                )
+            # Time for the rest of the stream, had it kept running
+            await asyncio.sleep(client.token_interval * 10)
+        finally:
+            WebSocketService.disconnect_frontend("dashboard")
+
+    asyncio.run(run())
+    types = [message["type"] for message in frontend.sent]
+    assert "report_chunk" in types
+    assert types[-1] == "report_error"
+    assert types.count("report_error") == 1
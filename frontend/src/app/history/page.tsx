@@ -3,6 +3,7 @@
 import { FC, useState, useEffect } from "react";
 import { useSession } from "next-auth/react";
 import { Sidebar, Loader, AllReports } from "@/components";
+import { Button } from "@/components/ui/button";
 import { ApiHelper } from "@/lib";
 
 interface ReportData {
@@ -13,10 +14,9 @@ interface ReportData {
     description: string;
 }
 
-interface ApiResponse {
-    status: boolean;
-    message: string;
-    data: ReportData;
+interface ReportsPage {
+    reports: ReportData[];
+    next_cursor: string | null;
 }
 
 const History: FC = () => {
@@ -24,16 +24,31 @@ const History: FC = () => {
 
     const api = new ApiHelper();
 
-    const [data, setData] = useState<ReportData | null>(null);
+    const [data, setData] = useState<ReportData[]>([]);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
     const [loading, setLoading] = useState<boolean>(true);
+    const [loadingMore, setLoadingMore] = useState<boolean>(false);
+
+    // The API returns reports a page at a time, newest first
+    const fetchPage = async (cursor: string | null) => {
+        const query = cursor ? `?after=${encodeURIComponent(cursor)}` : "";
+        const response = await api.get<ReportsPage>(`report/reports/aryankhurana2324${query}`);
+        if (response.status && response.data) {
+            const page = response.data;
+            setData((reports) => (cursor ? [...reports, ...page.reports] : page.reports));
+            setNextCursor(page.next_cursor);
+        }
+    };
+
+    const loadMore = async () => {
+        setLoadingMore(true);
+        await fetchPage(nextCursor);
+        setLoadingMore(false);
+    };
 
     useEffect(() => {
         const fetchData = async () => {
-            const response = await api.get<ApiResponse>("report/reports/aryankhurana2324");
-            if (response.status) {
-                // @ts-expect-error: data is not null
-                setData(response.data);
-            }
+            await fetchPage(null);
             setLoading(false);
         };
 
@@ -63,8 +78,18 @@ const History: FC = () => {
                                 for the commands that you have ran on your devices.
                             </p>
                         </div>
-                        {/* @ts-expect-error: data is not null */}
                         <AllReports reports={data} />
+                        {nextCursor && (
+                            <div className="flex justify-center mt-8">
+                                <Button
+                                    onClick={loadMore}
+                                    disabled={loadingMore}
+                                    className="bg-gradient-to-r from-custom-purple to-custom-pink text-white transition-all duration-300 hover:from-purple-600 hover:to-indigo-700"
+                                >
+                                    {loadingMore ? "Loading..." : "Load More"}
+                                </Button>
+                            </div>
+                        )}
                     </div>
                 </div>
             )}
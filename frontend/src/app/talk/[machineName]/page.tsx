@@ -86,6 +86,15 @@ const VoiceInterface: FC = () => {
             `ws://${process.env.NEXT_PUBLIC_BACKEND_URL}/ws/v1/frontend/aryankhurana2324@gmail.com`
         );
 
+        socketRef.current.onopen = () => {
+            socketRef.current?.send(
+                JSON.stringify({
+                    type: "subscribe",
+                    machine_ids: ["aryankhurana2324"],
+                })
+            );
+        };
+
         socketRef.current.onmessage = (event) => {
             const message = event.data;
             console.log(message);
@@ -165,11 +174,31 @@ const VoiceInterface: FC = () => {
         try {
             const api = new ApiHelper();
 
-            // get the first index of messages an convert to json and send it
-            const firstMessage = JSON.parse(messages[0]);
+            // Build the report from the completed commands; the log also holds
+            // streamed command_output chunks and per-command results
+            const completed = messages
+                .map((message) => {
+                    try {
+                        return JSON.parse(message);
+                    } catch {
+                        return null;
+                    }
+                })
+                .filter((message) => message?.type === "command_complete");
+
+            if (completed.length === 0) {
+                console.error("No completed command to create a report from");
+                return;
+            }
+
+            const executionResult = {
+                ...completed[0],
+                command: completed.map((message) => message.command).join("\n"),
+                output: completed.map((message) => message.output).join("\n"),
+            };
             const response = await api.post(
                 `report/generate-report/aryankhurana2324/${params.machineName}`,
-                firstMessage
+                executionResult
             );
 
             if (response.status) {
@@ -8,6 +8,10 @@ export const MessageDisplay = ({ message }) => {
     const data = typeof message === "string" ? JSON.parse(message) : message;
 
     const getMessageStyle = (type) => {
+        // A rejected or failed plan reads as an error, not as finished output
+        if (type === "plan_complete") {
+            type = data.success ? "command_output" : "command_error";
+        }
         switch (type) {
             case "device_connected":
                 return {
@@ -84,6 +88,20 @@ export const MessageDisplay = ({ message }) => {
                     </div>
                 );
 
+            case "plan_complete":
+                return (
+                    <div className="space-y-1">
+                        <p className="font-medium text-white">
+                            {data.success ? "Plan Complete" : "Plan Failed"}
+                        </p>
+                        {!data.success && (data.error || data.stop_reason) && (
+                            <p className="text-red-400 text-sm">
+                                {data.error || data.stop_reason}
+                            </p>
+                        )}
+                    </div>
+                );
+
             default:
                 return <pre className="text-gray-400 text-sm">{JSON.stringify(data, null, 2)}</pre>;
         }